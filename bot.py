@@ -12,9 +12,15 @@ import discord
 import asyncio
 
 from libs import dataloader, savetome, loader
-from libs import command, plugin, addon
+from libs import command, plugin, addon, dispatch, journal, registry, msgcache, discovery, profiler, metrics, loopmonitor, outbound, scheduler, workerpool
 from libs import reaction as reactioncommand
 import importlib
+import concurrent.futures
+import configparser
+import functools
+import time
+import os
+import sys
 # import traceback
 # from os import listdir
 from os import listdir
@@ -25,13 +31,27 @@ DEFAULT = 'DEFAULT'
 CHANNEL_LOC = 'channelsloc'
 MSG_BACKUP_LOCATION = 'msgbackuploc'
 WATCH_MSG_LOCATION = 'alwayswatchmsgloc'
+MSG_JOURNAL_LOCATION = 'msgjournalloc'
+WATCH_JOURNAL_LOCATION = 'watchjournalloc'
 ROLE_MSG_LOCATION = 'rolemessagesloc'
 LOADING_WARNING = "Things are loading"
 ADMINS = ["106537989684887552", "255041793417019393"]
+DEFAULT_MAX_CONCURRENT_ACTIONS = 16
+DEFAULT_MESSAGE_SAVE_PERIOD = 60  # seconds
+DEFAULT_MESSAGE_SAVE_THRESHOLD = 500  # messages
+DEFAULT_REHYDRATE_CONCURRENCY = 8  # channels
+DEFAULT_ADDON_LOAD_THREADS = 4
+LAZY_FROM_CACHE = 2  # lazyaddons level which also lazily loads add-ons found in the discovery cache
+HISTORY_LIMIT = 100  # max messages per history request, as set by Discord
+ACTION_TIMEOUT = 'actiontimeout'  # also read from add-ons' config files, to override the bot's
+DEFAULT_QUARANTINE_TIMEOUTS = 3  # consecutive timeouts
+DEFAULT_QUARANTINE_PERIOD = 600  # seconds
 
 COMMANDS = 'commands'
 REACTIONS = 'reactions'
 PLUGINS = 'plugins'
+ADDON_TYPES = {addon.COMMAND: COMMANDS, addon.REACTION: REACTIONS, addon.PLUGIN: PLUGINS}  # maps add-on kinds to registries
+ADDON_KINDS = {ADDON_TYPES[kind]: kind for kind in ADDON_TYPES}
 
 # saved stuff
 # in the event of a crash, the data stored here can be used instead of loading
@@ -54,8 +74,40 @@ class Bot(discord.Client):
     CHANNEL_LOC = 'channelsloc'
     MSG_BACKUP_LOCATION = 'msgbackuploc'
     WATCH_MSG_LOCATION = 'alwayswatchmsgloc'
+    MSG_JOURNAL_LOCATION = MSG_JOURNAL_LOCATION
+    WATCH_JOURNAL_LOCATION = WATCH_JOURNAL_LOCATION
     ROLE_MSG_LOCATION = 'rolemessagesloc'
     MAX_MESSAGES = 'maxmessages'
+    MAX_MESSAGE_BYTES = 'maxmessagebytes'
+    CONCURRENT_ACTIONS = 'concurrentactions'
+    LAZY_ADDONS = 'lazyaddons'
+    MAX_CONCURRENT_ACTIONS = 'maxconcurrentactions'
+    MESSAGE_SAVE_PERIOD = 'messagesaveperiod'
+    MESSAGE_SAVE_THRESHOLD = 'messagesavethreshold'
+    REHYDRATE_CONCURRENCY = 'rehydrateconcurrency'
+    ADDON_LOAD_THREADS = 'addonloadthreads'
+    ADDON_CACHE_LOCATION = 'addoncacheloc'
+    ADDON_RELOAD_PERIOD = 'addonreloadperiod'
+    STARTUP_PROFILE = 'startupprofile'
+    STARTUP_PROFILE_LOCATION = 'startupprofileloc'
+    METRICS_LOCATION = 'metricsloc'
+    METRICS_SAVE_PERIOD = 'metricssaveperiod'
+    LOOP_MONITOR_INTERVAL = 'loopmonitorinterval'
+    LOOP_MONITOR_THRESHOLD = 'loopmonitorthreshold'
+    ACTION_TIMEOUT = ACTION_TIMEOUT
+    QUARANTINE_TIMEOUTS = 'quarantinetimeouts'
+    QUARANTINE_PERIOD = 'quarantineperiod'
+    OUTBOUND_SCHEDULER = 'outboundscheduler'
+    CHANNEL_RATE = 'channelrate'
+    CHANNEL_BURST = 'channelburst'
+    GLOBAL_RATE = 'globalrate'
+    EDIT_INTERVAL = 'editinterval'
+    PLUGIN_SCHEDULER = 'pluginscheduler'
+    PLUGIN_JITTER = 'pluginjitter'
+    MAX_CONCURRENT_PLUGINS = 'maxconcurrentplugins'
+    MISSED_PLUGIN_RUNS = 'missedpluginruns'
+    PLUGIN_WORKERS = 'pluginworkers'
+    PLUGIN_IO_THREADS = 'pluginiothreads'
 
     COMMANDS = COMMANDS
     REACTIONS = REACTIONS
@@ -63,15 +115,17 @@ class Bot(discord.Client):
 
     ADMINS = ADMINS
 
-    commands = OrderedDict()  # maps names to commands
-    reactions = OrderedDict()  # maps names to reaction commands
-    plugins = OrderedDict()  # maps names to plugins
+    commands = registry.AddOnRegistry()  # maps names to commands
+    reactions = registry.AddOnRegistry()  # maps names to reaction commands
+    plugins = registry.AddOnRegistry()  # maps names to plugins
     packages = dict()
+    package_index = {COMMANDS: dict(), REACTIONS: dict(), PLUGINS: dict()}  # maps add-on names to package names
 
-    def __init__(self, config, log):
+    def __init__(self, config, log, startup_profile=None):
         '''(str, Logger, fun) -> Bot
         config: a string which is the loaction of the base config file
         log: a Logger for dumping info
+        startup_profile: overrides startupprofile in the config file (eg for tests)
         checks: a function which checks reddit/forum/twitter for new stuff'''
         if not config:
             # TODO: raise some kind of exception
@@ -85,9 +139,101 @@ class Bot(discord.Client):
         super().__init__(max_messages=max_messages)
         self.log = log
         self.data = dict()
-        self.always_watch_messages = {LOADING_WARNING}
+        self.command_index = None  # built on the first message after commands change
+        self.command_index_version = None
+        self.reaction_add_index = None  # built on the first reaction after reaction commands change
+        self.reaction_remove_index = None
+        self.reaction_index_version = None
+        # run matched commands' actions as concurrent tasks instead of one after another
+        self.concurrent_actions = int(self.data_config.get(self.CONCURRENT_ACTIONS, 0)) != 0
+        # cancel actions which take longer than actiontimeout seconds (0 for no limit),
+        # and stop dispatching to add-ons which time out quarantinetimeouts times in a row for quarantineperiod seconds
+        self.action_timeout = float(self.data_config.get(self.ACTION_TIMEOUT, 0)) or None
+        self.quarantine_timeouts = int(self.data_config.get(self.QUARANTINE_TIMEOUTS, DEFAULT_QUARANTINE_TIMEOUTS))
+        self.quarantine_period = float(self.data_config.get(self.QUARANTINE_PERIOD, DEFAULT_QUARANTINE_PERIOD))
+        self.action_timeouts = dict()  # add-on name -> actiontimeout from the add-on's config file, if it has one
+        self.consecutive_timeouts = dict()  # (addon type, name) -> timeouts in a row
+        self.quarantined = dict()  # (addon type, name) -> time when the add-on is released from quarantine
+        self.action_semaphore = asyncio.Semaphore(int(self.data_config.get(self.MAX_CONCURRENT_ACTIONS, DEFAULT_MAX_CONCURRENT_ACTIONS)))
+        # watched messages are pinned in the message cache as soon as they're added
+        self.always_watch_messages = msgcache.WatchSet({LOADING_WARNING}, on_add=self._on_watch_add, on_remove=self._on_watch_remove)
         self.role_messages = savetome.load_role_messages(self.data_config[ROLE_MSG_LOCATION], self.get_all_emojis)
+        # a byte budget for the message cache also makes it evict the least recently used messages first
+        self.max_message_bytes = int(self.data_config.get(self.MAX_MESSAGE_BYTES, 0)) or None
+        self.install_message_cache()
+        # import add-ons described in a package manifest only once they're needed
+        self.lazy_addons = int(self.data_config.get(self.LAZY_ADDONS, 0))
+        # import and initialize add-on packages in this many threads at once (1 to load one at a time)
+        self.addon_load_threads = int(self.data_config.get(self.ADDON_LOAD_THREADS, DEFAULT_ADDON_LOAD_THREADS))
+        # remembers what's in add-on folders and files, so unchanged ones don't need to be searched or imported to find out
+        self.addon_cache = discovery.DiscoveryCache(self.data_config.get(self.ADDON_CACHE_LOCATION))
+        self.addon_cache.load()
+        # record what loading each add-on costs (1 for times and files, 2 to also trace memory)
+        if startup_profile is None:
+            startup_profile = int(self.data_config.get(self.STARTUP_PROFILE, 0))
+        self.startup_profiler = profiler.StartupProfiler(enabled=startup_profile > 0, trace_memory=startup_profile > 1)
+        # reload add-ons whose files change, checking every addonreloadperiod seconds (0 to never check)
+        self.addon_reload_period = float(self.data_config.get(self.ADDON_RELOAD_PERIOD, 0))
+        self.addon_reload_failures = dict()  # path -> (mtime, size) of add-on files which failed to reload
+        self.plugin_tasks = dict()  # maps plugin names to the tasks running their _action()
+        # latency and throughput of every command and reaction command, dumped to metricsloc every metricssaveperiod seconds
+        self.metrics = metrics.MetricsRegistry()
+        # queue add-ons' API calls so they stay within Discord's rate limits
+        if int(self.data_config.get(self.OUTBOUND_SCHEDULER, 0)):
+            global_rate = float(self.data_config.get(self.GLOBAL_RATE, outbound.DEFAULT_GLOBAL_RATE))
+            self.outbound = outbound.OutboundScheduler(self.loop, global_rate=global_rate, global_burst=global_rate,
+                channel_rate=float(self.data_config.get(self.CHANNEL_RATE, outbound.DEFAULT_CHANNEL_RATE)),
+                channel_burst=float(self.data_config.get(self.CHANNEL_BURST, outbound.DEFAULT_CHANNEL_BURST)))
+        else:
+            self.outbound = None
+        self.edit_interval = float(self.data_config.get(self.EDIT_INTERVAL, 0))
+        # run plugins' periodic actions from one scheduler, instead of a loop per plugin
+        if int(self.data_config.get(self.PLUGIN_SCHEDULER, 0)):
+            self.plugin_scheduler = scheduler.PluginScheduler(self.loop,
+                jitter=float(self.data_config.get(self.PLUGIN_JITTER, 0)),
+                max_concurrent=int(self.data_config.get(self.MAX_CONCURRENT_PLUGINS, 0)) or None,
+                policy=self.data_config.get(self.MISSED_PLUGIN_RUNS, scheduler.COALESCE))
+        else:
+            self.plugin_scheduler = None
+        # worker processes shared by ThreadedPlugins which support it (0 for a process per ThreadedPlugin)
+        plugin_workers = int(self.data_config.get(self.PLUGIN_WORKERS, 0))
+        self.worker_pool = workerpool.WorkerPool(plugin_workers) if plugin_workers > 0 else None
+        # threads shared by IOThreadPlugins (0 to use the event loop's default executor)
+        plugin_io_threads = int(self.data_config.get(self.PLUGIN_IO_THREADS, 0))
+        self.io_executor = concurrent.futures.ThreadPoolExecutor(max_workers=plugin_io_threads, thread_name_prefix='plugin io') if plugin_io_threads > 0 else None
+        self.edit_coalescer = None  # made with the add-ons' api methods
+        # made once, before add-ons are initialized (in several threads), so that they all share the same ones
+        self._scheduled_api_methods = self._make_api_methods()
+        self.metrics_save_period = float(self.data_config.get(self.METRICS_SAVE_PERIOD, 0))
+        # measures event loop lag and blames add-ons which block the loop for longer than loopmonitorthreshold seconds
+        loop_monitor_interval = float(self.data_config.get(self.LOOP_MONITOR_INTERVAL, loopmonitor.DEFAULT_INTERVAL))
+        if loop_monitor_interval > 0:
+            self.loop_monitor = loopmonitor.LoopMonitor(self.loop, interval=loop_monitor_interval,
+                threshold=float(self.data_config.get(self.LOOP_MONITOR_THRESHOLD, loopmonitor.DEFAULT_THRESHOLD)), log=self.log)
+        else:
+            self.loop_monitor = None
+        # message backups are written behind, by _save_messages_loop()
+        self.unsaved_message_changes = 0
+        self.message_save_period = float(self.data_config.get(self.MESSAGE_SAVE_PERIOD, DEFAULT_MESSAGE_SAVE_PERIOD))
+        self.message_save_threshold = int(self.data_config.get(self.MESSAGE_SAVE_THRESHOLD, DEFAULT_MESSAGE_SAVE_THRESHOLD))
+        self.message_save_event = asyncio.Event()
+        # configs from before the journals default to a journal next to the old text backup
+        self.message_journal = journal.MessageJournal(self.data_config.get(MSG_JOURNAL_LOCATION, os.path.splitext(self.data_config[MSG_BACKUP_LOCATION])[0]+'.journal'))
+        self.watch_journal = journal.MessageJournal(self.data_config.get(WATCH_JOURNAL_LOCATION, os.path.splitext(self.data_config[WATCH_MSG_LOCATION])[0]+'.journal'))
+        self.channel_index = dict()  # maps channel ids to (server, channel), built in on_ready()
+        self.rehydrate_concurrency = int(self.data_config.get(self.REHYDRATE_CONCURRENCY, DEFAULT_REHYDRATE_CONCURRENCY))
         self.load_all_addons(reload=True)
+        self.loop.create_task(self._save_messages_loop())
+        if self.addon_reload_period > 0:
+            self.loop.create_task(self._watch_addons_loop())
+        if self.metrics_save_period > 0 and self.METRICS_LOCATION in self.data_config:
+            self.loop.create_task(self._save_metrics_loop())
+        if self.loop_monitor is not None:
+            self.loop.create_task(self.loop_monitor.run())
+        if self.outbound is not None:
+            self.loop.create_task(self.outbound.run())
+        if self.plugin_scheduler is not None:
+            self.loop.create_task(self.plugin_scheduler.run())
 
     def add_data(self, name, content_from=DEFAULT):
         '''(str, str) -> None
@@ -111,15 +257,8 @@ class Bot(discord.Client):
         global _commands
         if not isinstance(cmd, command.Command):
             raise ValueError('Only commands may be registered in Bot::register_command')
-        if name in self.commands:
-            self.commands[name] = cmd
-        else:
-            self.commands[name] = cmd
-            for key in list(self.commands.keys()):
-                if name == key:
-                    break
-                elif sorted([name, key])[0] == name:
-                    self.commands.move_to_end(key)
+        self.commands[name] = cmd
+        self.release_quarantine(COMMANDS, name)
         if package != '':
             self.register_package(COMMANDS, name, package)
         _commands = self.commands
@@ -132,18 +271,11 @@ class Bot(discord.Client):
             raise ValueError('Only plugins may be registered in Bot::register_plugin')
         if isinstance(plugin_object, plugin.AdminPlugin):  # give AdminPlugins access to all this class's variables
             plugin_object.add_client_variable(self)
-        if name in self.plugins:
-            self.plugins[name] = plugin_object
-        else:
-            self.plugins[name] = plugin_object
-            for key in list(self.plugins.keys()):
-                if name == key:
-                    break
-                elif sorted([name, key])[0] == name:
-                    self.plugins.move_to_end(key)
+        plugin_object.scheduler = self.plugin_scheduler
+        self.plugins[name] = plugin_object
         if package != '':
             self.register_package(PLUGINS, name, package)
-        self.loop.create_task(plugin_object._action())
+        self.plugin_tasks[name] = self.loop.create_task(plugin_object._action())
         _plugins = self.plugins
 
     def register_reaction_command(self, cmd, name, package=None):
@@ -154,19 +286,35 @@ class Bot(discord.Client):
             or isinstance(cmd, reactioncommand.ReactionRemoveCommand)\
             or isinstance(cmd, reactioncommand.Dummy)):
             raise ValueError("%s is not a reaction command. Only reaction add/remove commands may be registered in Bot::register_reaction_command" % name)
-        if name in self.reactions:
-            self.reactions[name] = cmd
-        else:
-            self.reactions[name] = cmd
-            for key in list(self.reactions.keys()):
-                if name == key:
-                    break
-                elif sorted([name, key])[0] == name:
-                    self.reactions.move_to_end(key)
+        if isinstance(cmd, reactioncommand.ReactionCommand):
+            # rebuild the reaction indexes whenever the command's emojis change
+            cmd.on_emoji_change = self.invalidate_reaction_indexes
+        self.reactions[name] = cmd
+        self.release_quarantine(REACTIONS, name)
         if package != '':
             self.register_package(REACTIONS, name, package)
         _reactions = self.reactions
 
+    def invalidate_reaction_indexes(self):
+        '''(Bot) -> None
+        Marks the reaction dispatch indexes as out of date, so they're rebuilt on the next reaction'''
+        self.reaction_add_index = None
+        self.reaction_remove_index = None
+
+    def build_reaction_indexes(self):
+        '''(Bot) -> None
+        Splits the reaction commands into add and remove commands and indexes them by emoji'''
+        add_reactions = OrderedDict()
+        remove_reactions = OrderedDict()
+        for name in self.reactions:
+            if isinstance(self.reactions[name], reactioncommand.ReactionAddCommand):
+                add_reactions[name] = self.reactions[name]
+            if isinstance(self.reactions[name], reactioncommand.ReactionRemoveCommand):
+                remove_reactions[name] = self.reactions[name]
+        self.reaction_index_version = self.reactions.version
+        self.reaction_add_index = dispatch.ReactionIndex(add_reactions)
+        self.reaction_remove_index = dispatch.ReactionIndex(remove_reactions)
+
     def register_package(self, addon_type, name, package):
         '''(str, str) -> None
         Registers an add-on into a package'''
@@ -180,11 +328,20 @@ class Bot(discord.Client):
             self.packages[package] = new_package
         if name not in self.packages[package][addon_type]:
             self.packages[package][addon_type].append(name)
+        self.package_index[addon_type].setdefault(name, package)
         _packages = self.packages
 
     def get_package(self, name, addon_type):
+        '''(str, str) -> str
+        Returns the name of the package which the add-on is in'''
+        package = self.package_index[addon_type].get(name)
+        if package in self.packages and name in self.packages[package][addon_type]:
+            return package
+        # the add-on was moved or removed from its package since it was indexed
+        self.package_index[addon_type].pop(name, None)
         for key in self.packages:
             if name in self.packages[key][addon_type]:
+                self.package_index[addon_type][name] = key
                 return key
 
     def load_command(self, filename, name, package=None, reload=False):
@@ -251,6 +408,21 @@ class Bot(discord.Client):
         '''(str, str[, str]) -> plugin.Plugin or reaction.Reaction or command.Command
         initilizes an addon and then registers it with the bot
         This determines what sort of add-on the file contains and acts accordingly'''
+        addon_type, addon_instance = self.init_addon(filename, name, package=package, reload=reload, **kwargs)
+        return self.register_addon(addon_type, addon_instance, name, package=package)
+
+    def init_addon(self, filename, name, package=None, reload=False, **kwargs):
+        '''(str, str[, str]) -> (str, plugin.Plugin or reaction.Reaction or command.Command)
+        imports and initializes an addon, without registering it with the bot
+        Returns the addon's type (COMMANDS, REACTIONS or PLUGINS) and the addon, or (None, None) if the file contains no addon
+        This doesn't touch the bot's registries, so it's safe to run outside of the event loop's thread'''
+        with self.startup_profiler.profile(name, package=package) as record:
+            addon_type, addon_instance = self._init_addon(filename, name, package, reload, record, **kwargs)
+            if record is not None:
+                record[profiler.KIND] = ADDON_KINDS.get(addon_type)
+            return addon_type, addon_instance
+
+    def _init_addon(self, filename, name, package, reload, record, **kwargs):
         if package:
             if package not in loader.sub_namespaces:
                 loader.sub_namespaces[package] = loader.CustomNamespace()
@@ -271,14 +443,7 @@ class Bot(discord.Client):
         addon.MESSAGE: bot.wait_for_message,
         addon.REACTION: bot.wait_for_reaction
         }
-        api_methods = {
-        addon.SEND_MESSAGE: bot.send_message,
-        addon.EDIT_MESSAGE: bot.edit_message,
-        addon.ADD_REACTION: bot.add_reaction,
-        addon.REMOVE_REACTION: bot.remove_reaction,
-        addon.SEND_TYPING: bot.send_typing,
-        addon.SEND_FILE: bot.send_file
-        }
+        api_methods = bot.get_api_methods()
         parameters = {
         'user': lambda: bot.user, # user_func uses lambda to create a closure on bot
         'namespace': namespace,
@@ -286,7 +451,9 @@ class Bot(discord.Client):
         'role_messages': bot.role_messages,
         'api_methods': api_methods,
         'events': events,
-        'all_emojis_func': bot.get_all_emojis
+        'all_emojis_func': bot.get_all_emojis,
+        'worker_pool': bot.worker_pool,
+        'io_executor': bot.io_executor
         }
         # find config file
         if filename[:-len(".py")]+config_end in self.data_config:
@@ -295,36 +462,45 @@ class Bot(discord.Client):
             parameters['config'] = join('addons', package_loader, filename[:-len(".py")]+'.config')
         else:
             parameters['config'] = None
+        action_timeout = self.read_action_timeout(parameters['config'])
+        if action_timeout is False:
+            self.action_timeouts.pop(name, None)
+        else:
+            self.action_timeouts[name] = action_timeout
 
+        path = join('addons', package_loader, filename)
         if package_loader:
             package_loader = package+'.'
-        try:
-            temp_lib = importlib.import_module("addons."+package_loader+filename[:-len(".py")])  # import reaction
-        except Exception as e:
-            print('While loading addons, failed to load python file %s' % filename)
-            raise e
-        if reload:  # dumb way to do it, ik
-            temp_lib = importlib.reload(temp_lib)
+        with self.startup_profiler.phase(record, profiler.IMPORT_TIME):
+            try:
+                temp_lib = importlib.import_module("addons."+package_loader+filename[:-len(".py")])  # import reaction
+            except Exception as e:
+                print('While loading addons, failed to load python file %s' % filename)
+                raise e
+            if reload:  # dumb way to do it, ik
+                temp_lib = importlib.reload(temp_lib)
 
         if 'Plugin' in dir(temp_lib):
             try:
-                plugin_instance = temp_lib.Plugin(**parameters, **kwargs)  # init plugin
+                with self.startup_profiler.phase(record, profiler.INIT_TIME):
+                    plugin_instance = temp_lib.Plugin(**parameters, **kwargs)  # init plugin
             except Exception as e:
                 self.log.warning('Failed to initialize plugin %s' % name)
                 raise e
-            self.register_plugin(plugin_instance, name, package=package)
-            return self.plugins[name]
+            self.addon_cache.put(path, addon.PLUGIN, config=parameters['config'])
+            return PLUGINS, plugin_instance
         elif 'Command' in dir(temp_lib):
             # add command-specific parameters
             perms_dir = self.data_config[PERMISSIONS_LOCATION]
             parameters['perms_loc'] = perms_dir+'c.'+package_loader+filename[:-len(".py")]+".json"
             try:
-                cmd_instance = temp_lib.Command(**parameters, **kwargs)  # init command
+                with self.startup_profiler.phase(record, profiler.INIT_TIME):
+                    cmd_instance = temp_lib.Command(**parameters, **kwargs)  # init command
             except Exception as e:
                 self.log.warning('Failed to initialize command %s' % name)
                 raise e
-            self.register_command(cmd_instance, name, package=package)
-            return self.commands[name]
+            self.addon_cache.put(path, addon.COMMAND, config=parameters['config'], perms_loc=parameters['perms_loc'], **discovery.describe(cmd_instance))
+            return COMMANDS, cmd_instance
         elif 'Reaction' in dir(temp_lib):
             # add reaction-specific parameters
             perms_dir = self.data_config[PERMISSIONS_LOCATION]
@@ -332,13 +508,60 @@ class Bot(discord.Client):
             parameters['perms_loc'] = perms_dir+'r.'+package_loader+filename[:-len(".py")]+".json"
             parameters['emoji_loc'] = emoji_dir+package_loader+filename[:-len(".py")]+".json"
             try:
-                reaction_instance = temp_lib.Reaction(**parameters, **kwargs)  # init reaction
+                with self.startup_profiler.phase(record, profiler.INIT_TIME):
+                    reaction_instance = temp_lib.Reaction(**parameters, **kwargs)  # init reaction
             except Exception as e:
                 self.log.warning('Failed to initialize reaction %s' % name)
                 raise e
-            self.register_reaction_command(reaction_instance, name, package=package)
+            self.addon_cache.put(path, addon.REACTION, config=parameters['config'], perms_loc=parameters['perms_loc'], emoji_loc=parameters['emoji_loc'], **discovery.describe_emoji(reaction_instance))
+            return REACTIONS, reaction_instance
+        self.addon_cache.put(path, None)
+        return None, None
+
+    def register_addon(self, addon_type, addon_instance, name, package=None):
+        '''(str, plugin.Plugin or reaction.Reaction or command.Command, str[, str]) -> plugin.Plugin or reaction.Reaction or command.Command
+        registers an addon initialized by init_addon() with the bot
+        Returns the registered addon, or None if there's no addon'''
+        if addon_type == PLUGINS:
+            self.register_plugin(addon_instance, name, package=package)
+            return self.plugins[name]
+        elif addon_type == COMMANDS:
+            self.register_command(addon_instance, name, package=package)
+            return self.commands[name]
+        elif addon_type == REACTIONS:
+            self.register_reaction_command(addon_instance, name, package=package)
             return self.reactions[name]
 
+    def get_api_methods(self):
+        '''(Bot) -> dict
+        Returns the Discord API methods given to add-ons, which go through the outbound scheduler
+        and edit coalescer if they're enabled'''
+        return dict(self._scheduled_api_methods)
+
+    def _make_api_methods(self):
+        api_methods = {
+        addon.SEND_MESSAGE: self.send_message,
+        addon.EDIT_MESSAGE: self.edit_message,
+        addon.ADD_REACTION: self.add_reaction,
+        addon.REMOVE_REACTION: self.remove_reaction,
+        addon.SEND_TYPING: self.send_typing,
+        addon.SEND_FILE: self.send_file
+        }
+        if self.outbound is not None:
+            api_methods = {
+            addon.SEND_MESSAGE: self.outbound.wrap(self.send_message, outbound.channel_of_destination, priority=outbound.HIGH),
+            addon.EDIT_MESSAGE: self.outbound.wrap(self.edit_message, outbound.channel_of_message),
+            addon.ADD_REACTION: self.outbound.wrap(self.add_reaction, outbound.channel_of_message),
+            addon.REMOVE_REACTION: self.outbound.wrap(self.remove_reaction, outbound.channel_of_message),
+            addon.SEND_TYPING: self.outbound.wrap(self.send_typing, outbound.channel_of_destination, priority=outbound.LOW),
+            addon.SEND_FILE: self.outbound.wrap(self.send_file, outbound.channel_of_destination, priority=outbound.HIGH)
+            }
+        if self.edit_interval > 0:
+            # only the newest of quick successive edits to a message is sent
+            self.edit_coalescer = outbound.EditCoalescer(self.loop, api_methods[addon.EDIT_MESSAGE], interval=self.edit_interval)
+            api_methods[addon.EDIT_MESSAGE] = self.edit_coalescer.edit
+        return api_methods
+
     def load_all_addons(self, reload=False):
         if int(self.data_config['loadoldfolders']):
             if len(self.commands) == 0 or reload:
@@ -350,89 +573,443 @@ class Bot(discord.Client):
                 self.plugins.clear()
             loader.load_plugins('plugins', self, register=True)
         self.load_addons('addons', register=True)
+        if self.startup_profiler.enabled:
+            self.save_startup_report()
+
+    def save_startup_report(self):
+        '''(Bot) -> None
+        Writes the startup profile of every add-on loaded so far to startupprofileloc'''
+        self.startup_profiler.finish()
+        for record in self.startup_profiler.slowest(5):
+            self.log.info('Slow addon %s (%s): %.3fs (import %.3fs, init %.3fs)' % (record[profiler.NAME], record[profiler.PACKAGE], record[profiler.TOTAL_TIME], record[profiler.IMPORT_TIME], record[profiler.INIT_TIME]))
+        if self.STARTUP_PROFILE_LOCATION in self.data_config:
+            try:
+                self.startup_profiler.save(self.data_config[self.STARTUP_PROFILE_LOCATION])
+            except OSError as e:
+                self.log.warning('Failed to save startup profile: %s' % e)
+
+    def startup_report(self):
+        '''(Bot) -> dict
+        Returns the startup profile of every add-on (see libs.profiler), for admin add-ons'''
+        return self.startup_profiler.report()
 
     def load_addons(self, folder, register=False):
         bot = self
-        for item in sorted(listdir(folder)):
-            if isfile(join(folder, item)):
+        to_init = list()  # (path, filename, name, package) of add-ons to import, in load order
+        manifests = dict()  # package -> manifest
+        found = self.find_addons(folder)
+        for filename, name, package in found:
+            path = join(folder, package or '', filename)
+            self.log.info("Loading addon in %s " % join(package or '', filename))
+            if not register:
+                continue
+            cached = self.addon_cache.get(path)
+            if cached is not None and cached[discovery.KIND] is None:
+                # unchanged since it was last found to contain no addon, so don't import it again
+                self.log.info('No addon found in %s' % path)
+                continue
+            if self.lazy_addons:
+                if package not in manifests:
+                    manifests[package] = loader.load_manifest(join(folder, package or ''))
+                if filename in manifests[package] and bot.register_lazy_addon(filename, name, manifests[package][filename], package=package):
+                    continue
+                if self.lazy_addons >= LAZY_FROM_CACHE and cached is not None \
+                        and bot.register_lazy_addon(filename, name, self.cached_description(cached), package=package):
+                    continue
+            to_init.append((path, filename, name, package))
+        # import and initialize in parallel, then register in order on this thread
+        for (path, filename, name, package), result in zip(to_init, self.init_addons(to_init)):
+            try:
+                if isinstance(result, Exception):
+                    raise result
+                addon = bot.register_addon(*result, name, package=package)
+                assert addon is not None
+            except AssertionError:
+                self.log.info('No addon found in %s' % path)
+            except Exception as e:
+                print('Failed to load addon at %s' % path)
+                self.log.error(('Failed to load %s reason: ' % path) + str(e))
+                self.addon_reload_failures[path] = self._file_version(path)
+        if register:
+            self.addon_cache.prune({join(folder, package or '', filename) for filename, name, package in found})
+            self.save_addon_cache()
+
+    def find_addons(self, folder):
+        '''(Bot, str) -> list of (str, str, str)
+        Returns the (filename, name, package) of every add-on file in folder and its packages (sub-folders), in load order'''
+        found = list()
+        for item, item_is_file in self.addon_cache.listdir(folder):
+            if item_is_file:
                 if item[-len(".py"):] == ".py" and item[0]!="_":
-                    self.log.info("Loading addon in %s " % item)
-                    if register:
-                        try:
-                            addon=bot.load_addon(item, item[:-len(".py")], package=None)
-                            assert addon is not None
-                        except AssertionError:
-                            self.log.info('No addon found in %s' % join(folder, item))
-                        except Exception as e:
-                            print('Failed to load addon at %s' % join(folder, item))
-                            self.log.error(('Failed to load %s reason: ' % join(folder, item)) + str(e))
+                    found.append((item, item[:-len(".py")], None))
             elif item[0] != "_": # second level
-                for sub_item in sorted(listdir(join(folder, item))):
-                    if isfile(join(folder, item, sub_item)):
+                for sub_item, sub_item_is_file in self.addon_cache.listdir(join(folder, item)):
+                    if sub_item_is_file:
                         if sub_item[-len(".py"):] == ".py" and sub_item[0]!="_":
-                            self.log.info("Loading addon in %s " % join(item, sub_item))
-                            if register:
-                                try:
-                                    addon=bot.load_addon(sub_item, sub_item[:-len(".py")], package=item)
-                                    assert addon is not None
-                                except AssertionError:
-                                    self.log.info('No addon found in %s' % join(folder, item, sub_item))
-                                except Exception as e:
-                                    print('Failed to load addon at %s' % join(folder, item, sub_item))
-                                    self.log.error(('Failed to load %s reason: ' % join(folder, item, sub_item)) + str(e))
+                            found.append((sub_item, sub_item[:-len(".py")], item))
+        return found
+
+    @asyncio.coroutine
+    def reload_changed_addons(self, folder='addons'):
+        '''(Bot[, str]) -> list of str
+        Reloads only the add-ons whose files have changed (or been added) since they were last loaded.
+        Returns the names of the add-ons which were reloaded'''
+        reloaded = list()
+        for filename, name, package in self.find_addons(folder):
+            path = join(folder, package or '', filename)
+            if self.addon_cache.get(path) is not None:
+                continue  # unchanged
+            if path in self.addon_reload_failures and self.addon_reload_failures[path] == self._file_version(path):
+                continue  # still broken, so don't keep trying
+            cached = self.addon_cache.files.get(path)
+            addon_type, registered = self.registered_addon(name, cached[discovery.KIND] if cached else None)
+            if isinstance(registered, loader.LazyAddOn) and registered.addon is None:
+                continue  # not imported yet, so it'll be loaded from the new file when it's needed
+            self.log.info("Reloading changed addon in %s " % join(package or '', filename))
+            try:
+                addon_instance = yield from self.reload_addon(filename, name, package=package)
+            except Exception as e:
+                self.addon_reload_failures[path] = self._file_version(path)
+                print('Failed to reload addon at %s' % path)
+                self.log.error(('Failed to reload %s reason: ' % path) + str(e))
+                continue
+            self.addon_reload_failures.pop(path, None)
+            if addon_instance is not None:
+                reloaded.append(name)
+        self.save_addon_cache()
+        return reloaded
+
+    @asyncio.coroutine
+    def reload_addon(self, filename, name, package=None):
+        '''(Bot, str, str[, str]) -> plugin.Plugin or reaction.Reaction or command.Command
+        Shuts down the loaded add-on called name (if there is one), re-imports and initializes it from filename,
+        then swaps the new add-on into its registry.
+        Shutting down and initializing happen in the default executor, so the bot keeps handling events meanwhile,
+        except for the add-on being reloaded, which is quarantined until the new add-on is registered.
+        If the new add-on fails to initialize, the old (shut down) add-on stays quarantined until it's reloaded again'''
+        cached = self.addon_cache.files.get(join('addons', package or '', filename))
+        old_type, old_addon = self.registered_addon(name, cached[discovery.KIND] if cached else None)
+        if old_addon is not None:
+            # nothing is dispatched to it once it starts shutting down
+            self.quarantined[(old_type, name)] = None
+            # shut down first, so that anything it saves is there for the new add-on to load
+            yield from self.loop.run_in_executor(None, old_addon._shutdown)
+            if old_type == PLUGINS and name in self.plugin_tasks:
+                self.plugin_tasks.pop(name).cancel()
+        module_name = 'addons.'+(package+'.' if package else '')+filename[:-len(".py")]
+        try:
+            addon_type, addon_instance = yield from self.loop.run_in_executor(None,
+                functools.partial(self._init_addon_in_thread, filename, name, package=package, reload=module_name in sys.modules))
+        except Exception as e:
+            if old_addon is not None:
+                self.log.warning('Keeping %s %s quarantined, since it failed to reload' % (old_type, name))
+            raise e
+        if self.worker_pool is not None and any(getattr(instance, 'worker_pool', None) is not None for instance in (old_addon, addon_instance)):
+            # workers import plugin classes by name, so they'd keep running the old code
+            self.worker_pool.recycle()
+        if old_type is not None and old_type != addon_type:
+            del self.registries()[old_type][name]
+        new_addon = self.register_addon(addon_type, addon_instance, name, package=package)
+        if old_type is not None:
+            self.release_quarantine(old_type, name)
+        return new_addon
+
+    def registered_addon(self, name, kind=None):
+        '''(Bot, str[, str]) -> (str, AddOn)
+        Returns the type (COMMANDS, REACTIONS or PLUGINS) and the registered add-on called name,
+        or (None, None) if there isn't one. kind (eg addon.COMMAND) is checked first, if it's known'''
+        registries = self.registries()
+        addon_types = [ADDON_TYPES[kind]] if kind in ADDON_TYPES else list()
+        for addon_type in addon_types + [COMMANDS, REACTIONS, PLUGINS]:
+            if name in registries[addon_type]:
+                return addon_type, registries[addon_type][name]
+        return None, None
+
+    def registries(self):
+        return {COMMANDS: self.commands, REACTIONS: self.reactions, PLUGINS: self.plugins}
+
+    def _file_version(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @asyncio.coroutine
+    def _watch_addons_loop(self):
+        '''(Bot) -> None
+        the looping task which reloads add-ons when their files change'''
+        while True:
+            yield from asyncio.sleep(self.addon_reload_period)
+            try:
+                yield from self.reload_changed_addons()
+            except Exception as e:
+                self.log.error('Failed to check add-ons for changes: %s' % e)
+
+    def cached_description(self, cached):
+        '''(Bot, dict) -> dict
+        Returns a package manifest style description of an add-on from its discovery cache entry'''
+        description = {loader.TYPE: cached[discovery.KIND]}
+        triggers = {trigger: cached.get(trigger) for trigger in discovery.TRIGGERS if trigger in cached}
+        if None not in triggers.values():
+            # with only some of its triggers known, the command could be missed
+            description.update(triggers)
+        if isinstance(cached.get(discovery.EMOJI), dict):
+            description[loader.EMOJI] = cached[discovery.EMOJI]
+            # the reaction saves its emoji map when it's shut down, which may be newer than the cached one
+            try:
+                saved_emoji = dataloader.datafile(cached[discovery.EMOJI_LOC], load_as='json').content
+                if isinstance(saved_emoji, dict):
+                    description[loader.EMOJI] = saved_emoji
+            except (OSError, KeyError, TypeError, ValueError):
+                pass
+        return description
+
+    def save_addon_cache(self):
+        try:
+            self.addon_cache.save()
+        except OSError as e:
+            self.log.warning('Failed to save add-on discovery cache: %s' % e)
+
+    def init_addons(self, to_init):
+        '''(Bot, list of (str, str, str, str)) -> list of (str, addon) or Exception
+        Runs init_addon() on every (path, filename, name, package) in to_init and returns the results in the same order
+        (an Exception in place of any add-on which failed).
+        Packages are initialized in parallel, in a thread pool, when addonloadthreads is more than 1;
+        the add-ons in a package are always initialized one after another, in order, since they share a namespace'''
+        groups = OrderedDict()  # package -> [(index, filename, name), ...]
+        for index, (path, filename, name, package) in enumerate(to_init):
+            groups.setdefault(package, list()).append((index, filename, name))
+        results = [None] * len(to_init)
+
+        def init_group(package):
+            for index, filename, name in groups[package]:
+                try:
+                    results[index] = self._init_addon_in_thread(filename, name, package=package)
+                except Exception as e:
+                    results[index] = e
+        if self.addon_load_threads > 1 and len(groups) > 1:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.addon_load_threads) as executor:
+                for future in [executor.submit(init_group, package) for package in groups]:
+                    future.result()
+        else:
+            for package in groups:
+                init_group(package)
+        return results
+
+    def _init_addon_in_thread(self, *args, **kwargs):
+        # asyncio objects made in an add-on's __init__ should belong to the bot's loop
+        asyncio.set_event_loop(self.loop)
+        return self.init_addon(*args, **kwargs)
+
+    def register_lazy_addon(self, filename, name, description, package=None):
+        '''(str, str, dict[, str]) -> loader.LazyAddOn
+        Registers a stand-in for an add-on described in a package manifest, which imports the add-on when it's first needed
+        Returns None if the add-on can't be loaded lazily (eg plugins), in which case it should be loaded normally'''
+        if not isinstance(description, dict):
+            return None
+
+        def load_func():
+            self.log.info("Lazily loading addon in %s " % join(package or '', filename))
+            return self.load_addon(filename, name, package=package)
+        path = join('addons', package or '', filename)
+        version_func = lambda: self._file_version(path)
+        if description.get(loader.TYPE) == addon.COMMAND:
+            lazy_addon = loader.LazyCommand(load_func, description, version_func=version_func)
+            self.register_command(lazy_addon, name, package=package)
+        elif description.get(loader.TYPE) == addon.REACTION:
+            lazy_addon = loader.LazyReaction(load_func, description, version_func=version_func)
+            self.register_reaction_command(lazy_addon, name, package=package)
+        else:
+            return None
+        return lazy_addon
+
+    def _load_lazy_reaction(self, name):
+        '''(Bot, str) -> reaction.ReactionCommand
+        Imports the reaction command name if it's a stand-in, and returns the registered reaction command'''
+        if isinstance(self.reactions[name], loader.LazyReaction):
+            self.reactions[name]._load()  # this registers the real reaction command in place of the stand-in
+        return self.reactions.get(name)
 
     @asyncio.coroutine
     def on_message(self, message):
         yield from self.message_stuff()
-        for cmd in list(self.commands.keys()):
-            # list(self.commands.keys()) prevents RuntimeErrors from mutation when loading new command
+        if self.command_index is None or self.command_index_version != self.commands.version:
+            self.command_index = dispatch.CommandIndex(self.commands)
+            self.command_index_version = self.commands.version
+        for cmd in self.command_index.candidates(message):
+            # candidates is a list, which prevents RuntimeErrors from mutation when loading new command
+            if cmd not in self.commands or self.is_quarantined(COMMANDS, cmd):
+                continue
             try:
-                if self.commands[cmd]._matches(message):
-                    if isinstance(self.commands[cmd], command.AdminCommand):
-                        yield from self.commands[cmd]._action(message, self)
+                start = time.perf_counter()
+                matched = self.commands[cmd]._matches(message)
+                self.metrics.record_match(COMMANDS, cmd, time.perf_counter() - start, matched)
+                if matched:
+                    if self.concurrent_actions:
+                        # matching still happens in order, so breaks_on_match is respected
+                        self.loop.create_task(self._concurrent_command_action(cmd, self.commands[cmd], message))
                     else:
-                        yield from self.commands[cmd]._action(message)
+                        yield from self._command_action(cmd, self.commands[cmd], message)
                     if self.commands[cmd].breaks_on_match:
                         break
             except Exception as e:
-                # Catch all problems that happen in matching/executing a command.
+                # Catch all problems that happen in matching a command.
                 # This means that if there's a bug that would cause execution to
                 # break, other commands can still be tried.
+                self.metrics.record_error(COMMANDS, cmd)
                 yield from self._on_command_error(cmd, e, message)
 
+    @asyncio.coroutine
+    def _command_action(self, cmd_name, cmd, message):
+        '''(Bot, str, command.Command, discord.Message) -> None
+        runs cmd's action on message, reporting any errors it raises'''
+        start = time.perf_counter()
+        try:
+            if isinstance(cmd, command.AdminCommand):
+                yield from self._run_action(COMMANDS, cmd_name, cmd, cmd._action(message, self))
+            else:
+                yield from self._run_action(COMMANDS, cmd_name, cmd, cmd._action(message))
+        except Exception as e:
+            self.metrics.record_action(COMMANDS, cmd_name, time.perf_counter() - start)
+            self.metrics.record_error(COMMANDS, cmd_name)
+            yield from self._on_command_error(cmd_name, e, message)
+        else:
+            self.metrics.record_action(COMMANDS, cmd_name, time.perf_counter() - start)
+
+    @asyncio.coroutine
+    def _run_action(self, addon_type, name, addon_instance, action):
+        '''(Bot, str, str, AddOn, coroutine) -> None
+        runs action, cancelling it if it takes longer than the add-on's action timeout.
+        Raises asyncio.TimeoutError if it's cancelled; the add-on is quarantined after too many timeouts in a row'''
+        timeout = self.get_action_timeout(name)
+        if timeout is None:
+            yield from action
+            return
+        try:
+            yield from asyncio.wait_for(self._as_coroutine(action), timeout)
+        except asyncio.TimeoutError:
+            timeouts = self.consecutive_timeouts.get((addon_type, name), 0) + 1
+            self.consecutive_timeouts[(addon_type, name)] = timeouts
+            if self.quarantine_timeouts > 0 and timeouts >= self.quarantine_timeouts:
+                self.quarantine(addon_type, name)
+            raise asyncio.TimeoutError('action took longer than %ss and was cancelled (%d time(s) in a row)' % (timeout, timeouts))
+        self.consecutive_timeouts.pop((addon_type, name), None)
+
+    @asyncio.coroutine
+    def _as_coroutine(self, action):
+        # add-on actions are plain generators, which asyncio.wait_for() doesn't accept
+        return (yield from action)
+
+    def get_action_timeout(self, name):
+        '''(Bot, str) -> float
+        Returns how many seconds the actions of the add-on called name may take (None for no limit);
+        actiontimeout in the add-on's config file overrides the bot's'''
+        return self.action_timeouts.get(name, self.action_timeout)
+
+    def read_action_timeout(self, config):
+        '''(Bot, str) -> float or None or False
+        Returns actiontimeout from the add-on config file config (None for no limit),
+        or False if there isn't one'''
+        if not config:
+            return False
+        try:
+            config_file = dataloader.datafile(config)
+            if config_file.type == 'config' and ACTION_TIMEOUT in config_file.content[DEFAULT]:
+                return float(config_file.content[DEFAULT][ACTION_TIMEOUT]) or None
+        except (OSError, KeyError, ValueError, configparser.Error) as e:
+            self.log.warning('Ignoring actiontimeout in %s: %s' % (config, e))
+        return False
+
+    def quarantine(self, addon_type, name):
+        '''(Bot, str, str) -> None
+        Stops dispatching events to an add-on for quarantineperiod seconds (until it's reloaded, if that's 0)'''
+        self.log.warning('Quarantining %s %s after %d timeouts in a row' % (addon_type, name, self.consecutive_timeouts.get((addon_type, name), 0)))
+        self.quarantined[(addon_type, name)] = time.monotonic() + self.quarantine_period if self.quarantine_period > 0 else None
+
+    def release_quarantine(self, addon_type, name):
+        self.quarantined.pop((addon_type, name), None)
+        self.consecutive_timeouts.pop((addon_type, name), None)
+
+    def is_quarantined(self, addon_type, name):
+        if (addon_type, name) not in self.quarantined:
+            return False
+        until = self.quarantined[(addon_type, name)]
+        if until is not None and time.monotonic() >= until:
+            self.log.info('Releasing %s %s from quarantine' % (addon_type, name))
+            self.release_quarantine(addon_type, name)
+            return False
+        return True
+
+    @asyncio.coroutine
+    def _concurrent_command_action(self, cmd_name, cmd, message):
+        '''(Bot, str, command.Command, discord.Message) -> None
+        runs cmd's action as a task, limited to maxconcurrentactions actions at once'''
+        yield from self.action_semaphore.acquire()
+        try:
+            yield from self._command_action(cmd_name, cmd, message)
+        finally:
+            self.action_semaphore.release()
+
     @asyncio.coroutine
     def on_reaction_add(self, rxn, user):
-        for cmd in list(self.reactions.keys()):
-            if isinstance(self.reactions[cmd], reactioncommand.ReactionAddCommand):
-                try:
-                    if self.reactions[cmd]._matches(rxn, user):
+        if self.reaction_add_index is None or self.reaction_index_version != self.reactions.version:
+            self.build_reaction_indexes()
+        for cmd in self.reaction_add_index.candidates(rxn):
+            if cmd not in self.reactions or self.is_quarantined(REACTIONS, cmd):
+                continue
+            try:
+                if not isinstance(self._load_lazy_reaction(cmd), reactioncommand.ReactionAddCommand):
+                    continue
+                start = time.perf_counter()
+                matched = self.reactions[cmd]._matches(rxn, user)
+                self.metrics.record_match(REACTIONS, cmd, time.perf_counter() - start, matched)
+                if matched:
+                    start = time.perf_counter()
+                    try:
                         if isinstance(self.reactions[cmd], reactioncommand.AdminReactionCommand):
-                            yield from self.reactions[cmd]._action(rxn, user, self)
+                            yield from self._run_action(REACTIONS, cmd, self.reactions[cmd], self.reactions[cmd]._action(rxn, user, self))
                         else:
-                            yield from self.reactions[cmd]._action(rxn, user)
-                        break
-                except Exception as e:
-                    # Catch and report all errors that happen in matches/action.
-                    # This prevents a bug in one reaction command from
-                    # breaking execution, so other commands can still be run.
-                    yield from self._on_reaction_add_error(cmd, e, rxn, user)
+                            yield from self._run_action(REACTIONS, cmd, self.reactions[cmd], self.reactions[cmd]._action(rxn, user))
+                    finally:
+                        self.metrics.record_action(REACTIONS, cmd, time.perf_counter() - start)
+                    break
+            except Exception as e:
+                # Catch and report all errors that happen in matches/action.
+                # This prevents a bug in one reaction command from
+                # breaking execution, so other commands can still be run.
+                self.metrics.record_error(REACTIONS, cmd)
+                yield from self._on_reaction_add_error(cmd, e, rxn, user)
 
     @asyncio.coroutine
     def on_reaction_remove(self, rxn, user):
-        for cmd in list(self.reactions.keys()):
-            if isinstance(self.reactions[cmd], reactioncommand.ReactionRemoveCommand):
-                try:
-                    if self.reactions[cmd]._matches(rxn, user):
+        if self.reaction_remove_index is None or self.reaction_index_version != self.reactions.version:
+            self.build_reaction_indexes()
+        for cmd in self.reaction_remove_index.candidates(rxn):
+            if cmd not in self.reactions or self.is_quarantined(REACTIONS, cmd):
+                continue
+            try:
+                if not isinstance(self._load_lazy_reaction(cmd), reactioncommand.ReactionRemoveCommand):
+                    continue
+                start = time.perf_counter()
+                matched = self.reactions[cmd]._matches(rxn, user)
+                self.metrics.record_match(REACTIONS, cmd, time.perf_counter() - start, matched)
+                if matched:
+                    start = time.perf_counter()
+                    try:
                         if isinstance(self.reactions[cmd], reactioncommand.AdminReactionCommand):
-                            yield from self.reactions[cmd]._action(rxn, user, self)
+                            yield from self._run_action(REACTIONS, cmd, self.reactions[cmd], self.reactions[cmd]._action(rxn, user, self))
                         else:
-                            yield from self.reactions[cmd]._action(rxn, user)
-                        break
-                except Exception as e:
-                    # Catch and report all errors that happen in matches/action.
-                    # This prevents a bug in one reaction command from
-                    # breaking execution, so other commands can still be run.
-                    yield from self._on_reaction_remove_error(cmd, e, rxn, user)
+                            yield from self._run_action(REACTIONS, cmd, self.reactions[cmd], self.reactions[cmd]._action(rxn, user))
+                    finally:
+                        self.metrics.record_action(REACTIONS, cmd, time.perf_counter() - start)
+                    break
+            except Exception as e:
+                # Catch and report all errors that happen in matches/action.
+                # This prevents a bug in one reaction command from
+                # breaking execution, so other commands can still be run.
+                self.metrics.record_error(REACTIONS, cmd)
+                yield from self._on_reaction_remove_error(cmd, e, rxn, user)
 
     @asyncio.coroutine
     def on_ready(self):
@@ -441,6 +1018,9 @@ class Bot(discord.Client):
         self.log.info('Username: ' + str(self.user.name))
         # self.log.info('Email: ' + str(self.email))
         self.log.info('Connected to %s servers' % len(self.servers))
+        # discord.py replaces the message cache with a plain deque on every READY (eg after reconnecting)
+        self.install_message_cache()
+        self.build_channel_index()
         yield from self.load_messages()
         print("All messages loaded. Full functionality enabled")
 
@@ -455,70 +1035,200 @@ class Bot(discord.Client):
             return
         # load messages from file
         self.always_watch_messages.add(LOADING_WARNING)
-        try:
-            messagefile = dataloader.datafile(self.data_config[MSG_BACKUP_LOCATION])
-        except FileNotFoundError:
-            messagefile = dataloader.newdatafile(self.data_config[MSG_BACKUP_LOCATION])
-            messagefile.content = list()
+        saved_messages = self.load_journal(self.message_journal, MSG_BACKUP_LOCATION)
 
-        self.log.info("Loading %a messages" % len(messagefile.content))
+        self.log.info("Loading %a messages" % len(saved_messages))
         if _messages is None:
-            for msg_str in messagefile.content:
-                channel_id, msg_id = msg_str.strip().split(":")
-                try:
-                    msg = yield from self.get_message_properly(channel_id, msg_id)
-                    if msg.server:  # PATCH: private messages can't be loaded properly, this prevents them from being used
-                        self.messages.append(msg)
-                except (discord.NotFound, discord.Forbidden, discord.InvalidArgument):
-                    self.log.warning("Unable to load %a message" % msg_id)
+            for msg in (yield from self.rehydrate_messages(saved_messages)):
+                self.messages.append(msg)
         else:
-            self.messages = messages
+            # reconnected, so put back the messages which discord.py cleared
+            message_cache = self.get_message_cache()
+            if _messages is not message_cache:
+                for msg in _messages:
+                    if msg not in message_cache:
+                        message_cache.append(msg)
         self.log.info("Finished loading messages")
 
         # load always_watch_messages from file
-        try:
-            watchfile = dataloader.datafile(self.data_config[WATCH_MSG_LOCATION])
-        except FileNotFoundError:
-            watchfile = dataloader.newdatafile(self.data_config[WATCH_MSG_LOCATION])
-            watchfile.content = list()
-
-        self.log.info("Loading %a watched messages" % len(watchfile.content))
-        for msg_str in watchfile.content:
-            channel_id, msg_id = msg_str.strip().split(":")
-            try:
-                msg = yield from self.get_message_properly(channel_id, msg_id)
-                if msg.server:  # PATCH: private messages can't be loaded properly, this prevents them from being used
-                    if msg not in self.messages:
-                        self.messages.append(msg)
-                    self.always_watch_messages.add(msg)
-            except (discord.NotFound, discord.Forbidden, discord.InvalidArgument):
-                # prevents the following, respectively: msg deleted/not-accessible, bot permissions changed, malformed save file
-                self.log.warning("Unable to load %a message" % msg_id)
+        saved_watch_messages = self.load_journal(self.watch_journal, WATCH_MSG_LOCATION)
+
+        self.log.info("Loading %a watched messages" % len(saved_watch_messages))
+        message_cache = self.get_message_cache()
+        # only retrieve watched messages which weren't already loaded into self.messages
+        for msg in (yield from self.rehydrate_messages([pair for pair in saved_watch_messages if message_cache.get(pair[1]) is None])):
+            self.always_watch_messages.add(msg)
+        for channel_id, msg_id in saved_watch_messages:
+            if message_cache.get(msg_id) is not None:
+                self.always_watch_messages.add(message_cache.get(msg_id))
         self.always_watch_messages.remove(LOADING_WARNING)
         self.log.info("Finished loading watched messages")
 
+    def load_journal(self, message_journal, text_location):
+        '''(Bot, journal.MessageJournal, str) -> list of (str, str)
+        loads the (channel id, message id) pairs saved in message_journal
+        If there's no journal yet, the old text backup at data_config[text_location] is imported first'''
+        try:
+            if not isfile(message_journal.filename) and text_location in self.data_config and isfile(self.data_config[text_location]):
+                textfile = dataloader.datafile(self.data_config[text_location])
+                message_journal.import_pairs(tuple(msg_str.strip().split(":")) for msg_str in textfile.content if msg_str.strip())
+            return message_journal.load()
+        except ValueError:
+            # prevents a malformed save file from stopping startup
+            self.log.warning("Unable to load %a; starting with no saved messages" % message_journal.filename)
+            return list()
+
     @asyncio.coroutine
-    def get_message_properly(self, channel_id, msg_id):
-        '''(Bot, str, str) -> discord.Message
-        retrieves a message with id msg_id from channel_id which has (most) variables properly defined
-        unlike the API's darn annoying default thing that doesn't set anything that I didn't already know arrrg!!'''
-        msg = yield from self.get_message(discord.Object(channel_id), msg_id)
-        # get_message returns a discord.Message which is lacking a certain variables, including .server and .channel
-        # match private channel to msg
+    def rehydrate_messages(self, saved_messages):
+        '''(Bot, list of (str, str)) -> list of discord.Message
+        retrieves the saved (channel id, message id) pairs from Discord, in the same order
+        Channels are retrieved concurrently, up to rehydrateconcurrency at once.
+        Messages which can't be retrieved (deleted, no permissions, private) are left out'''
+        msg_ids_by_channel = OrderedDict()
+        for channel_id, msg_id in saved_messages:
+            msg_ids_by_channel.setdefault(channel_id, set()).add(msg_id)
+        found = dict()  # message id -> discord.Message
+        progress = {'channels': 0, 'total': len(msg_ids_by_channel), 'found': found}
+        semaphore = asyncio.Semaphore(self.rehydrate_concurrency)
+        tasks = [self._rehydrate_channel(channel_id, msg_ids_by_channel[channel_id], found, semaphore, progress) for channel_id in msg_ids_by_channel]
+        if tasks:
+            yield from asyncio.gather(*tasks)
+        result = list()
+        for channel_id, msg_id in saved_messages:
+            if msg_id in found:
+                result.append(found.pop(msg_id))  # pop prevents duplicates
+        return result
+
+    @asyncio.coroutine
+    def _rehydrate_channel(self, channel_id, msg_ids, found, semaphore, progress):
+        '''(Bot, str, set of str, dict, asyncio.Semaphore, dict) -> None
+        retrieves msg_ids from the channel into found'''
+        server, channel = self.find_channel(channel_id)
+        if server is None:
+            # PATCH: private messages can't be loaded properly, this prevents them from being used
+            self.log.warning("Unable to load %a messages from channel %a" % (len(msg_ids), channel_id))
+        else:
+            yield from semaphore.acquire()
+            try:
+                yield from self._retrieve_channel_messages(channel, msg_ids, found)
+            except (discord.HTTPException, discord.InvalidArgument) as e:
+                # prevents the following, respectively: channel deleted/not-accessible, bot permissions changed, malformed save file
+                self.log.warning("Unable to load messages from channel %a: %s" % (channel_id, e))
+            finally:
+                semaphore.release()
+            missing = len([msg_id for msg_id in msg_ids if msg_id not in found])
+            if missing:
+                self.log.warning("Unable to load %a messages from channel %a" % (missing, channel_id))
+        # report progress roughly every 10%
+        progress['channels'] += 1
+        if progress['channels'] == progress['total'] or progress['channels'] % max(1, progress['total']//10) == 0:
+            self.log.info("Loaded messages from %s/%s channels (%s messages so far)" % (progress['channels'], progress['total'], len(progress['found'])))
+
+    @asyncio.coroutine
+    def _retrieve_channel_messages(self, channel, msg_ids, found):
+        '''(Bot, discord.Channel, set of str, dict) -> None
+        retrieves msg_ids from channel into found, using history requests where messages are clustered
+        Each history request starts just before the oldest message that's still needed,
+        so every request retrieves at least one needed message (unless it was deleted)'''
+        remaining = sorted(int(msg_id) for msg_id in msg_ids)
+        while remaining:
+            if len(remaining) == 1:
+                try:
+                    page = [(yield from self.http.get_message(channel.id, str(remaining[0])))]
+                except discord.NotFound:
+                    return  # deleted message
+            else:
+                page = yield from self.http.logs_from(channel.id, HISTORY_LIMIT, after=str(remaining[0] - 1))
+            newest = remaining[0]
+            for data in page:
+                newest = max(newest, int(data['id']))
+                if data['id'] in msg_ids:
+                    found[data['id']] = self.connection._create_message(channel=channel, **data)
+            if len(page) < HISTORY_LIMIT:
+                return  # there are no more messages after this page, so the remaining ones were deleted
+            remaining = [msg_id for msg_id in remaining if msg_id > newest]
+
+    def build_channel_index(self):
+        '''(Bot) -> None
+        (re)builds the channel id index of every server channel the bot can see'''
+        self.channel_index = dict()
+        for server in self.servers:
+            self.index_server(server)
+
+    def index_server(self, server):
+        '''(Bot, discord.Server) -> None
+        adds all of server's channels to the channel id index'''
+        for channel in server.channels:
+            self.channel_index[channel.id] = (server, channel)
+
+    def unindex_server(self, server):
+        '''(Bot, discord.Server) -> None
+        removes all of server's channels from the channel id index'''
+        for channel_id in [channel_id for channel_id in self.channel_index if self.channel_index[channel_id][0].id == server.id]:
+            del self.channel_index[channel_id]
+
+    @asyncio.coroutine
+    def on_channel_create(self, channel):
+        if not channel.is_private:
+            self.channel_index[channel.id] = (channel.server, channel)
+
+    @asyncio.coroutine
+    def on_channel_delete(self, channel):
+        self.channel_index.pop(channel.id, None)
+
+    @asyncio.coroutine
+    def on_channel_update(self, before, after):
+        if not after.is_private:
+            self.channel_index[after.id] = (after.server, after)
+
+    @asyncio.coroutine
+    def on_server_join(self, server):
+        self.index_server(server)
+
+    @asyncio.coroutine
+    def on_server_remove(self, server):
+        self.unindex_server(server)
+        # discord.py replaces the message cache with a plain deque when a server is removed
+        self.install_message_cache()
+
+    @asyncio.coroutine
+    def on_server_available(self, server):
+        self.index_server(server)
+
+    def find_channel(self, channel_id):
+        '''(Bot, str) -> (discord.Server, discord.Channel)
+        finds the channel with id channel_id, and the server it's in
+        The server is None for private channels; both are None if the channel can't be found'''
+        if channel_id in self.channel_index:
+            return self.channel_index[channel_id]
+        result = (None, None)
         for channel in self.private_channels:  # NOTE: private_channels is not loaded at startup, so it will contain nothing initially
             # NOTE: private_channels is loaded when you send a message, though, to make things weirder
-            # print(channel.id==channel_id)
             if channel.id == channel_id:
-                msg.server = None
-                msg.channel = channel
+                result = (None, channel)
                 break
-        # match server to msg
+        if self.channel_index:
+            # the index is up to date, so it's not a server channel
+            return result
+        # the index hasn't been built yet (before on_ready)
         for server in self.servers:
             for channel in server.channels:
                 if channel.id == channel_id:
-                    msg.server = server
-                    msg.channel = channel
-                    break
+                    return (server, channel)
+        return result
+
+    @asyncio.coroutine
+    def get_message_properly(self, channel_id, msg_id):
+        '''(Bot, str, str) -> discord.Message
+        retrieves a message with id msg_id from channel_id which has (most) variables properly defined
+        unlike the API's darn annoying default thing that doesn't set anything that I didn't already know arrrg!!'''
+        msg = yield from self.get_message(discord.Object(channel_id), msg_id)
+        # get_message returns a discord.Message which is lacking a certain variables, including .server and .channel
+        # match server and channel to msg
+        server, channel = self.find_channel(channel_id)
+        if channel is not None:
+            msg.server = server
+            msg.channel = channel
         if isinstance(msg, str):
             print("What the fuck", msg_id)
         return msg
@@ -526,21 +1236,81 @@ class Bot(discord.Client):
     @asyncio.coroutine
     def message_stuff(self):
         '''(Bot) -> None
-        Convenience function for calling save_messages(), save_always_watched_messages() and sync_always_watched() in one line'''
+        Convenience function for doing everything that needs to be done with messages when one is received
+        (always watched messages are kept in self.messages by _on_watch_add(), so they don't need to be synced here)'''
+        self.mark_messages_changed()
+
+    def mark_messages_changed(self, changes=1):
+        '''(Bot, int) -> None
+        mark the message backups as out of date
+        they're saved within messagesaveperiod seconds, or sooner once messagesavethreshold changes pile up'''
+        self.unsaved_message_changes += changes
+        if self.unsaved_message_changes >= self.message_save_threshold:
+            self.message_save_event.set()
+
+    @asyncio.coroutine
+    def _save_messages_loop(self):
+        '''(Bot) -> None
+        the looping task which saves out of date message backups'''
+        while True:
+            try:
+                yield from asyncio.wait_for(self.message_save_event.wait(), self.message_save_period)
+            except asyncio.TimeoutError:
+                pass
+            self.message_save_event.clear()
+            self.flush_messages()
+
+    @asyncio.coroutine
+    def _save_metrics_loop(self):
+        '''(Bot) -> None
+        the looping task which dumps add-on metrics to metricsloc'''
+        while True:
+            yield from asyncio.sleep(self.metrics_save_period)
+            self.save_metrics()
+
+    def save_metrics(self):
+        if self.METRICS_LOCATION not in self.data_config:
+            return
+        try:
+            self.metrics.save(self.data_config[self.METRICS_LOCATION])
+        except OSError as e:
+            self.log.warning('Failed to save add-on metrics: %s' % e)
+
+    def metrics_report(self):
+        '''(Bot) -> dict
+        Returns the latency and throughput of every command and reaction command (see libs.metrics), for admin add-ons'''
+        return self.metrics.report()
+
+    def plugin_schedule(self):
+        '''(Bot) -> dict
+        Returns when each plugin next runs and how its runs have gone (see libs.scheduler), for admin add-ons'''
+        if self.plugin_scheduler is None:
+            return None
+        return {name: self.plugin_scheduler.info(self.plugins[name]) for name in self.plugins}
+
+    def loop_lag_report(self):
+        '''(Bot) -> dict
+        Returns event loop lag statistics and which add-ons blocked the loop (see libs.loopmonitor), for admin add-ons'''
+        if self.loop_monitor is None:
+            return None
+        return self.loop_monitor.report()
+
+    def flush_messages(self):
+        '''(Bot) -> None
+        save the message backups now, if they're out of date'''
+        if not self.unsaved_message_changes or LOADING_WARNING in self.always_watch_messages:
+            return  # keep changes marked until loading is done
+        self.unsaved_message_changes = 0
         self.save_messages()
         self.save_always_watched_messages()
-        self.sync_always_watched()
 
     def save_messages(self):
         '''(Bot) -> None
         backup self.messages deque'''
         global _messages
         if LOADING_WARNING not in self.always_watch_messages:  # if not still loading messages (likely from startup)
-            messagefile = dataloader.newdatafile(dataloader.datafile("./data/config.config").content["DEFAULT"][MSG_BACKUP_LOCATION])
-            for msg in self.messages:
-                messagefile.content.append(msg.channel.id + ":" + msg.id)
-            messagefile.save()
-            # self.log.info("Saved %a messages" % len(messagefile.content))
+            self.message_journal.save((msg.channel.id, msg.id) for msg in self.messages)
+            # self.log.info("Saved %a messages" % len(self.message_journal.live))
             _messages = self.messages
         else:
             self.log.info("Messages are still being loaded, skipping save messages")
@@ -549,20 +1319,58 @@ class Bot(discord.Client):
         '''(Bot) -> None
         backup self.always_watch_messages set'''
         if LOADING_WARNING not in self.always_watch_messages:  # if not still loading messages (likely from startup)
-            watchfile = dataloader.newdatafile(dataloader.datafile("./data/config.config").content["DEFAULT"][WATCH_MSG_LOCATION])
-            for msg in self.always_watch_messages:
-                watchfile.content.append(msg.channel.id + ":" + msg.id)
-            watchfile.save()
-            # self.log.info("Saved %a watched messages" % len(watchfile.content))
+            self.watch_journal.save((msg.channel.id, msg.id) for msg in self.always_watch_messages)
+            # self.log.info("Saved %a watched messages" % len(self.watch_journal.live))
         else:
             self.log.info("Messages are still being loaded, skipping save always watched messages")
 
     def sync_always_watched(self):
         '''(Bot) -> None
         ensure self.messages contains all the necessary messages in the watch list'''
+        message_cache = self.get_message_cache()
         for msg in self.always_watch_messages:
-            if msg not in self.messages and msg != LOADING_WARNING:
-                self.messages.append(msg)
+            if msg != LOADING_WARNING:
+                message_cache.pin(msg)
+
+    def install_message_cache(self):
+        '''(Bot) -> None
+        replaces discord.py's message deque with an id-indexed MessageCache, if it isn't one already'''
+        if not isinstance(self.connection.messages, msgcache.MessageCache):
+            # role messages and watched messages are never evicted
+            self.connection.messages = msgcache.MessageCache(self.connection.messages,
+                maxlen=self.connection.max_messages,
+                max_bytes=self.max_message_bytes,
+                lru=self.max_message_bytes is not None,
+                pin_sources=[self.role_messages])
+            self.sync_always_watched()
+        # discord.py looks up messages (eg for reactions) by searching every message; use the index instead
+        self.connection._get_message = self.connection.messages.get
+
+    def get_message_cache(self):
+        '''(Bot) -> msgcache.MessageCache
+        returns the message cache (self.messages), making sure it's a MessageCache'''
+        if not isinstance(self.connection.messages, msgcache.MessageCache):
+            self.install_message_cache()
+        return self.connection.messages
+
+    def message_cache_stats(self):
+        '''(Bot) -> dict
+        returns the message cache's size and hit/miss/eviction counters'''
+        return self.get_message_cache().stats()
+
+    def _on_watch_add(self, msg):
+        '''(Bot, discord.Message) -> None
+        called when a message is added to always_watch_messages'''
+        if msg != LOADING_WARNING:
+            self.get_message_cache().pin(msg)
+            self.mark_messages_changed()
+
+    def _on_watch_remove(self, msg):
+        '''(Bot, discord.Message) -> None
+        called when a message is removed from always_watch_messages'''
+        if msg != LOADING_WARNING:
+            self.get_message_cache().unpin(msg)
+            self.mark_messages_changed()
 
     def _on_command_error(self, cmd_name, error, message):
         '''(Bot, str) -> None
@@ -586,7 +1394,7 @@ class Bot(discord.Client):
         yield from self.on_reaction_add_error(cmd_name, error, rxn, user)
 
     @asyncio.coroutine
-    def on_reaction_add_error(self, cmd_name, error):
+    def on_reaction_add_error(self, cmd_name, error, rxn, user):
         '''(Bot, str) -> None
         method to catch and report errors from reactions
         This should not raise it's own errors!'''
@@ -618,6 +1426,18 @@ class Bot(discord.Client):
         for cmd_name in self.plugins:
             self.plugins[cmd_name]._shutdown()
 
+        if self.loop_monitor is not None:
+            self.loop_monitor.stop()
+        if self.outbound is not None:
+            self.outbound.stop()
+        if self.plugin_scheduler is not None:
+            self.plugin_scheduler.stop()
+        if self.worker_pool is not None:
+            self.worker_pool.shutdown()
+        if self.io_executor is not None:
+            self.io_executor.shutdown(wait=False)
+        self.flush_messages()
+        self.save_metrics()
         savetome.save_role_messages(self.data_config[ROLE_MSG_LOCATION], self.role_messages)
         self.loop.run_until_complete(self.logout())
         self._cancel_all_tasks()
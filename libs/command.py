@@ -20,7 +20,19 @@ DEFAULT = addon.DEFAULT
 
 class Command(addon.AddOn):
     '''Command represents a command that the discord bot can use to take action
-    based on messages posted in any discord channels it listens to.'''
+    based on messages posted in any discord channels it listens to.
+
+    Commands may declare triggers so that the bot only checks matches() when
+    a message could possibly match (see libs.dispatch):
+    trigger_prefixes: strings which the message must start with (case insensitive)
+    trigger_keywords: words which must appear in the message (case insensitive)
+    trigger_patterns: regexes (str or compiled) which must be found in the message
+    If any one trigger is found, matches() is checked like usual.
+    Commands which don't declare any triggers always have matches() checked.'''
+
+    trigger_prefixes = tuple()
+    trigger_keywords = tuple()
+    trigger_patterns = tuple()
 
     def __init__(self, perms_loc=None, api_methods=dict(), always_watch_messages=set(), role_messages=dict(), namespace=None, events=dict(), **kwargs):
         '''(str, dict, set, dict, CustomNamespace) -> Command
@@ -97,7 +109,8 @@ class Command(addon.AddOn):
 
 class BenchmarkableCommand(Command):
     '''Extending BenchmarkableCommand will make the bot respond with the time
-    it took to execute a command if "benchmark" appears in the message.'''
+    it took to execute a command if "benchmark" appears in the message.
+    Deprecated: the bot now measures every command (see libs.metrics and Bot.metrics_report())'''
     def __init__(self, *args, **kwargs):
         warnings.warn('BenchmarkableCommand is no longer supported', DeprecationWarning)
         super().__init__(*args, **kwargs)
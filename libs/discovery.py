@@ -0,0 +1,142 @@
+'''
+Persisted cache of what the bot found while discovering add-ons, so that
+unchanged folders and files don't need to be searched and imported again to
+find out what they contain.
+
+Folder listings are remembered until the folder's mtime changes (which happens
+whenever a file is added, removed or renamed in it).
+Each add-on file's entry (its kind, resolved config/perms/emoji locations,
+declared triggers and emoji map) is remembered until the file's mtime or size changes.
+
+The cache is only a shortcut; deleting it just makes the next startup slower.
+
+@author: NGnius
+'''
+
+import json, os, logging
+
+# entry keys
+MTIME = 'mtime'
+SIZE = 'size'
+KIND = 'kind'  # libs.addon.COMMAND, REACTION or PLUGIN, or None for files which contain no add-on
+CONFIG = 'config'
+PERMS_LOC = 'perms_loc'
+EMOJI_LOC = 'emoji_loc'
+TRIGGERS = ('trigger_prefixes', 'trigger_keywords', 'trigger_patterns')
+EMOJI = 'emoji'
+
+FOLDERS = 'folders'
+FILES = 'files'
+VERSION = 'version'
+CACHE_VERSION = 1
+
+log = logging.getLogger('main')
+
+class DiscoveryCache:
+    '''Cache of add-on folder listings and add-on file descriptions, stored at filename'''
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.folders = dict()  # folder -> {mtime, items: [[name, is_file], ...]}
+        self.files = dict()  # path -> entry
+        self.changed = False
+        self.hits = 0
+        self.misses = 0
+
+    def load(self):
+        '''(DiscoveryCache) -> None
+        Reads the cache from disk. A missing, corrupt or outdated cache is treated as empty'''
+        self.folders = dict()
+        self.files = dict()
+        self.changed = False
+        if not self.filename or not os.path.isfile(self.filename):
+            return
+        try:
+            with open(self.filename, 'r') as file:
+                content = json.load(file)
+            if content.get(VERSION) == CACHE_VERSION:
+                self.folders = dict(content[FOLDERS])
+                self.files = dict(content[FILES])
+        except (ValueError, KeyError, TypeError, AttributeError, OSError) as e:
+            log.warning('Ignoring unreadable add-on discovery cache %s (%s)' % (self.filename, e))
+
+    def save(self):
+        '''(DiscoveryCache) -> None
+        Writes the cache to disk, if it changed'''
+        if not self.filename or not self.changed:
+            return
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'w') as file:
+            json.dump({VERSION: CACHE_VERSION, FOLDERS: self.folders, FILES: self.files}, file)
+        os.replace(temp_filename, self.filename)
+        self.changed = False
+
+    def listdir(self, folder):
+        '''(DiscoveryCache, str) -> list of (str, bool)
+        Returns the (name, is a file) of every item in folder, sorted by name'''
+        mtime = os.stat(folder).st_mtime_ns
+        cached = self.folders.get(folder)
+        if cached is not None and cached[MTIME] == mtime:
+            self.hits += 1
+            return [tuple(item) for item in cached['items']]
+        self.misses += 1
+        items = [(item, os.path.isfile(os.path.join(folder, item))) for item in sorted(os.listdir(folder))]
+        self.folders[folder] = {MTIME: mtime, 'items': items}
+        self.changed = True
+        return items
+
+    def get(self, path):
+        '''(DiscoveryCache, str) -> dict
+        Returns the entry for the file at path, or None if there isn't one or the file has changed since'''
+        entry = self.files.get(path)
+        if entry is not None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat is not None and entry[MTIME] == stat.st_mtime_ns and entry[SIZE] == stat.st_size:
+                self.hits += 1
+                return entry
+        self.misses += 1
+        return None
+
+    def put(self, path, kind, **info):
+        '''(DiscoveryCache, str, str) -> dict
+        Records what the file at path contains, as of now'''
+        stat = os.stat(path)
+        entry = {MTIME: stat.st_mtime_ns, SIZE: stat.st_size, KIND: kind}
+        entry.update(info)
+        self.files[path] = entry
+        self.changed = True
+        return entry
+
+    def prune(self, paths):
+        '''(DiscoveryCache, collection of str) -> None
+        Forgets every file which isn't in paths (eg files which were deleted)'''
+        for path in [path for path in self.files if path not in paths]:
+            del self.files[path]
+            self.changed = True
+
+def describe(addon_instance):
+    '''(AddOn) -> dict
+    Returns the declared triggers of addon_instance which can be saved in the cache.
+    Compiled patterns are left out, since they can't be stored as JSON'''
+    description = dict()
+    for trigger in TRIGGERS:
+        values = getattr(addon_instance, trigger, None) or tuple()
+        if all(isinstance(value, str) for value in values):
+            description[trigger] = list(values)
+        else:
+            description[trigger] = None
+    return description
+
+def describe_emoji(addon_instance):
+    '''(ReactionCommand) -> dict
+    Returns addon_instance's emoji map, which can be saved in the cache, if it has one that can be stored as JSON
+    and it's only matched by the emojis in it'''
+    emoji = getattr(addon_instance, 'emoji', None)
+    if not isinstance(emoji, dict) or not getattr(addon_instance, 'emoji_indexed', True):
+        return dict()
+    if not all(isinstance(server_id, str) and (value is None or isinstance(value, str)) for server_id, value in emoji.items()):
+        return dict()
+    return {EMOJI: dict(emoji)}
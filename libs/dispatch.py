@@ -0,0 +1,238 @@
+'''
+Indexes for picking out which add-ons could care about an event, so that the
+bot doesn't have to ask every add-on about every message.
+
+Commands can declare triggers (see libs.command.Command) which are compiled
+into a CommandIndex. A message is scanned once against all the triggers
+and only the commands which were triggered (plus any commands which declare
+no triggers) are passed on to their _matches() method.
+
+Reaction commands are indexed by the emojis in their emoji maps in the same way,
+with a ReactionIndex.
+
+Indexes are only a pre-filter; _matches() always has the final say.
+
+@author: NGnius
+'''
+
+import re
+
+# trigger attribute names, as declared on libs.command.Command
+PREFIXES = 'trigger_prefixes'
+KEYWORDS = 'trigger_keywords'
+PATTERNS = 'trigger_patterns'
+
+WORD_REGEX = re.compile(r'\w+')
+BACKREFERENCE_REGEX = re.compile(r'\\\d|\(\?P=')
+DEFAULT_PATTERN_FLAGS = re.I
+
+class PrefixTrie:
+    '''Character trie of lowercase prefixes, mapping each prefix to the names of
+    the commands which declared it'''
+
+    def __init__(self):
+        self.root = dict()
+        self._END = None  # key for the names stored at a node
+
+    def add(self, prefix, name):
+        node = self.root
+        for char in prefix.lower():
+            node = node.setdefault(char, dict())
+        node.setdefault(self._END, set()).add(name)
+
+    def search(self, string):
+        '''(PrefixTrie, str) -> set of str
+        Returns the names of all commands with a prefix which string starts with'''
+        found = set()
+        node = self.root
+        for char in string.lower():
+            if char not in node:
+                break
+            node = node[char]
+            if self._END in node:
+                found.update(node[self._END])
+        return found
+
+class CommandIndex:
+    '''A dispatch index over an ordered mapping of names to commands.
+
+    candidates(message) returns the names of the commands which could match
+    message, in the same order as the mapping it was built from.'''
+
+    def __init__(self, commands=dict()):
+        self.names = list()  # names in registry order
+        self.positions = dict()  # name -> registry position, for ordering results
+        self.fallback = list()  # positions of commands without triggers
+        self.prefixes = PrefixTrie()
+        self.keywords = dict()  # lowercase word -> set of names
+        self.patterns = list()  # list of (compiled combined pattern, [(compiled pattern, name), ...])
+        self.build(commands)
+
+    def build(self, commands):
+        '''(CommandIndex, ordered mapping) -> None
+        (Re)builds the index from commands'''
+        self.names = list(commands)
+        self.positions = dict()
+        self.fallback = list()
+        self.prefixes = PrefixTrie()
+        self.keywords = dict()
+        patterns_by_flags = dict()
+        uncombinable = list()
+        for position, name in enumerate(commands):
+            self.positions[name] = position
+            cmd = commands[name]
+            prefixes = getattr(cmd, PREFIXES, None) or tuple()
+            keywords = getattr(cmd, KEYWORDS, None) or tuple()
+            patterns = getattr(cmd, PATTERNS, None) or tuple()
+            if not (prefixes or keywords or patterns):
+                self.fallback.append(position)
+                continue
+            for prefix in prefixes:
+                self.prefixes.add(prefix, name)
+            for keyword in keywords:
+                self.keywords.setdefault(keyword.lower(), set()).add(name)
+            for pattern in patterns:
+                if isinstance(pattern, str):
+                    pattern = re.compile(pattern, DEFAULT_PATTERN_FLAGS)
+                if BACKREFERENCE_REGEX.search(pattern.pattern) is not None:
+                    # group numbers change in an alternation, so this can't be combined
+                    uncombinable.append((pattern, name))
+                else:
+                    patterns_by_flags.setdefault(pattern.flags, list()).append((pattern, name))
+        self.patterns = list()
+        for flags in patterns_by_flags:
+            self.patterns.append((combine_patterns(patterns_by_flags[flags], flags), patterns_by_flags[flags]))
+        if uncombinable:
+            self.patterns.append((None, uncombinable))
+
+    def triggered(self, content):
+        '''(CommandIndex, str) -> set of str
+        Returns the names of all commands with a trigger in content'''
+        found = self.prefixes.search(content)
+        if self.keywords:
+            for word in WORD_REGEX.findall(content.lower()):
+                if word in self.keywords:
+                    found.update(self.keywords[word])
+        for combined, patterns in self.patterns:
+            # one scan to rule out the common case where nothing matches
+            if combined is not None and combined.search(content) is None:
+                continue
+            for pattern, name in patterns:
+                if name not in found and pattern.search(content) is not None:
+                    found.add(name)
+        return found
+
+    def candidates(self, message):
+        '''(CommandIndex, discord.Message) -> list of str
+        Returns the names of all commands which may match message, in registry order'''
+        content = message.content or ''
+        positions = self.fallback + [self.positions[name] for name in self.triggered(content)]
+        return [self.names[position] for position in sorted(positions)]
+
+def combine_patterns(patterns, flags):
+    '''(list of (compiled pattern, str), int) -> compiled pattern or None
+    Joins patterns into a single alternation, or returns None if that's not possible
+    (eg duplicate group names)'''
+    try:
+        return re.compile('|'.join('(?:%s)' % pattern.pattern for pattern, name in patterns), flags)
+    except (re.error, TypeError):
+        return None
+
+class IndexedDict(dict):
+    '''dict which calls on_change() whenever it's modified, so that an index
+    built from its contents knows to rebuild itself'''
+
+    def __init__(self, *args, on_change=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_change = on_change
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.on_change()
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._changed()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self._changed()
+        return result
+
+    def setdefault(self, key, default=None):
+        result = super().setdefault(key, default)
+        self._changed()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+class ReactionIndex:
+    '''A dispatch index over an ordered mapping of names to reaction commands,
+    keyed by the (server id, emoji) pairs in each reaction command's emoji map.
+
+    candidates(reaction) returns the names of the reaction commands which could
+    match reaction, in the same order as the mapping it was built from.
+    Reaction commands with emoji set to None, or with emoji_indexed set to False
+    (see libs.reaction.ReactionCommand), are always candidates.'''
+
+    def __init__(self, reactions=dict()):
+        self.names = list()  # names in registry order
+        self.fallback = list()  # positions of reaction commands which match any emoji
+        self.by_server = dict()  # server id -> positions of reaction commands which match any emoji in that server
+        self.by_emoji = dict()  # (server id, emoji id or unicode emoji) -> positions
+        self.build(reactions)
+
+    def build(self, reactions):
+        '''(ReactionIndex, ordered mapping) -> None
+        (Re)builds the index from reactions'''
+        self.names = list(reactions)
+        self.fallback = list()
+        self.by_server = dict()
+        self.by_emoji = dict()
+        for position, name in enumerate(reactions):
+            emoji = getattr(reactions[name], 'emoji', None)
+            if not isinstance(emoji, dict) or not getattr(reactions[name], 'emoji_indexed', True):
+                self.fallback.append(position)
+                continue
+            for server_id in emoji:
+                if not emoji[server_id]:
+                    self.by_server.setdefault(server_id, list()).append(position)
+                    continue
+                try:
+                    self.by_emoji.setdefault((server_id, emoji[server_id]), list()).append(position)
+                except TypeError:
+                    # unhashable emoji, so it can't be indexed
+                    self.by_server.setdefault(server_id, list()).append(position)
+
+    def candidates(self, reaction):
+        '''(ReactionIndex, discord.Reaction) -> list of str
+        Returns the names of all reaction commands which may match reaction, in registry order'''
+        server = reaction.message.server
+        if server is None:
+            positions = self.fallback
+        else:
+            positions = self.fallback + self.by_server.get(server.id, list()) \
+                + self.by_emoji.get((server.id, emoji_key(reaction.emoji)), list())
+        return [self.names[position] for position in sorted(positions)]
+
+def emoji_key(emoji):
+    '''(discord.Emoji or str) -> str
+    Returns the key which an emoji is stored as in a reaction command's emoji map'''
+    if isinstance(emoji, str):
+        return emoji
+    return getattr(emoji, 'id', None)
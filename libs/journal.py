@@ -0,0 +1,124 @@
+'''
+Append-only binary journal of (channel id, message id) pairs, used to back up
+the bot's message cache and watched messages between restarts.
+
+Every record is a pair of little-endian unsigned 64-bit integers (16 bytes),
+after a 16 byte header. Discord ids are snowflakes, which never use the top
+bit, so that bit of the channel id marks a record as a removal.
+Saving only appends the pairs which changed since the last save; once the
+journal grows to compactratio times the number of live pairs, it's rewritten
+with only the live pairs.
+
+@author: NGnius
+'''
+
+import mmap, os, struct
+from collections import OrderedDict
+
+HEADER = b'IDEAMSGJOURNAL\x00\x01'  # magic + version, padded to one record
+RECORD = struct.Struct('<QQ')
+REMOVED = 1 << 63
+COMPACT_RATIO = 2
+MIN_COMPACT_RECORDS = 1024
+
+class MessageJournal:
+    '''Journal of (channel id, message id) str pairs stored at filename'''
+
+    def __init__(self, filename, compact_ratio=COMPACT_RATIO):
+        self.filename = filename
+        self.compact_ratio = compact_ratio
+        self.live = OrderedDict()  # (channel id, message id) -> None, in the order they were added
+        self.records = 0  # records in the file, including removals and replaced pairs
+        self.loaded = False  # whether live reflects what's on disk
+
+    def load(self):
+        '''(MessageJournal) -> list of (str, str)
+        Replays the journal from disk and returns the saved pairs, oldest first'''
+        self.live = OrderedDict()
+        self.records = 0
+        self.loaded = True
+        if not os.path.isfile(self.filename):
+            return list()
+        with open(self.filename, 'rb+') as file:
+            header = file.read(len(HEADER))
+            if header != HEADER:
+                if HEADER.startswith(header):
+                    # empty, or the first save was interrupted while writing the header
+                    self.loaded = len(header) == 0
+                    return list()
+                self.loaded = False
+                raise ValueError('%s is not a message journal' % self.filename)
+            size = os.fstat(file.fileno()).st_size
+            usable = size - (size - len(HEADER)) % RECORD.size
+            if usable < size:
+                # a save was interrupted part way through a record
+                file.truncate(usable)
+            if usable <= len(HEADER):
+                return list()
+            with mmap.mmap(file.fileno(), usable, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for channel_id, msg_id in RECORD.iter_unpack(view[len(HEADER):]):
+                        self.records += 1
+                        if channel_id & REMOVED:
+                            self.live.pop((str(channel_id ^ REMOVED), str(msg_id)), None)
+                        else:
+                            self.live[(str(channel_id), str(msg_id))] = None
+                finally:
+                    view.release()
+        return list(self.live)
+
+    def import_pairs(self, pairs):
+        '''(MessageJournal, iterable of (str, str)) -> None
+        Replaces the journal's contents with pairs (eg from an old text backup)'''
+        self.live = OrderedDict((pair, None) for pair in pairs)
+        self.compact()
+
+    def save(self, pairs):
+        '''(MessageJournal, iterable of (str, str)) -> int
+        Makes the journal contain exactly pairs, by appending only what changed.
+        Returns the number of records written'''
+        pairs = OrderedDict((pair, None) for pair in pairs)
+        if not self.loaded:
+            # what's on disk is unknown, so appending changes isn't safe
+            self.live = pairs
+            return self.compact()
+        removed = [pair for pair in self.live if pair not in pairs]
+        added = [pair for pair in pairs if pair not in self.live]
+        if not removed and not added:
+            return 0
+        for pair in removed:
+            del self.live[pair]
+        for pair in added:
+            self.live[pair] = None
+        if self.records + len(removed) + len(added) > max(MIN_COMPACT_RECORDS, self.compact_ratio * len(self.live)):
+            return self.compact()
+        data = b''.join([pack(channel_id, msg_id, removal=True) for channel_id, msg_id in removed]\
+            + [pack(channel_id, msg_id) for channel_id, msg_id in added])
+        new_file = not os.path.isfile(self.filename) or os.path.getsize(self.filename) == 0
+        with open(self.filename, 'ab') as file:
+            if new_file:
+                file.write(HEADER)
+            file.write(data)
+        self.records += len(removed) + len(added)
+        return len(removed) + len(added)
+
+    def compact(self):
+        '''(MessageJournal) -> int
+        Rewrites the journal with only the live pairs. Returns the number of records written'''
+        temp_filename = self.filename + '.tmp'
+        with open(temp_filename, 'wb') as file:
+            file.write(HEADER)
+            file.write(b''.join(pack(channel_id, msg_id) for channel_id, msg_id in self.live))
+        os.replace(temp_filename, self.filename)
+        self.records = len(self.live)
+        self.loaded = True
+        return self.records
+
+def pack(channel_id, msg_id, removal=False):
+    '''(str, str, bool) -> bytes
+    Packs a (channel id, message id) pair into a record'''
+    channel_id = int(channel_id)
+    if removal:
+        channel_id |= REMOVED
+    return RECORD.pack(channel_id, int(msg_id))
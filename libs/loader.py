@@ -7,7 +7,7 @@ This heavily relies on Python's importlib in order to allow for new add-ons to b
 @author: NGnius
 '''
 
-from libs import dataloader, plugin, addon
+from libs import dataloader, plugin, addon, command, reaction, profiler
 import importlib, logging
 from os import listdir
 from os.path import isfile, join
@@ -17,6 +17,11 @@ EMOJIS_LOCATION = 'emojiloc'
 PERMISSIONS_LOCATION = 'permissionsloc'
 CONFIGEND = 'configend'
 
+# add-on package manifest constants
+MANIFEST = 'manifest.json'
+TYPE = 'type'
+EMOJI = 'emoji'
+
 
 class CustomNamespace:
     '''For creating custom namespaces wherever necessary'''
@@ -34,7 +39,7 @@ emoji_dir=config.content[EMOJIS_LOCATION]
 def init_command(filename, namespace, bot, folder, package="", reload=False, **kwargs):
     config_end=config.content[CONFIGEND]
     events = {addon.READY:bot.wait_until_ready, addon.LOGIN:bot.wait_until_login, addon.MESSAGE:bot.wait_for_message, addon.REACTION:bot.wait_for_reaction}
-    api_methods = {addon.SEND_MESSAGE:bot.send_message, addon.EDIT_MESSAGE:bot.edit_message, addon.ADD_REACTION:bot.add_reaction, addon.REMOVE_REACTION:bot.remove_reaction, addon.SEND_TYPING:bot.send_typing, addon.SEND_FILE:bot.send_file}
+    api_methods = bot.get_api_methods()
     parameters = {'user':lambda: bot.user, 'namespace':namespace, 'always_watch_messages':bot.always_watch_messages, 'role_messages':bot.role_messages, 'api_methods':api_methods, 'events':events}
     # find config file
     if filename[:-len(".py")]+config_end in config.content:
@@ -43,18 +48,22 @@ def init_command(filename, namespace, bot, folder, package="", reload=False, **k
         parameters['config']=join(folder, package, filename[:-len(".py")]+'.config')
     else:
         parameters['config']=None
-    if package:
-        package=package+"."
-    temp_lib = importlib.import_module("commands."+package+filename[:-len(".py")]) # import command
-    if reload: # dumb way to do it, ik
-        temp_lib = importlib.reload(temp_lib)
-    parameters['perms_loc']=perms_dir+'c.'+package+filename[:-len(".py")]+".json"
-    return temp_lib.Command(**parameters, **kwargs) # init command
+    startup_profiler = get_profiler(bot)
+    with startup_profiler.profile(filename[:-len(".py")], package=package or None, kind=addon.COMMAND) as record:
+        if package:
+            package=package+"."
+        with startup_profiler.phase(record, profiler.IMPORT_TIME):
+            temp_lib = importlib.import_module("commands."+package+filename[:-len(".py")]) # import command
+            if reload: # dumb way to do it, ik
+                temp_lib = importlib.reload(temp_lib)
+        parameters['perms_loc']=perms_dir+'c.'+package+filename[:-len(".py")]+".json"
+        with startup_profiler.phase(record, profiler.INIT_TIME):
+            return temp_lib.Command(**parameters, **kwargs) # init command
 
 def init_reaction(filename, namespace, bot, folder, package="", emoji_dir="/", reload=False, **kwargs):
     config_end=config.content[CONFIGEND]
     events = {addon.READY:bot.wait_until_ready, addon.LOGIN:bot.wait_until_login, addon.MESSAGE:bot.wait_for_message, addon.REACTION:bot.wait_for_reaction}
-    api_methods = {addon.SEND_MESSAGE:bot.send_message, addon.EDIT_MESSAGE:bot.edit_message, addon.ADD_REACTION:bot.add_reaction, addon.REMOVE_REACTION:bot.remove_reaction, addon.SEND_TYPING:bot.send_typing, addon.SEND_FILE:bot.send_file}
+    api_methods = bot.get_api_methods()
     # user_func uses lambda to create a closure on bot. This way when bot.user
     # updates it's available to DirectOnlyCommand's without giving extra info.
     parameters = {'user':lambda: bot.user, 'namespace':namespace, 'always_watch_messages':bot.always_watch_messages, 'role_messages':bot.role_messages, 'api_methods':api_methods, 'events':events, 'all_emojis_func':bot.get_all_emojis}
@@ -65,22 +74,26 @@ def init_reaction(filename, namespace, bot, folder, package="", emoji_dir="/", r
         parameters['config']=join(folder, package, filename[:-len(".py")]+'.config')
     else:
         parameters['config']=None
-    if package!="":
-        package=package+"."
-    temp_lib = importlib.import_module("reactions."+package+filename[:-len(".py")]) # import reaction
-    if reload: # dumb way to do it, ik
-        temp_lib = importlib.reload(temp_lib)
-    # add reaction-specific parameters
-    parameters['perms_loc']=perms_dir+'r.'+package+filename[:-len(".py")]+".json"
-    parameters['emoji_loc']=emoji_dir+package+filename[:-len(".py")]+".json"
-    return temp_lib.Reaction(**parameters, **kwargs) # init reaction
+    startup_profiler = get_profiler(bot)
+    with startup_profiler.profile(filename[:-len(".py")], package=package or None, kind=addon.REACTION) as record:
+        if package!="":
+            package=package+"."
+        with startup_profiler.phase(record, profiler.IMPORT_TIME):
+            temp_lib = importlib.import_module("reactions."+package+filename[:-len(".py")]) # import reaction
+            if reload: # dumb way to do it, ik
+                temp_lib = importlib.reload(temp_lib)
+        # add reaction-specific parameters
+        parameters['perms_loc']=perms_dir+'r.'+package+filename[:-len(".py")]+".json"
+        parameters['emoji_loc']=emoji_dir+package+filename[:-len(".py")]+".json"
+        with startup_profiler.phase(record, profiler.INIT_TIME):
+            return temp_lib.Reaction(**parameters, **kwargs) # init reaction
 
 def init_plugin(filename, namespace, bot, folder, package="", reload=False, **kwargs):
     config_end=config.content[CONFIGEND]
     # generate parameters
     events = {addon.READY:bot.wait_until_ready, addon.LOGIN:bot.wait_until_login, addon.MESSAGE:bot.wait_for_message, addon.REACTION:bot.wait_for_reaction}
-    api_methods = {addon.SEND_MESSAGE:bot.send_message, addon.EDIT_MESSAGE:bot.edit_message, addon.ADD_REACTION:bot.add_reaction, addon.REMOVE_REACTION:bot.remove_reaction, addon.SEND_TYPING:bot.send_typing, addon.SEND_FILE:bot.send_file}
-    parameters = {'user':lambda: bot.user, 'namespace':namespace, 'events':events, 'api_methods':api_methods}
+    api_methods = bot.get_api_methods()
+    parameters = {'user':lambda: bot.user, 'namespace':namespace, 'events':events, 'api_methods':api_methods, 'worker_pool':getattr(bot, 'worker_pool', None), 'io_executor':getattr(bot, 'io_executor', None)}
 
     # find config file
     if filename[:-len(".py")]+config_end in config.content:
@@ -90,14 +103,23 @@ def init_plugin(filename, namespace, bot, folder, package="", reload=False, **kw
     else:
         parameters['config']=None
     # print(join(folder, package, filename[:-len(".py")]+'.config')) # config filepath
-    # import plugin
-    if package!="":
-        package=package+"."
-    temp_lib = importlib.import_module("plugins."+package+filename[:-len(".py")]) # import plugin
-    if reload: # dumb way to do it, ik
-        temp_lib = importlib.reload(temp_lib)
-    # init plugin and return it
-    return temp_lib.Plugin(**parameters, **kwargs)
+    startup_profiler = get_profiler(bot)
+    with startup_profiler.profile(filename[:-len(".py")], package=package or None, kind=addon.PLUGIN) as record:
+        # import plugin
+        if package!="":
+            package=package+"."
+        with startup_profiler.phase(record, profiler.IMPORT_TIME):
+            temp_lib = importlib.import_module("plugins."+package+filename[:-len(".py")]) # import plugin
+            if reload: # dumb way to do it, ik
+                temp_lib = importlib.reload(temp_lib)
+        # init plugin and return it
+        with startup_profiler.phase(record, profiler.INIT_TIME):
+            return temp_lib.Plugin(**parameters, **kwargs)
+
+def get_profiler(bot):
+    '''(Bot) -> profiler.StartupProfiler
+    Returns the bot's startup profiler, or a disabled one if it doesn't have one'''
+    return getattr(bot, 'startup_profiler', None) or profiler.DISABLED
 
 '''All loading functions work similarly
 All python files (files ending in .py) will be loaded from the appropriate folder, and any .py file in immediate sub-folder (eg for commands, any python files
@@ -179,3 +201,122 @@ def load_plugins(folder, bot, register=False):
                             bot.register_package(bot.PLUGINS, sub_item[:-len(".py")], item)
                             plugins[sub_item[:-len(".py")]]=init_plugin(sub_item, sub_namespaces[item], bot, folder, package=item)
     return plugins
+
+'''Lazy loading
+A package can include a manifest.json which describes its add-ons, so that they
+don't need to be imported until they're needed. The manifest maps filenames to
+descriptions, eg
+{
+    "hello.py": {"type": "command", "trigger_prefixes": ["!hello"]},
+    "vote.py": {"type": "reaction"}
+}
+Commands can declare triggers (see libs.command.Command) so that they're only
+imported once a message triggers them. Reactions can declare their emoji map
+(server id -> emoji, like ReactionCommand.emoji) under "emoji" so that they're only
+imported once one of those emojis is used; otherwise they're imported on the first reaction.
+Plugins, and add-ons which aren't in the manifest, are always loaded immediately.
+'''
+
+def load_manifest(folder):
+    '''(str) -> dict
+    Returns the add-on manifest in folder, or an empty dict if there isn't one'''
+    if not isfile(join(folder, MANIFEST)):
+        return dict()
+    manifest = dataloader.datafile(join(folder, MANIFEST), default_val=dict()).content
+    if not isinstance(manifest, dict):
+        log.warning('Ignoring malformed add-on manifest %s' % join(folder, MANIFEST))
+        return dict()
+    return manifest
+
+class LazyAddOn:
+    '''Mix-in for stand-ins of add-ons which haven't been imported yet.
+    load_func() should import the add-on, register it with the bot (replacing
+    the stand-in) and return it.
+    version_func() should return the version of the add-on's file (eg its mtime),
+    so that an add-on which failed to load is retried once its file changes'''
+    addon_class = addon.AddOn
+
+    def _init_lazy(self, load_func, description, version_func=None):
+        self.load_func = load_func
+        self.description = description
+        self.version_func = version_func
+        self.addon = None
+        self.failed = False
+        self.failed_version = None  # version of the file which failed to load
+
+    def _version(self):
+        return self.version_func() if self.version_func is not None else None
+
+    def _load(self):
+        '''(LazyAddOn) -> AddOn
+        Imports the add-on, if it hasn't been already, and returns it (or None if it failed to load)'''
+        if self.failed and self.version_func is not None and self._version() != self.failed_version:
+            self.failed = False  # the file changed, so it might be fixed
+        if self.addon is None and not self.failed:
+            try:
+                self.addon = self.load_func()
+            except Exception as e:
+                self._fail()  # don't keep trying to import a broken add-on
+                raise e
+            if not isinstance(self.addon, self.addon_class):
+                if self.addon is not None:
+                    log.warning('Add-on %s does not match its manifest description %s' % (self.addon, self.description))
+                self.addon = None
+                self._fail()
+        return self.addon
+
+    def _fail(self):
+        self.failed = True
+        self.failed_version = self._version()
+
+    def _help(self, *args, **kwargs):
+        addon_instance = self._load()
+        if addon_instance is None:
+            return self.DEFAULT_HELPSTRING
+        return addon_instance._help(*args, **kwargs)
+
+    def _shutdown(self):
+        pass  # nothing was loaded, so there's nothing to save
+
+class LazyCommand(LazyAddOn, command.Command):
+    '''Stand-in for a command which hasn't been imported yet'''
+    addon_class = command.Command
+
+    def __init__(self, load_func, description, version_func=None):
+        self._init_lazy(load_func, description, version_func)
+        self.perms = None
+        self.breaks_on_match = False
+        self.trigger_prefixes = tuple(description.get('trigger_prefixes', tuple()))
+        self.trigger_keywords = tuple(description.get('trigger_keywords', tuple()))
+        self.trigger_patterns = tuple(description.get('trigger_patterns', tuple()))
+
+    def _matches(self, message):
+        cmd = self._load()
+        return cmd is not None and cmd._matches(message)
+
+    def _action(self, message, *args):
+        cmd = self._load()
+        if cmd is not None:
+            yield from cmd._action(message, *args)
+
+class LazyReaction(LazyAddOn, reaction.ReactionAddCommand, reaction.ReactionRemoveCommand):
+    '''Stand-in for a reaction command which hasn't been imported yet
+    This is registered as both an add and a remove reaction command, so the bot
+    should _load() it before checking which kind of reaction command it really is'''
+    addon_class = reaction.ReactionCommand
+    emoji_indexed = True # by the emoji map in its description, which is only there for indexed reaction commands
+
+    def __init__(self, load_func, description, version_func=None):
+        self._init_lazy(load_func, description, version_func)
+        self.perms = None
+        emoji = description.get(EMOJI)
+        self.emoji = emoji if isinstance(emoji, dict) else None # without an emoji map, any reaction could be for it
+
+    def _matches(self, rxn, user):
+        reaction_command = self._load()
+        return reaction_command is not None and reaction_command._matches(rxn, user)
+
+    def _action(self, rxn, user, *args):
+        reaction_command = self._load()
+        if reaction_command is not None:
+            yield from reaction_command._action(rxn, user, *args)
@@ -0,0 +1,116 @@
+'''
+Event loop lag monitor, for finding add-ons which block the bot.
+
+Every add-on runs on the bot's single asyncio loop, so one blocking call (eg a
+synchronous file save or web request) freezes everything else.
+LoopMonitor measures how late a regular heartbeat on the loop is (the lag).
+A watchdog thread notices when the heartbeat stops for longer than a threshold,
+takes a sample of the loop thread's stack and blames the add-on module which
+is on the stack (eg addons.package.file), logging the sample.
+
+@author: NGnius
+'''
+
+import asyncio, sys, threading, time, traceback, logging
+from collections import deque
+
+from libs import metrics
+
+DEFAULT_INTERVAL = 0.1  # seconds between heartbeats
+DEFAULT_THRESHOLD = 0.25  # seconds the loop can be blocked before it's blamed on someone
+ADDON_MODULES = ('addons.', 'commands.', 'reactions.', 'plugins.')  # module name prefixes of add-ons
+UNKNOWN = '(bot)'  # blamed when no add-on is on the stack
+MAX_SAMPLES = 20
+STACK_DEPTH = 12  # innermost frames to keep in a sample
+
+class LoopMonitor:
+    '''Measures the lag of loop and blames long stalls on the add-ons which caused them
+
+    Call run() as a task on the loop being monitored, and stop() to end it'''
+
+    def __init__(self, loop, interval=DEFAULT_INTERVAL, threshold=DEFAULT_THRESHOLD, log=None, addon_modules=ADDON_MODULES):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.log = log if log is not None else logging.getLogger('main')
+        self.addon_modules = tuple(addon_modules)
+        self.lag = metrics.Histogram()
+        self.stalls = 0
+        self.blame = dict()  # module name -> {'stalls': int, 'time': seconds}
+        self.samples = deque(maxlen=MAX_SAMPLES)  # most recent stalls, oldest first
+        self.stopped = False
+        self._last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._culprit = None  # blamed for the current stall, by the watchdog
+        self._watchdog = None
+
+    async def run(self):
+        '''(LoopMonitor) -> None
+        the looping heartbeat; this must run on the monitored loop'''
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._watchdog = threading.Thread(target=self._watch, name='loop monitor', daemon=True)
+        self._watchdog.start()
+        while not self.stopped:
+            before = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._last_beat = now
+            lag = max(0.0, now - before - self.interval)
+            self.lag.add(lag)
+            culprit, self._culprit = self._culprit, None
+            if culprit is not None:
+                blame = self.blame.setdefault(culprit, {'stalls': 0, 'time': 0.0})
+                blame['stalls'] += 1
+                blame['time'] += lag
+                self.stalls += 1
+                self.log.warning('Event loop was blocked for %.3fs by %s' % (lag, culprit))
+
+    def stop(self):
+        self.stopped = True
+
+    def _watch(self):
+        sampled_beat = None
+        while not self.stopped:
+            time.sleep(self.interval)
+            last_beat = self._last_beat
+            if last_beat == sampled_beat:
+                continue  # already sampled this stall
+            if time.monotonic() - last_beat - self.interval > self.threshold:
+                sampled_beat = last_beat
+                self.sample()
+
+    def sample(self):
+        '''(LoopMonitor) -> dict
+        Samples the loop thread's stack and blames whichever add-on is on it for the current stall'''
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return None
+        culprit = self.attribute(frame)
+        stack = traceback.format_stack(frame)[-STACK_DEPTH:]
+        sample = {'time': time.time(), 'culprit': culprit, 'stack': stack}
+        self.samples.append(sample)
+        self._culprit = culprit
+        self.log.warning('Event loop blocked for more than %.3fs by %s, at:\n%s' % (self.threshold, culprit, ''.join(stack)))
+        return sample
+
+    def attribute(self, frame):
+        '''(LoopMonitor, frame) -> str
+        Returns the name of the innermost add-on module in frame's stack'''
+        while frame is not None:
+            module = frame.f_globals.get('__name__', '')
+            if module.startswith(self.addon_modules):
+                return module
+            frame = frame.f_back
+        return UNKNOWN
+
+    def report(self):
+        '''(LoopMonitor) -> dict
+        Returns lag statistics, who was blamed for stalls and the most recent stack samples'''
+        return {
+            'lag': self.lag.summary(),
+            'stalls': self.stalls,
+            'threshold': self.threshold,
+            'blame': {culprit: dict(self.blame[culprit]) for culprit in sorted(self.blame, key=lambda culprit: self.blame[culprit]['time'], reverse=True)},
+            'samples': list(self.samples)
+            }
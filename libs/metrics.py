@@ -0,0 +1,150 @@
+'''
+Latency and throughput metrics for add-ons, filled in by the bot as it
+dispatches messages and reactions, so that no add-on needs to subclass
+anything (unlike the old BenchmarkableCommand) to be measured.
+
+For every command and reaction command, MetricsRegistry keeps how many times
+it was checked (_matches()), how many times it matched, how many actions it
+ran and how many errors it raised, with histograms of how long checks and
+actions took.
+Action times are wall-clock times, so they include time spent waiting on
+Discord, not just time spent running on the event loop (see libs.loopmonitor).
+
+Histograms use logarithmic buckets (each about 19% wider than the last), so
+they use little memory and percentiles are accurate to within a bucket.
+
+@author: NGnius
+'''
+
+import json, math, os, time
+
+MIN_VALUE = 1e-6  # seconds; smaller values all go in the first bucket
+BUCKET_FACTOR = 2 ** 0.25
+PERCENTILES = (50, 95, 99)
+
+class Histogram:
+    '''Histogram of durations (in seconds) with logarithmic buckets'''
+
+    def __init__(self):
+        self.buckets = dict()  # bucket index -> count
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        if value < MIN_VALUE:
+            index = 0
+        else:
+            index = int(math.log(value / MIN_VALUE, BUCKET_FACTOR)) + 1
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, percent):
+        '''(Histogram, float) -> float
+        Returns (the upper end of the bucket of) the duration which percent% of durations are less than or equal to'''
+        if self.count == 0:
+            return 0.0
+        rank = math.ceil(self.count * percent / 100)
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(MIN_VALUE * BUCKET_FACTOR ** index, self.max)
+        return self.max
+
+    def summary(self):
+        '''(Histogram) -> dict
+        Returns the count, mean, max and percentiles of the durations'''
+        summary = {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max
+            }
+        for percent in PERCENTILES:
+            summary['p%d' % percent] = self.percentile(percent)
+        return summary
+
+class AddOnMetrics:
+    '''Counters and histograms for a single add-on'''
+
+    def __init__(self):
+        self.checks = 0
+        self.matches = 0
+        self.actions = 0
+        self.errors = 0
+        self.match_time = Histogram()
+        self.action_time = Histogram()
+
+    def summary(self, uptime):
+        return {
+            'checks': self.checks,
+            'matches': self.matches,
+            'actions': self.actions,
+            'errors': self.errors,
+            'actions_per_minute': 60 * self.actions / uptime if uptime > 0 else 0.0,
+            'match_time': self.match_time.summary(),
+            'action_time': self.action_time.summary()
+            }
+
+class MetricsRegistry:
+    '''Metrics of every add-on, grouped by kind (eg 'commands', 'reactions') then name'''
+
+    def __init__(self):
+        self.addons = dict()  # kind -> name -> AddOnMetrics
+        self.started = time.monotonic()
+
+    def get(self, kind, name):
+        '''(MetricsRegistry, str, str) -> AddOnMetrics
+        Returns the metrics of the add-on name, creating them if necessary'''
+        addons = self.addons.setdefault(kind, dict())
+        if name not in addons:
+            addons[name] = AddOnMetrics()
+        return addons[name]
+
+    def record_match(self, kind, name, seconds, matched):
+        metrics = self.get(kind, name)
+        metrics.checks += 1
+        if matched:
+            metrics.matches += 1
+        metrics.match_time.add(seconds)
+
+    def record_action(self, kind, name, seconds):
+        metrics = self.get(kind, name)
+        metrics.actions += 1
+        metrics.action_time.add(seconds)
+
+    def record_error(self, kind, name):
+        self.get(kind, name).errors += 1
+
+    def reset(self):
+        self.addons = dict()
+        self.started = time.monotonic()
+
+    def report(self):
+        '''(MetricsRegistry) -> dict
+        Returns a summary of every add-on's metrics, which can be dumped as JSON'''
+        uptime = time.monotonic() - self.started
+        report = {'uptime': uptime}
+        for kind in self.addons:
+            report[kind] = {name: self.addons[kind][name].summary(uptime) for name in sorted(self.addons[kind])}
+        return report
+
+    def busiest(self, count=10):
+        '''(MetricsRegistry, int) -> list of (str, str, float)
+        Returns the (kind, name, total seconds) of the count add-ons which spent the most time
+        checking and acting, busiest first'''
+        totals = list()
+        for kind in self.addons:
+            for name, metrics in self.addons[kind].items():
+                totals.append((kind, name, metrics.match_time.total + metrics.action_time.total))
+        return sorted(totals, key=lambda total: total[2], reverse=True)[:count]
+
+    def save(self, filename):
+        '''(MetricsRegistry, str) -> None
+        Writes the report to filename as JSON'''
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+        os.replace(temp_filename, filename)
@@ -0,0 +1,242 @@
+'''
+Message cache used in place of discord.py's client message deque.
+
+MessageCache keeps messages in the order they were added, like a deque with a
+maxlen, but also indexes them by id so that membership checks, look-ups and
+removals don't need to search through every message.
+It can also be limited by the approximate memory its messages use, evicting the
+least recently used messages first.
+Pinned messages (eg always watched messages) are never evicted.
+
+WatchSet is the set used for always watched messages; it reports additions and
+removals so that the cache can pin and unpin messages as they happen.
+
+@author: NGnius
+'''
+
+from collections import OrderedDict
+
+# approximate sizes, in bytes, for estimating a message's memory use
+MESSAGE_OVERHEAD = 2048  # the Message object and its attributes, excluding content
+ATTACHMENT_SIZE = 512  # attachment info (url, filename, etc.), not the file itself
+REACTION_SIZE = 256
+
+class MessageCache:
+    '''Ordered, id-indexed message cache with a maximum length and/or size
+
+    This supports the parts of the deque interface used by discord.py and the bot
+    (append, remove, iteration, len and in)
+
+    maxlen: max number of messages, like a deque (None for no limit)
+    max_bytes: max approximate size of all messages, in bytes (None for no limit)
+    lru: if True, get() moves messages to the newest end, so the least recently
+        used messages are evicted first instead of the oldest
+    pin_sources: containers of message ids which will also not be evicted (eg role_messages)'''
+
+    def __init__(self, messages=tuple(), maxlen=None, max_bytes=None, lru=False, pin_sources=tuple(), sizeof=None):
+        self.maxlen = maxlen
+        self.max_bytes = max_bytes
+        self.lru = lru
+        self.pin_sources = list(pin_sources)
+        self.sizeof = sizeof if sizeof is not None else approximate_size
+        self._messages = OrderedDict()  # message id -> message, oldest (or least recently used) first
+        self._sizes = dict()  # message id -> approximate size
+        self.bytes = 0
+        self.pinned = set()  # ids of messages which will not be evicted
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        for msg in messages:
+            self.append(msg)
+
+    def append(self, msg):
+        '''(MessageCache, discord.Message) -> None
+        Adds msg as the newest message, evicting the oldest unpinned messages if the cache is full'''
+        if msg.id in self._messages:
+            self.bytes -= self._sizes[msg.id]
+            self._messages.move_to_end(msg.id)
+        self._messages[msg.id] = msg
+        self._sizes[msg.id] = self.sizeof(msg)
+        self.bytes += self._sizes[msg.id]
+        self._evict()
+
+    def remove(self, msg):
+        '''(MessageCache, discord.Message) -> None
+        Removes msg. Raises ValueError if it's not in the cache (like a deque)'''
+        if msg.id not in self._messages:
+            raise ValueError('message not in cache')
+        self._discard(msg.id)
+        self.pinned.discard(msg.id)
+
+    def get(self, msg_id, default=None):
+        '''(MessageCache, str) -> discord.Message
+        Returns the message with id msg_id, or default if it's not in the cache'''
+        if msg_id in self._messages:
+            self.hits += 1
+            if self.lru:
+                self._messages.move_to_end(msg_id)
+            return self._messages[msg_id]
+        self.misses += 1
+        return default
+
+    def pin(self, msg):
+        '''(MessageCache, discord.Message) -> None
+        Adds msg (if it's not already in the cache) and stops it from being evicted'''
+        self.pinned.add(msg.id)
+        if msg.id not in self._messages:
+            self.append(msg)
+
+    def unpin(self, msg):
+        '''(MessageCache, discord.Message) -> None
+        Allows msg to be evicted again'''
+        self.pinned.discard(msg.id)
+        self._evict()
+
+    def is_pinned(self, msg_id):
+        return msg_id in self.pinned or any(msg_id in source for source in self.pin_sources)
+
+    def clear(self):
+        self._messages.clear()
+        self._sizes.clear()
+        self.bytes = 0
+        self.pinned.clear()
+
+    def stats(self):
+        '''(MessageCache) -> dict
+        Returns the cache's size and hit/miss/eviction counters'''
+        return {
+            'messages': len(self._messages),
+            'pinned': len([msg_id for msg_id in self._messages if self.is_pinned(msg_id)]),
+            'bytes': self.bytes,
+            'maxlen': self.maxlen,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+            }
+
+    def _is_full(self):
+        return (self.maxlen is not None and len(self._messages) > self.maxlen) \
+            or (self.max_bytes is not None and self.bytes > self.max_bytes)
+
+    def _discard(self, msg_id):
+        del self._messages[msg_id]
+        self.bytes -= self._sizes.pop(msg_id)
+
+    def _evict(self):
+        # pinned messages are moved to the newest end instead of being evicted,
+        # so each one is checked at most once before giving up
+        checked = 0
+        while self._is_full() and checked < len(self._messages):
+            msg_id = next(iter(self._messages))
+            if self.is_pinned(msg_id):
+                self._messages.move_to_end(msg_id)
+                checked += 1
+            else:
+                self._discard(msg_id)
+                self.evictions += 1
+
+    def __contains__(self, msg):
+        return getattr(msg, 'id', None) in self._messages
+
+    def __iter__(self):
+        return iter(list(self._messages.values()))
+
+    def __reversed__(self):
+        return reversed(list(self._messages.values()))
+
+    def __len__(self):
+        return len(self._messages)
+
+    def __repr__(self):
+        return '%s(%r, maxlen=%r)' % (self.__class__.__name__, list(self._messages.values()), self.maxlen)
+
+def approximate_size(msg):
+    '''(discord.Message) -> int
+    Returns a rough estimate of how much memory msg uses, in bytes'''
+    size = MESSAGE_OVERHEAD + len(getattr(msg, 'content', None) or '')
+    for embed in getattr(msg, 'embeds', None) or tuple():
+        size += len(str(embed))
+    size += ATTACHMENT_SIZE * len(getattr(msg, 'attachments', None) or tuple())
+    size += REACTION_SIZE * len(getattr(msg, 'reactions', None) or tuple())
+    return size
+
+class WatchSet(set):
+    '''set which calls on_add(item) and on_remove(item) whenever items are added or removed'''
+
+    def __init__(self, *args, on_add=None, on_remove=None):
+        super().__init__(*args)
+        self.on_add = on_add
+        self.on_remove = on_remove
+
+    def _added(self, items):
+        if self.on_add is not None:
+            for item in items:
+                self.on_add(item)
+
+    def _removed(self, items):
+        if self.on_remove is not None:
+            for item in items:
+                self.on_remove(item)
+
+    def add(self, item):
+        if item not in self:
+            super().add(item)
+            self._added((item,))
+
+    def remove(self, item):
+        super().remove(item)
+        self._removed((item,))
+
+    def discard(self, item):
+        if item in self:
+            super().discard(item)
+            self._removed((item,))
+
+    def pop(self):
+        item = super().pop()
+        self._removed((item,))
+        return item
+
+    def clear(self):
+        items = list(self)
+        super().clear()
+        self._removed(items)
+
+    def update(self, *others):
+        for other in others:
+            for item in other:
+                self.add(item)
+
+    def difference_update(self, *others):
+        for other in others:
+            for item in list(other):
+                self.discard(item)
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __isub__(self, other):
+        self.difference_update(other)
+        return self
+
+    def intersection_update(self, *others):
+        keep = set(self).intersection(*others)
+        for item in [item for item in self if item not in keep]:
+            self.discard(item)
+
+    def symmetric_difference_update(self, other):
+        for item in set(other):
+            if item in self:
+                self.discard(item)
+            else:
+                self.add(item)
+
+    def __iand__(self, other):
+        self.intersection_update(other)
+        return self
+
+    def __ixor__(self, other):
+        self.symmetric_difference_update(other)
+        return self
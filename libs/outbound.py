@@ -0,0 +1,306 @@
+'''
+Rate limit aware scheduler for the Discord API methods given to add-ons.
+
+Every call to a scheduled API method (see OutboundScheduler.wrap()) is queued
+and sent once both the global token bucket and the token bucket of the
+channel it's for allow it, highest priority (lowest number) first.
+Calls which are rate limited anyway (HTTP 429) are retried after the delay
+Discord asks for, or with exponential backoff, and that channel is paused
+meanwhile, so that bursts stay at the limit instead of bouncing off it.
+
+EditCoalescer sits in front of edit_message: edits to a message which arrive
+less than an interval after its last edit wait, and only the newest of them
+is sent (the others would be overwritten before anyone saw them anyway).
+
+Scheduled methods (and EditCoalescer.edit()) return an asyncio Future for the
+method's result, which can be used with both await and yield from.
+
+@author: NGnius
+'''
+
+import asyncio, bisect, functools, itertools, logging
+
+# priorities (lower goes first)
+HIGH = 0
+NORMAL = 1
+LOW = 2
+PRIORITY = 'priority'  # keyword argument which scheduled methods accept to override their priority
+
+DEFAULT_GLOBAL_RATE = 50  # requests per second, as set by Discord
+DEFAULT_GLOBAL_BURST = 50
+DEFAULT_CHANNEL_RATE = 1  # requests per second
+DEFAULT_CHANNEL_BURST = 5
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF = 0.5  # seconds, doubled after every retry
+DEFAULT_EDIT_INTERVAL = 1.0  # seconds between edits of the same message
+MAX_TRACKED_EDITS = 1024  # messages to remember the last edit time of, before forgetting old ones
+RATE_LIMITED = 429
+
+log = logging.getLogger('main')
+
+class TokenBucket:
+    '''Allows rate requests per second on average, and bursts of up to capacity requests'''
+
+    def __init__(self, rate, capacity, now=0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def wait_time(self, now):
+        '''(TokenBucket, float) -> float
+        Returns how long until a request is allowed (0 if it's allowed now)'''
+        if now < self.updated:
+            return self.updated - now  # paused
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds, now):
+        '''(TokenBucket, float, float) -> None
+        Allows no requests for seconds (eg after being rate limited), then one request before refilling as usual'''
+        self.tokens = min(1, self.capacity)
+        self.updated = max(self.updated, now + seconds)
+
+class Request:
+    def __init__(self, method, channel, args, kwargs, priority, future):
+        self.method = method
+        self.channel = channel
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = future
+        self.attempts = 0
+
+class OutboundScheduler:
+    '''Queues API calls and sends them within the global and per-channel rate limits
+
+    run() must be running as a task on loop for anything to be sent'''
+
+    def __init__(self, loop, global_rate=DEFAULT_GLOBAL_RATE, global_burst=DEFAULT_GLOBAL_BURST,
+            channel_rate=DEFAULT_CHANNEL_RATE, channel_burst=DEFAULT_CHANNEL_BURST,
+            max_retries=DEFAULT_MAX_RETRIES, backoff=DEFAULT_BACKOFF):
+        self.loop = loop
+        self.global_bucket = TokenBucket(global_rate, global_burst, now=loop.time())
+        self.channel_rate = channel_rate
+        self.channel_burst = channel_burst
+        self.channel_buckets = dict()  # channel id -> TokenBucket
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.queue = list()  # sorted (priority, sequence number, Request)
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self.sent = 0
+        self.retries = 0
+        self.stopped = False
+
+    def wrap(self, method, channel_of, priority=NORMAL):
+        '''(OutboundScheduler, coroutine function, function, int) -> coroutine function
+        Returns a scheduled version of method, which can be used just like method
+        (eg with loop.create_task()). channel_of(args, kwargs) should return the id of
+        the channel which a call is for'''
+        @functools.wraps(method)
+        async def scheduled(*args, **kwargs):
+            call_priority = kwargs.pop(PRIORITY, priority)
+            return await self.submit(method, channel_of(args, kwargs), args, kwargs, priority=call_priority)
+        return scheduled
+
+    def submit(self, method, channel, args=tuple(), kwargs=dict(), priority=NORMAL):
+        '''(OutboundScheduler, coroutine function, str, tuple, dict, int) -> asyncio.Future
+        Queues method(*args, **kwargs). Returns a future for its result'''
+        future = self.loop.create_future()
+        self._enqueue(Request(method, channel, args, kwargs, priority, future))
+        return future
+
+    def _enqueue(self, request):
+        bisect.insort(self.queue, (request.priority, next(self._sequence), request))
+        self._wakeup.set()
+
+    def _bucket(self, channel):
+        if channel not in self.channel_buckets:
+            self.channel_buckets[channel] = TokenBucket(self.channel_rate, self.channel_burst, now=self.loop.time())
+        return self.channel_buckets[channel]
+
+    def _next_ready(self, now):
+        '''(OutboundScheduler, float) -> (int, float)
+        Returns the queue index of the first request which can be sent now (or None)
+        and otherwise how long until one can be'''
+        wait = None
+        for index, (priority, sequence, request) in enumerate(self.queue):
+            channel_wait = self._bucket(request.channel).wait_time(now)
+            if channel_wait == 0:
+                return index, 0.0
+            wait = channel_wait if wait is None else min(wait, channel_wait)
+        return None, wait
+
+    async def run(self):
+        '''(OutboundScheduler) -> None
+        the looping task which sends queued requests'''
+        while not self.stopped:
+            if not self.queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            now = self.loop.time()
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+            index, wait = self._next_ready(now)
+            if index is None:
+                # every queued channel is limited, so wait for one of them or for a new request
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            request = self.queue.pop(index)[2]
+            self.global_bucket.take(now)
+            self._bucket(request.channel).take(now)
+            self.loop.create_task(self._send(request))
+
+    async def _send(self, request):
+        if request.future.cancelled():
+            return
+        request.attempts += 1
+        try:
+            result = await request.method(*request.args, **request.kwargs)
+        except Exception as e:
+            if is_rate_limited(e) and request.attempts <= self.max_retries:
+                delay = retry_after(e)
+                if delay is None:
+                    delay = self.backoff * 2 ** (request.attempts - 1)
+                self.retries += 1
+                log.info('Rate limited in channel %s, retrying in %.2fs' % (request.channel, delay))
+                self._bucket(request.channel).pause(delay, self.loop.time())
+                self._enqueue(request)
+            elif not request.future.cancelled():
+                request.future.set_exception(e)
+            return
+        self.sent += 1
+        if not request.future.cancelled():
+            request.future.set_result(result)
+
+    def stop(self):
+        self.stopped = True
+        self._wakeup.set()
+
+    def stats(self):
+        return {'queued': len(self.queue), 'sent': self.sent, 'retries': self.retries, 'channels': len(self.channel_buckets)}
+
+def is_rate_limited(error):
+    '''(Exception) -> bool
+    Returns True if error is an HTTP 429 (eg a discord.HTTPException)'''
+    return getattr(getattr(error, 'response', None), 'status', None) == RATE_LIMITED
+
+def retry_after(error):
+    '''(Exception) -> float
+    Returns how many seconds Discord asked to wait before retrying, or None if it didn't say'''
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or dict()
+    try:
+        return float(headers['Retry-After'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+def channel_of_destination(args, kwargs):
+    '''for methods which take a destination first (eg send_message, send_file, send_typing)'''
+    destination = args[0] if args else kwargs.get('destination')
+    return getattr(destination, 'id', destination)
+
+def channel_of_message(args, kwargs):
+    '''for methods which take a message first (eg edit_message, add_reaction, remove_reaction)'''
+    message = args[0] if args else kwargs.get('message')
+    channel = getattr(message, 'channel', None)
+    return getattr(channel, 'id', channel)
+
+class PendingEdit:
+    def __init__(self, message, args, kwargs, future):
+        self.message = message
+        self.args = args
+        self.kwargs = kwargs
+        self.futures = [future]
+
+class EditCoalescer:
+    '''Sends at most one edit per message every interval seconds, keeping only the newest pending edit
+
+    edit() returns when the edit which replaced it (or it) has been made'''
+
+    def __init__(self, loop, edit_method, interval=DEFAULT_EDIT_INTERVAL):
+        self.loop = loop
+        self.edit_method = edit_method
+        self.interval = interval
+        self.pending = dict()  # message id -> PendingEdit
+        self.in_flight = set()  # ids of messages with an edit being sent
+        self.last_edit = dict()  # message id -> loop time of the last edit sent
+        self.edits = 0
+        self.coalesced = 0
+
+    async def edit(self, message, *args, **kwargs):
+        '''(EditCoalescer, discord.Message, ...) -> discord.Message
+        Edits message (eventually), with the same arguments as edit_message'''
+        return await self.queue_edit(message, *args, **kwargs)
+
+    def queue_edit(self, message, *args, **kwargs):
+        '''(EditCoalescer, discord.Message, ...) -> asyncio.Future
+        Queues an edit of message, with the same arguments as edit_message'''
+        key = getattr(message, 'id', None) or id(message)
+        future = self.loop.create_future()
+        if key in self.pending:
+            pending = self.pending[key]
+            pending.message, pending.args, pending.kwargs = message, args, kwargs
+            pending.futures.append(future)
+            self.coalesced += 1
+        else:
+            self.pending[key] = PendingEdit(message, args, kwargs, future)
+            if key not in self.in_flight:
+                self._schedule(key)
+        return future
+
+    def _schedule(self, key):
+        if key in self.last_edit:
+            self.loop.call_at(max(self.loop.time(), self.last_edit[key] + self.interval), self._flush, key)
+        else:
+            self.loop.call_soon(self._flush, key)
+
+    def _flush(self, key):
+        pending = self.pending.pop(key, None)
+        if pending is None:
+            return
+        now = self.loop.time()
+        if len(self.last_edit) > MAX_TRACKED_EDITS:
+            self.last_edit = {old_key: time for old_key, time in self.last_edit.items() if time + self.interval > now}
+        self.last_edit[key] = now
+        self.in_flight.add(key)
+        self.loop.create_task(self._send(key, pending))
+
+    async def _send(self, key, pending):
+        try:
+            result = await self.edit_method(pending.message, *pending.args, **pending.kwargs)
+        except Exception as e:
+            for future in pending.futures:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for future in pending.futures:
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self.edits += 1
+            self.in_flight.discard(key)
+            if key in self.pending:
+                # edits which arrived while this one was being sent
+                self._schedule(key)
+
+    def stats(self):
+        return {'pending': len(self.pending), 'edits': self.edits, 'coalesced': self.coalesced}
@@ -7,8 +7,9 @@ Plugin is designed to be similar to Command and Reaction interface classes while
 @author: NGnius
 """
 
-import asyncio, time, traceback
-from multiprocessing import Process, Queue
+import asyncio, functools, pickle, threading, time, traceback, logging
+from multiprocessing import Process, Pipe
+from queue import Queue as ThreadQueue
 
 from libs import dataloader, addon
 
@@ -31,10 +32,48 @@ CUSTOM = None
 ARGS = 'args'
 KWARGS = 'kwargs'
 
+# threaded plugin IPC constants
+ACTIONS = (addon.SEND_MESSAGE, addon.EDIT_MESSAGE, addon.ADD_REACTION, addon.REMOVE_REACTION, addon.SEND_TYPING, addon.SEND_FILE) # index is the action's code in frames
+ACTION_CODES = {action: code for code, action in enumerate(ACTIONS)}
+MAX_FRAME_ACTIONS = 256 # actions batched before a frame is sent, even if threaded_action() hasn't finished
+# IPC counters
+FRAMES = 'frames'
+ACTIONS_RECEIVED = 'actions'
+BYTES = 'bytes'
+INVALID = 'invalid'
+DROPPED = 'dropped'
+
+log = logging.getLogger('main')
+
+def encode_actions(action_dict):
+    '''(dict) -> list of (int, list, dict)
+    Returns the (action code, args, kwargs) of every action in action_dict, which is the compact form used in frames.
+    Anything which isn't an action is kept (as is), so that it's counted as invalid when it's dispatched'''
+    if not isinstance(action_dict, dict):
+        return [action_dict]
+    actions = list()
+    for key in action_dict:
+        params = action_dict[key]
+        if key in ACTION_CODES and isinstance(params, dict):
+            actions.append((ACTION_CODES[key], params.get(ARGS, tuple()), params.get(KWARGS) or None))
+        else:
+            actions.append((key, params))
+    return actions
+
+def encode_frame(actions):
+    '''(list) -> bytes'''
+    return pickle.dumps(actions, protocol=pickle.HIGHEST_PROTOCOL)
+
+def decode_frame(frame):
+    '''(bytes) -> list'''
+    return pickle.loads(frame)
+
 class Plugin(addon.AddOn):
     '''Plugin represents a plugin that the discord bot can work alongside
     to add custom functionality not present in the base bot'''
 
+    scheduler = None  # libs.scheduler.PluginScheduler which runs action(), set by the bot when the plugin is registered
+
     def __init__(self, api_methods=dict(), config=None, events=dict(), namespace=None, **kwargs):
         '''(Plugin, dict, str, dict) -> Plugin
         api_methods: a dict of api methods accessible to the Plugin, so that most plugins don't have to be AdminPlugins
@@ -67,6 +106,9 @@ class Plugin(addon.AddOn):
         in order to expand or modify it's functionality.
 
         the looping async method to call action()'''
+        if self.scheduler is not None:
+            await self.scheduler.schedule(self)
+            return
         while not self.shutting_down and self.period!=-1:
             start_time = time.perf_counter()
             try:
@@ -92,6 +134,8 @@ class Plugin(addon.AddOn):
 
         the method to call shutdown()'''
         self.shutting_down=True
+        if self.scheduler is not None:
+            self.scheduler.unschedule(self)
         self.shutdown()
 
     def shutdown(self):
@@ -113,34 +157,196 @@ class Plugin(addon.AddOn):
         Use this to handle error reporting or exceptional cases'''
         pass
 
+class PipeQueue:
+    '''The queue given to threaded_action() in a ThreadedPlugin's process.
+    Actions put in it are batched into one frame, which is sent to the bot's process when it's flushed
+    (after every threaded_action()) or once it holds max_actions actions.
+
+    It's write-only: nothing can be got from it. empty() and qsize() are about the actions which haven't been sent yet'''
+
+    def __init__(self, connection, max_actions=MAX_FRAME_ACTIONS):
+        self.connection = connection
+        self.max_actions = max_actions
+        self.pending = list()
+
+    def put(self, item, block=True, timeout=None):
+        self.pending.extend(encode_actions(item))
+        if len(self.pending) >= self.max_actions:
+            self.flush()
+
+    def put_nowait(self, item):
+        self.put(item)
+
+    def empty(self):
+        return len(self.pending) == 0
+
+    def qsize(self):
+        return len(self.pending)
+
+    def flush(self):
+        '''(PipeQueue) -> None
+        Sends the pending actions as a frame'''
+        if self.pending:
+            frame = encode_frame(self.pending)
+            self.pending = list()
+            self.connection.send_bytes(frame)
+
 class ThreadedPlugin(Plugin):
     '''ThreadedPlugin is an extension of the Plugin interface for an independent task to run in another thread.
 
-    This is quite useful for scrapers and other slow tasks that block the main thread and don't require access to bot variables'''
+    This is quite useful for scrapers and other slow tasks that block the main thread and don't require access to bot variables
+
+    Plugins which set threaded_state can share the bot's worker pool (see libs.workerpool) instead of
+    each spawning a process. threaded_action() then runs in a worker process on an instance with only
+    the (picklable) attributes named in threaded_state, whose new values are copied back after each run
+
+    What threaded_action() puts in its queue is handled by action() as soon as it arrives, rather than
+    on the next period (where the loop doesn't support add_reader, it's handled every period as before).
+    The queue given to threaded_action() is write-only (only put(), put_nowait(), empty() and qsize()),
+    since it's no longer the multiprocessing.Queue which action() reads from
+
+    A ThreadedPlugin made outside of the main thread (eg while add-ons are loaded in a thread pool) only
+    spawns its process once _action() runs, since forking from any other thread can deadlock the child'''
+
+    threaded_state = None  # names of the attributes threaded_action() uses, or None if it needs its own process
 
     def spawn_process(self):
-        self.process = Process(target = self._threaded_action, args = (self.queue, ), kwargs = self.threaded_kwargs) # secondary thread
+        self._receiver, self._sender = Pipe(duplex=False) # for sending information from the ThreadedPlugin's secondary thread
+        self.process = Process(target = self._threaded_action, args = (PipeQueue(self._sender), ), kwargs = self.threaded_kwargs) # secondary thread
         self.process.start()
 
-    def __init__(self, should_spawn_thread=True,**kwargs):
-        '''(ThreadedPlugin, dict) -> ThreadedPlugin'''
+    def __init__(self, should_spawn_thread=True, worker_pool=None, **kwargs):
+        '''(ThreadedPlugin, bool, WorkerPool, dict) -> ThreadedPlugin
+        worker_pool: the shared libs.workerpool.WorkerPool to run threaded_action() in, if threaded_state is set'''
         super().__init__(**kwargs)
         self.end_process = self.config[END_PROCESS] # method of ending process. Valid options are 'join', 'terminate' and 'kill' (Python3.7+ only for kill)
         self.threaded_period = float(self.config[THREADED_PERIOD]) # like self.period, except for for the threaded action
-        self.queue = Queue() # queue object for sending information to and from the ThreadedPlugin's secondary thread
+        self.worker_pool = worker_pool if self.threaded_state is not None else None
+        self.process = None
+        self.spawn_pending = False # spawn_process() once _action() runs, on the event loop's thread
+        self.queue = ThreadQueue() # what threaded_action() sent, waiting to be handled by action()
+        self._delivery = None # task running action() for results which just arrived
+        self.action_methods = {ACTION_CODES[action]: getattr(self, action) for action in ACTIONS} # action code -> api method
+        self.ipc_stats = {FRAMES: 0, ACTIONS_RECEIVED: 0, BYTES: 0, INVALID: 0, DROPPED: 0}
         try: # ensure threaded_kwargs exists, but don't overwrite
             self.threaded_kwargs
         except AttributeError:
             self.threaded_kwargs = dict()
         # please note that ThreadedPlugin will create a copy of all variables
         # for the new thread, unless they're compatible with multiple threads
-        if should_spawn_thread:
+        if should_spawn_thread and self.worker_pool is None:
+            if threading.current_thread() is threading.main_thread():
+                self.spawn_process()
+            else:
+                self.spawn_pending = True
+
+    async def _action(self):
+        '''(ThreadedPlugin) -> None
+        Does everything Plugin's _action() does, while handling results from threaded_action() as they arrive'''
+        loop = asyncio.get_event_loop()
+        if self.spawn_pending:
+            self.spawn_pending = False
             self.spawn_process()
+        if self.worker_pool is not None:
+            results_task = asyncio.ensure_future(self._pooled_threaded_action())
+            try:
+                await super()._action()
+            finally:
+                results_task.cancel()
+            return
+        if self.process is None: # nothing to receive results from
+            await super()._action()
+            return
+        try:
+            loop.add_reader(self._receiver.fileno(), self._on_results_readable)
+        except NotImplementedError:
+            await super()._action() # results are received when action() runs instead
+            return
+        try:
+            await super()._action()
+        finally:
+            loop.remove_reader(self._receiver.fileno())
+
+    def _receive_results(self):
+        '''(ThreadedPlugin) -> bool
+        Moves everything threaded_action() has sent into self.queue, without blocking.
+        Returns False if nothing more can be received (ie the process is gone)'''
+        try:
+            while self._receiver.poll():
+                frame = self._receiver.recv_bytes()
+                try:
+                    actions = decode_frame(frame)
+                except Exception: # not a frame
+                    self.ipc_stats[INVALID] += 1
+                    continue
+                self._queue_actions(actions, len(frame))
+        except (EOFError, OSError):
+            return False
+        return True
+
+    def _queue_actions(self, actions, size=0):
+        '''(ThreadedPlugin, list, int) -> None
+        Adds a frame of encoded actions to self.queue'''
+        self.ipc_stats[FRAMES] += 1
+        self.ipc_stats[ACTIONS_RECEIVED] += len(actions)
+        self.ipc_stats[BYTES] += size
+        for action in actions:
+            self.queue.put(action)
+
+    def _on_results_readable(self):
+        if not self._receive_results():
+            asyncio.get_event_loop().remove_reader(self._receiver.fileno())
+        if not self.queue.empty():
+            self._results_arrived()
+
+    def _results_arrived(self):
+        '''(ThreadedPlugin) -> None
+        Runs action() for results which just arrived, unless it's already running'''
+        if self._delivery is None or self._delivery.done():
+            self._delivery = asyncio.ensure_future(self._deliver_results())
+
+    async def _deliver_results(self):
+        try:
+            await self.action()
+        except Exception as e: # catch any exception that could crash the task
+            self._on_action_error(e)
+
+    async def _pooled_threaded_action(self):
+        '''(ThreadedPlugin) -> None
+        Similar to _threaded_action(), the looping task that runs threaded_action in the worker pool'''
+        loop = asyncio.get_event_loop()
+        while not self.shutting_down and self.threaded_period!=-1:
+            start_time = time.perf_counter()
+            try:
+                results = await self.worker_pool.run_threaded_action(loop, self)
+                self._queue_actions([action for item in results for action in encode_actions(item)])
+                self._results_arrived()
+            except asyncio.CancelledError:
+                raise
+            except Exception: # catch anything that could crash the task
+                traceback.print_exc()
+            sleep_time = self.threaded_period - (time.perf_counter() - start_time)
+            if sleep_time<0:
+                sleep_time=0
+            await asyncio.sleep(sleep_time)
+
+    def get_threaded_state(self):
+        '''(ThreadedPlugin) -> dict
+        Returns the attributes named in threaded_state, to be sent to a worker process'''
+        return {name: getattr(self, name, None) for name in self.threaded_state or tuple()}
+
+    def set_threaded_state(self, state):
+        '''(ThreadedPlugin, dict) -> None
+        Updates the attributes named in threaded_state, from a worker process'''
+        for name in state:
+            setattr(self, name, state[name])
 
     def _shutdown(self):
         '''(ThreadedPlugin) -> None
         Exits the secondary thread and does everything Plugin's _shutdown() does'''
         super()._shutdown()
+        if self.process is None:
+            return # pooled, or no process was spawned
         if self.process.is_alive():
             if self.end_process == JOIN:
                 self.process.join()
@@ -153,7 +359,7 @@ class ThreadedPlugin(Plugin):
         self.process.join() # wait for process ot terminate, indefinitely if necessary
 
     def _threaded_action(self, queue, **kwargs):
-        '''(ThreadedPlugin, Queue, dict) -> None
+        '''(ThreadedPlugin, PipeQueue, dict) -> None
         Concrete implementations should NOT override this function. Only sub-classes should override this,
         in order to expand or modify it's functionality.
 
@@ -166,13 +372,14 @@ class ThreadedPlugin(Plugin):
             except: # catch anything that could crash the thread
                 traceback.print_exc()
                 pass
+            queue.flush() # send what this run put in the queue as one frame
             sleep_time = self.threaded_period - (time.perf_counter() - start_time)
             if sleep_time<0:
                 sleep_time=0
             time.sleep(sleep_time) # account for execution time of self.action() in asyncio.sleep()
 
     def threaded_action(self, queue, **kwargs):
-        '''(ThreadedPlugin, Queue, dict) -> None
+        '''(ThreadedPlugin, PipeQueue, dict) -> None
         the method to be run in the secondary thread
         This will be looped externally'''
         pass
@@ -189,63 +396,115 @@ class ThreadedPlugin(Plugin):
 
         this method overrides Plugin's action method'''
 
+        if self.process is not None:
+            self._receive_results()
         while not self.queue.empty():
-            action_dict = self.queue.get() # hopefully it's a dict object
-            if isinstance(action_dict, dict): # make sure it's a dict object
-                for key in action_dict:
-                    if ARGS not in action_dict[key]:
-                        action_dict[key][ARGS]=[]
-                    if KWARGS not in action_dict[key]:
-                        action_dict[key][KWARGS]={}
-
-                    if key==self.SEND_MESSAGE:
-                        try:
-                            await self.send_message(*action_dict[key][ARGS], **action_dict[key][KWARGS])
-                        except TypeError:
-                            # TypeError is raised when missing arguments
-                            # or when action_dict[key] is not mapping
-                            # (ie **action_dict[key] is not a valid operation)
-                            pass
-                    elif key==self.EDIT_MESSAGE:
-                        try:
-                            await self.edit_message(*action_dict[key][ARGS], **action_dict[key][KWARGS])
-                        except TypeError:
-                            # TypeError is raised when missing arguments
-                            # or when action_dict[key] is not mapping
-                            # (ie **action_dict[key] is not a valid operation)
-                            pass
-                    elif key==self.ADD_REACTION:
-                        try:
-                            await self.add_reaction(*action_dict[key][ARGS], **action_dict[key][KWARGS])
-                        except TypeError:
-                            # TypeError is raised when missing arguments
-                            # or when action_dict[key] is not mapping
-                            # (ie **action_dict[key] is not a valid operation)
-                            pass
-                    elif key==self.REMOVE_REACTION:
-                        try:
-                            await self.remove_reaction(*action_dict[key][ARGS], **action_dict[key][KWARGS])
-                        except TypeError:
-                            # TypeError is raised when missing arguments
-                            # or when action_dict[key] is not mapping
-                            # (ie **action_dict[key] is not a valid operation)
-                            pass
-                    elif key==self.SEND_TYPING:
-                        try:
-                            await self.send_typing(*action_dict[key][ARGS], **action_dict[key][KWARGS])
-                        except TypeError:
-                            # TypeError is raised when missing arguments
-                            # or when action_dict[key] is not mapping
-                            # (ie **action_dict[key] is not a valid operation)
-                            pass
-                    elif key==self.SEND_FILE:
-                        try:
-                            await self.send_file(*action_dict[key][ARGS], **action_dict[key][KWARGS])
-                        except TypeError:
-                            # TypeError is raised when missing arguments
-                            # or when action_dict[key] is not mapping
-                            # (ie **action_dict[key] is not a valid operation)
-                            pass
+            await self.dispatch_action(self.queue.get())
+
+    async def dispatch_action(self, action):
+        '''(ThreadedPlugin, tuple) -> None
+        Calls the api method for an encoded action (see encode_actions()), or for every action in an action dict.
+        Invalid actions, and actions whose arguments don't suit the api method, are counted and dropped'''
+        if isinstance(action, dict): # put in self.queue directly, instead of sent in a frame
+            for encoded_action in encode_actions(action):
+                await self.dispatch_action(encoded_action)
+            return
+        try:
+            code, args, kwargs = action
+            method = self.action_methods[code]
+        except (TypeError, ValueError, KeyError):
+            self.ipc_stats[INVALID] += 1
+            return
+        if not isinstance(args, (list, tuple)) or not isinstance(kwargs, (dict, type(None))):
+            self.ipc_stats[INVALID] += 1
+            return
+        try:
+            await method(*args, **(kwargs or dict()))
+        except TypeError as e:
+            # TypeError is raised when arguments are missing or unexpected
+            self.ipc_stats[DROPPED] += 1
+            log.warning('%s dropped a %s action: %s' % (type(self).__name__, ACTIONS[code], e))
+
+class LoopQueue:
+    '''The queue given to an IOThreadPlugin's threaded_action().
+    Actions put in it are handed to the plugin on the event loop straight away'''
+
+    def __init__(self, loop, plugin):
+        self.loop = loop
+        self.plugin = plugin
+
+    def put(self, item, block=True, timeout=None):
+        self.loop.call_soon_threadsafe(self.plugin._actions_arrived, encode_actions(item))
+
+    def put_nowait(self, item):
+        self.put(item)
+
+    def empty(self):
+        return True # nothing is kept
+
+    def qsize(self):
+        return 0
+
+    def flush(self):
+        pass # nothing is batched
+
+class IOThreadPlugin(ThreadedPlugin):
+    '''IOThreadPlugin is a ThreadedPlugin whose threaded_action() runs in a thread of a shared pool, instead of in its own process.
+
+    This suits plugins which mostly wait on blocking I/O (eg web requests with requests), since it
+    doesn't cost a process or any pickling, and threaded_action() can use all of the plugin's attributes.
+    Don't use it for CPU-bound work, which would hold the GIL and slow down the bot.
+    Actions put in the queue are dispatched on the event loop as soon as they're put,
+    and call_api() can call api methods on the loop directly'''
+
+    def __init__(self, io_executor=None, **kwargs):
+        '''(IOThreadPlugin, concurrent.futures.Executor, dict) -> IOThreadPlugin
+        io_executor: the shared thread pool to run threaded_action() in (None for the event loop's default executor)'''
+        kwargs['should_spawn_thread'] = False
+        kwargs['worker_pool'] = None
+        super().__init__(**kwargs)
+        self.io_executor = io_executor
+        self.loop = None # the event loop, once the plugin is running
+
+    async def _action(self):
+        '''(IOThreadPlugin) -> None
+        Does everything Plugin's _action() does, while running threaded_action() in the thread pool'''
+        self.loop = asyncio.get_event_loop()
+        io_task = asyncio.ensure_future(self._io_threaded_action())
+        try:
+            await super()._action()
+        finally:
+            io_task.cancel()
+
+    async def _io_threaded_action(self):
+        '''(IOThreadPlugin) -> None
+        Similar to _threaded_action(), the looping task that runs threaded_action in the thread pool'''
+        queue = LoopQueue(self.loop, self)
+        while not self.shutting_down and self.threaded_period!=-1:
+            start_time = time.perf_counter()
+            try:
+                await self.loop.run_in_executor(self.io_executor, functools.partial(self.threaded_action, queue, **self.threaded_kwargs))
+            except asyncio.CancelledError:
+                raise
+            except Exception: # catch anything that could crash the task
+                traceback.print_exc()
+            sleep_time = self.threaded_period - (time.perf_counter() - start_time)
+            if sleep_time<0:
+                sleep_time=0
+            await asyncio.sleep(sleep_time)
+
+    def _actions_arrived(self, actions):
+        self._queue_actions(actions)
+        self._results_arrived()
+
+    def call_api(self, action, *args, **kwargs):
+        '''(IOThreadPlugin, str, ...) -> concurrent.futures.Future
+        Calls the api method for action (eg SEND_MESSAGE) on the event loop, from threaded_action().
+        Returns a future for its result, which threaded_action() can wait on'''
+        method = self.action_methods[ACTION_CODES[action]]
+        async def call():
+            return await method(*args, **kwargs)
+        return asyncio.run_coroutine_threadsafe(call(), self.loop)
 
 class OnReadyPlugin(Plugin):
     async def _action(self):
@@ -0,0 +1,176 @@
+'''
+Per add-on startup profiling, for finding which add-ons slow down the bot's startup.
+
+StartupProfiler records, for every add-on it's told about, how long importing
+and initializing took, how many files were opened while doing so and
+(optionally) how much memory was allocated, according to tracemalloc.
+The report can be saved as JSON and is kept by the bot for admin add-ons.
+
+Files are counted with an audit hook (Python 3.8+), per thread, so they're
+attributed correctly while add-ons load in parallel. Before 3.8, builtins.open
+is wrapped instead, until the profiler finishes, which counts the files add-ons
+open (eg with dataloader) but not the ones the import system reads. tracemalloc only tracks
+the whole process though, so memory deltas overlap when add-ons load in parallel.
+
+@author: NGnius
+'''
+
+import builtins, json, os, sys, threading, time, tracemalloc
+from contextlib import contextmanager
+
+# report keys
+NAME = 'name'
+PACKAGE = 'package'
+KIND = 'kind'
+IMPORT_TIME = 'import_time'
+INIT_TIME = 'init_time'
+TOTAL_TIME = 'total_time'
+FILES_READ = 'files_read'
+MEMORY = 'memory'
+ERROR = 'error'
+
+_local = threading.local()  # .records is the stack of records being profiled in this thread
+_hook_installed = False
+_original_open = None  # builtins.open, while it's wrapped to count files (before 3.8)
+_open_users = 0  # unfinished StartupProfilers which count files with the open wrapper
+_open_lock = threading.Lock()
+
+def _count_file():
+    records = getattr(_local, 'records', None)
+    if records:
+        records[-1][FILES_READ] += 1
+
+def _audit_hook(event, args):
+    if event == 'open':
+        _count_file()
+
+def _wrap_open(open_func):
+    def counting_open(*args, **kwargs):
+        _count_file()
+        return open_func(*args, **kwargs)
+    return counting_open
+
+def _install_hook():
+    global _hook_installed, _original_open, _open_users
+    if hasattr(sys, 'addaudithook'):
+        # audit hooks can't be removed, so only ever install one, which does nothing when nothing is being profiled
+        if not _hook_installed:
+            sys.addaudithook(_audit_hook)
+            _hook_installed = True
+        return
+    with _open_lock:
+        _open_users += 1
+        if _original_open is None:
+            _original_open = builtins.open
+            builtins.open = _wrap_open(_original_open)
+
+def _remove_hook():
+    global _original_open, _open_users
+    if hasattr(sys, 'addaudithook'):
+        return
+    with _open_lock:
+        _open_users -= 1
+        if _open_users <= 0 and _original_open is not None:
+            builtins.open = _original_open
+            _original_open = None
+            _open_users = 0
+
+def _counting_files():
+    return _hook_installed or _original_open is not None
+
+class StartupProfiler:
+    '''Records what loading each add-on cost
+
+    enabled: if False, profile() and phase() do nothing
+    trace_memory: also record tracemalloc deltas (this slows down loading quite a bit)'''
+
+    def __init__(self, enabled=True, trace_memory=False):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.records = list()
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.finished = None
+        self._counting = self.enabled  # until finish()
+        if self._counting:
+            _install_hook()
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextmanager
+    def profile(self, name, package=None, kind=None):
+        '''Profiles loading the add-on name while in the with block.
+        Yields the add-on's record (a dict), or None if the profiler is disabled'''
+        if not self.enabled:
+            yield None
+            return
+        record = {NAME: name, PACKAGE: package, KIND: kind, IMPORT_TIME: 0.0, INIT_TIME: 0.0, TOTAL_TIME: 0.0,
+            FILES_READ: 0 if _counting_files() else None, MEMORY: None, ERROR: None}
+        if not hasattr(_local, 'records'):
+            _local.records = list()
+        _local.records.append(record)
+        memory_before = tracemalloc.get_traced_memory()[0] if self.trace_memory else None
+        start = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record[ERROR] = repr(e)
+            raise e
+        finally:
+            record[TOTAL_TIME] = time.perf_counter() - start
+            if self.trace_memory:
+                record[MEMORY] = tracemalloc.get_traced_memory()[0] - memory_before
+            _local.records.pop()
+            with self._lock:
+                self.records.append(record)
+
+    @contextmanager
+    def phase(self, record, key):
+        '''Adds the time spent in the with block to record[key] (eg IMPORT_TIME)'''
+        if record is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record[key] += time.perf_counter() - start
+
+    def finish(self):
+        '''(StartupProfiler) -> None
+        Marks the end of startup, once all the add-ons are loaded, and stops tracing memory (and counting files)'''
+        self.finished = time.perf_counter()
+        if self._counting:
+            _remove_hook()
+            self._counting = False
+        if self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_memory = False
+
+    def slowest(self, count=10):
+        '''(StartupProfiler, int) -> list of dict
+        Returns the records of the count add-ons which took the longest to load, slowest first'''
+        with self._lock:
+            records = list(self.records)
+        return sorted(records, key=lambda record: record[TOTAL_TIME], reverse=True)[:count]
+
+    def report(self):
+        '''(StartupProfiler) -> dict
+        Returns the whole report, with add-ons in the order they finished loading'''
+        with self._lock:
+            records = list(self.records)
+        return {
+            'total_time': (self.finished or time.perf_counter()) - self.started,
+            'addon_time': sum(record[TOTAL_TIME] for record in records),
+            'addons': records
+            }
+
+    def save(self, filename):
+        '''(StartupProfiler, str) -> None
+        Writes the report to filename as JSON'''
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+        os.replace(temp_filename, filename)
+
+DISABLED = StartupProfiler(enabled=False)  # for when there's no profiler to use
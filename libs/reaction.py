@@ -7,7 +7,7 @@ is a reaction (reaction.message is equivalent to message in message command) and
 a user (the person who added/removed/updated the reaction)
 """
 
-from libs import dataloader, addon
+from libs import dataloader, addon, dispatch
 import discord
 
 DEFAULT = addon.DEFAULT
@@ -16,6 +16,36 @@ class ReactionCommand(addon.AddOn):
     '''ReactionAddCommand represents a command that the bot can use to take action
     based on reactions added to any discord message it listens to.'''
 
+    on_emoji_change = None # called whenever self.emoji changes, set by the bot so that its reaction index stays up to date
+    # True if _matches() only matches the emojis in self.emoji, so that the bot may skip it for other emojis.
+    # Sub-classes which override _matches() are assumed not to, unless they set this to True themselves
+    emoji_indexed = True
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if '_matches' in cls.__dict__ and 'emoji_indexed' not in cls.__dict__:
+            cls.emoji_indexed = False
+        if 'emoji' in cls.__dict__ and not isinstance(cls.__dict__['emoji'], property):
+            # a subclass's emoji class attribute would hide the emoji property, so make it the default instead
+            cls._emoji = cls.__dict__['emoji']
+            delattr(cls, 'emoji')
+
+    @property
+    def emoji(self):
+        return self._emoji
+
+    @emoji.setter
+    def emoji(self, value):
+        if isinstance(value, dict):
+            # notice changes made in place too (eg self.emoji[server.id] = emoji.id)
+            value = dispatch.IndexedDict(value, on_change=self._emoji_changed)
+        self._emoji = value
+        self._emoji_changed()
+
+    def _emoji_changed(self):
+        if self.on_emoji_change is not None:
+            self.on_emoji_change()
+
     def __init__(self, api_methods=dict(), all_emojis_func=None, emoji_loc=None, perms_loc=None, always_watch_messages=set(), role_messages=dict(), namespace=None, events=dict(), **kwargs):
         '''(ReactionCommand, func, str, dict) -> Command
         perms: str of users who have permission to use this command
@@ -39,7 +69,7 @@ class ReactionCommand(addon.AddOn):
         # NOTE: self.emoji should be set to None if it does not apply to the ReactionCommand
         # otherwise, self.emoji will be use the last saved emoji json backup
         try:
-            self.emoji # make sure self.emoji is not already defined by the subclass
+            self.emoji = self.emoji # make sure self.emoji is not already defined by the subclass
         except AttributeError:
             try:
                 self.emoji_file = dataloader.datafile(emoji_loc, load_as="json")
@@ -0,0 +1,69 @@
+'''
+Registry of loaded add-ons, used by bot.py to hold commands, reactions and plugins.
+
+AddOnRegistry is a mapping of names to add-ons which always iterates in
+alphabetical order of names, like the OrderedDicts it replaces did.
+New names are inserted with a binary search instead of re-sorting, and the
+ordered names are kept as a snapshot (a tuple) which is only rebuilt when names
+are added or removed, so iterating is cheap and safe while add-ons are being (un)loaded.
+
+@author: NGnius
+'''
+
+import bisect
+from collections.abc import MutableMapping
+
+class AddOnRegistry(MutableMapping):
+    '''Mapping of names to add-ons, in alphabetical order of names
+
+    version increases every time the registry changes, so anything built
+    from the registry (eg dispatch indexes) can tell when it's out of date'''
+
+    def __init__(self, *args, **kwargs):
+        self._addons = dict()
+        self._names = list()  # sorted names
+        self._snapshot = tuple()
+        self.version = 0
+        self.update(*args, **kwargs)
+
+    def __getitem__(self, name):
+        return self._addons[name]
+
+    def __setitem__(self, name, addon):
+        if name not in self._addons:
+            bisect.insort(self._names, name)
+            self._snapshot = None
+        self._addons[name] = addon
+        self.version += 1
+
+    def __delitem__(self, name):
+        del self._addons[name]
+        del self._names[bisect.bisect_left(self._names, name)]
+        self._snapshot = None
+        self.version += 1
+
+    def __contains__(self, name):
+        return name in self._addons
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def __len__(self):
+        return len(self._addons)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, [(name, self._addons[name]) for name in self.snapshot()])
+
+    def clear(self):
+        self._addons.clear()
+        self._names.clear()
+        self._snapshot = None
+        self.version += 1
+
+    def snapshot(self):
+        '''(AddOnRegistry) -> tuple of str
+        Returns the names in the registry, in order.
+        The tuple doesn't change when the registry does, so it's safe to loop over while (un)loading'''
+        if self._snapshot is None:
+            self._snapshot = tuple(self._names)
+        return self._snapshot
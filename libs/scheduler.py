@@ -0,0 +1,215 @@
+'''
+Central scheduler for the periodic action() of plugins.
+
+Instead of every plugin sleeping in its own loop, PluginScheduler keeps one
+heap of when each plugin should run next and a single task which starts
+plugin actions as they come due. This avoids drift (runs are scheduled a
+period after the previous scheduled run, not after it finished), can spread
+out plugins with the same period with jitter, and limits how many plugin
+actions run at once.
+
+When a run takes longer than the plugin's period, the runs which were missed
+are handled according to the plugin's missed run policy:
+SKIP: forget the missed runs and carry on at the next scheduled time
+CATCH_UP: run again straight away until every missed run has happened
+COALESCE: run once straight away, then carry on a period after that (default,
+    and how plugins used to behave)
+
+@author: NGnius
+'''
+
+import asyncio, heapq, itertools, random, time, logging
+
+SKIP = 'skip'
+CATCH_UP = 'catchup'
+COALESCE = 'coalesce'
+MISSED_RUN_POLICIES = (SKIP, CATCH_UP, COALESCE)
+MISSED_RUNS = 'missedruns'  # plugin config key for the missed run policy
+
+log = logging.getLogger('main')
+
+class ScheduledPlugin:
+    def __init__(self, plugin, scheduled, next_run, done):
+        self.plugin = plugin
+        self.scheduled = scheduled  # loop time of the next run, without jitter
+        self.next_run = next_run  # loop time of the next run
+        self.done = done  # future which is resolved when the plugin is unscheduled
+        self.running = False
+        self.runs = 0
+        self.skipped = 0
+        self.last_duration = None
+        self.removed = False
+
+class PluginScheduler:
+    '''Runs plugins' action() every plugin.period seconds, from one task
+
+    jitter: a fraction of each plugin's period, up to which runs are randomly delayed
+    max_concurrent: the max number of plugin actions running at once (None for no limit)
+    policy: the default missed run policy (SKIP, CATCH_UP or COALESCE)'''
+
+    def __init__(self, loop, jitter=0.0, max_concurrent=None, policy=COALESCE):
+        self.loop = loop
+        self.jitter = jitter
+        self.policy = policy
+        self.semaphore = asyncio.Semaphore(max_concurrent) if max_concurrent else None
+        self.heap = list()  # (next run, sequence number, ScheduledPlugin)
+        self.entries = dict()  # id(plugin) -> ScheduledPlugin
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self.running = set()  # tasks running plugins' actions
+        self.stopped = False
+
+    async def schedule(self, plugin):
+        '''(PluginScheduler, Plugin) -> None
+        Runs plugin's action() periodically until it shuts down or is unscheduled.
+        Cancelling this unschedules the plugin'''
+        if plugin.period == -1:
+            return
+        now = self.loop.time()
+        entry = ScheduledPlugin(plugin, now, now + self._jitter(plugin), self.loop.create_future())
+        self._unschedule(plugin)
+        self.entries[id(plugin)] = entry
+        self._push(entry)
+        try:
+            await entry.done
+        finally:
+            if self.entries.get(id(plugin)) is entry:
+                self._unschedule(plugin)
+
+    def unschedule(self, plugin):
+        '''(PluginScheduler, Plugin) -> None
+        Stops running plugin. This is safe to call from any thread'''
+        self.loop.call_soon_threadsafe(self._unschedule, plugin)
+
+    def _unschedule(self, plugin):
+        entry = self.entries.pop(id(plugin), None)
+        if entry is not None:
+            entry.removed = True
+            if not entry.done.done():
+                entry.done.set_result(None)
+
+    def _push(self, entry):
+        heapq.heappush(self.heap, (entry.next_run, next(self._sequence), entry))
+        self._wakeup.set()
+
+    def _jitter(self, plugin):
+        if self.jitter <= 0:
+            return 0.0
+        return random.uniform(0, self.jitter * plugin.period)
+
+    def get_policy(self, plugin):
+        config = getattr(plugin, 'config', None)
+        try:
+            if config is not None and MISSED_RUNS in config and config[MISSED_RUNS] in MISSED_RUN_POLICIES:
+                return config[MISSED_RUNS]
+        except TypeError:
+            pass  # not a config file
+        return self.policy
+
+    async def run(self):
+        '''(PluginScheduler) -> None
+        the looping task which starts plugins' actions when they're due.
+        Once stopped, it waits for the actions which are still running to be cancelled'''
+        while not self.stopped:
+            if not self.heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            next_run, sequence, entry = self.heap[0]
+            if entry.removed:
+                heapq.heappop(self.heap)
+                continue
+            delay = next_run - self.loop.time()
+            if delay > 0:
+                # wait until it's due, or until something is scheduled which might be due sooner
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            heapq.heappop(self.heap)
+            if entry.plugin.shutting_down:
+                self._unschedule(entry.plugin)
+                continue
+            entry.running = True
+            task = self.loop.create_task(self._run(entry))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+        if self.running:
+            await asyncio.wait(list(self.running))
+
+    async def _run(self, entry):
+        plugin = entry.plugin
+        try:
+            if self.semaphore is not None:
+                await self.semaphore.acquire()
+            try:
+                start_time = time.perf_counter()
+                try:
+                    await plugin.action()
+                except Exception as e: # catch any exception that could crash the task
+                    plugin._on_action_error(e)
+                entry.last_duration = time.perf_counter() - start_time
+                entry.runs += 1
+            finally:
+                if self.semaphore is not None:
+                    self.semaphore.release()
+        finally:
+            entry.running = False
+        if entry.removed or plugin.shutting_down or plugin.period == -1:
+            self._unschedule(plugin)
+            return
+        self._reschedule(entry)
+
+    def _reschedule(self, entry):
+        now = self.loop.time()
+        period = entry.plugin.period
+        next_run = entry.scheduled + period
+        if next_run < now:
+            policy = self.get_policy(entry.plugin)
+            if policy == SKIP:
+                missed = int((now - next_run) // period) + 1 if period > 0 else 0
+                entry.skipped += missed
+                next_run += missed * period
+            elif policy == COALESCE:
+                next_run = now
+            # CATCH_UP runs at next_run, which is already due, until it's caught up
+        # jitter isn't carried over to the next run, so it doesn't cause drift
+        entry.scheduled = next_run
+        entry.next_run = next_run + self._jitter(entry.plugin)
+        self._push(entry)
+
+    def stop(self):
+        '''(PluginScheduler) -> None
+        Unschedules every plugin and cancels the actions which are running'''
+        self.stopped = True
+        self._wakeup.set()
+        for entry in list(self.entries.values()):
+            self._unschedule(entry.plugin)
+        for task in self.running:
+            task.cancel()
+
+    def next_run(self, plugin):
+        '''(PluginScheduler, Plugin) -> float
+        Returns how many seconds until plugin next runs (negative if it's overdue), or None if it isn't scheduled'''
+        entry = self.entries.get(id(plugin))
+        if entry is None:
+            return None
+        return entry.next_run - self.loop.time()
+
+    def info(self, plugin):
+        '''(PluginScheduler, Plugin) -> dict
+        Returns when plugin next runs and how its runs have gone, or None if it isn't scheduled'''
+        entry = self.entries.get(id(plugin))
+        if entry is None:
+            return None
+        return {
+            'period': plugin.period,
+            'next_run': entry.next_run - self.loop.time(),
+            'running': entry.running,
+            'runs': entry.runs,
+            'skipped': entry.skipped,
+            'last_duration': entry.last_duration,
+            'policy': self.get_policy(plugin)
+            }
@@ -0,0 +1,112 @@
+'''
+Shared process pool for ThreadedPlugins.
+
+By default every ThreadedPlugin spawns its own process, which holds a copy of
+the whole bot, so memory use and process count grow with every scraper added.
+WorkerPool instead runs the threaded_action() of pooled plugins in a bounded,
+shared ProcessPoolExecutor.
+
+A pooled threaded_action() runs on a blank instance of the plugin's class in a
+worker process. Only the attributes the plugin names in threaded_state are
+copied to it, and their new values are copied back afterwards. So anything it
+needs must be named there and must be picklable.
+Whatever it puts in its queue is sent back to the plugin's action() as usual.
+
+Plugin classes are pickled by reference, so worker processes keep running the
+code they first imported. recycle() replaces the workers once a pooled plugin
+is reloaded.
+
+@author: NGnius
+'''
+
+import asyncio, concurrent.futures, logging, threading
+
+DEFAULT_MAX_WORKERS = 2
+
+log = logging.getLogger('main')
+
+class ActionList(list):
+    '''Stands in for the multiprocessing Queue given to threaded_action() in a worker process'''
+
+    def put(self, item, block=True, timeout=None):
+        self.append(item)
+
+    def put_nowait(self, item):
+        self.append(item)
+
+    def empty(self):
+        return len(self) == 0
+
+    def qsize(self):
+        return len(self)
+
+def run_threaded_action(plugin_class, state, kwargs):
+    '''(type, dict, dict) -> (list, dict)
+    Runs plugin_class's threaded_action() once, on an instance with only the attributes in state.
+    Returns what it put in its queue and the new values of the attributes in state.
+    This runs in a worker process'''
+    worker = plugin_class.__new__(plugin_class)  # __init__ is skipped, since it would spawn processes, load config, etc.
+    worker.__dict__.update(state)
+    worker.shutting_down = False
+    queue = ActionList()
+    plugin_class.threaded_action(worker, queue, **kwargs)
+    return list(queue), {name: getattr(worker, name, None) for name in state}
+
+class WorkerPool:
+    '''A bounded process pool shared by every pooled ThreadedPlugin
+
+    The processes are only started once something is submitted'''
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS):
+        self.max_workers = max_workers
+        self.executor = None
+        self._lock = threading.Lock()  # plugins are initialized in several threads
+        self.pending = set()  # futures of submitted actions which haven't finished
+        self.submitted = 0
+        self.failed = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self.executor is None:
+                self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.max_workers)
+            return self.executor
+
+    async def run_threaded_action(self, loop, plugin):
+        '''(WorkerPool, asyncio.AbstractEventLoop, ThreadedPlugin) -> list
+        Runs plugin's threaded_action() once in a worker process, then updates plugin's threaded state.
+        Returns what threaded_action() put in its queue'''
+        self.submitted += 1
+        future = self._get_executor().submit(run_threaded_action, type(plugin), plugin.get_threaded_state(), plugin.threaded_kwargs)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        try:
+            actions, state = await asyncio.wrap_future(future, loop=loop)
+        except Exception as e:
+            self.failed += 1
+            raise e
+        plugin.set_threaded_state(state)
+        return actions
+
+    def shutdown(self):
+        '''(WorkerPool) -> None
+        Stops the worker processes, without waiting for running actions.
+        Actions which haven't started are cancelled'''
+        with self._lock:
+            if self.executor is not None:
+                for future in list(self.pending):
+                    future.cancel()
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def recycle(self):
+        '''(WorkerPool) -> None
+        Replaces the worker processes with new ones (once something is submitted),
+        so that they import the current code of reloaded plugins.
+        Actions which were already submitted still finish in the old processes'''
+        with self._lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+                self.executor = None
+
+    def stats(self):
+        return {'max_workers': self.max_workers, 'started': self.executor is not None, 'submitted': self.submitted, 'failed': self.failed}
@@ -0,0 +1,84 @@
+import unittest
+import asyncio
+import bot as botlib
+from libs import testlib
+
+class FakeServer:
+    def __init__(self, server_id, channel_ids):
+        self.id = server_id
+        self.channels = [FakeChannel(channel_id, self) for channel_id in channel_ids]
+
+class FakeChannel:
+    def __init__(self, channel_id, server=None):
+        self.id = channel_id
+        self.server = server
+        self.is_private = server is None
+
+class FakeConnection:
+    def __init__(self, servers):
+        self.servers = servers
+        self.private_channels = list()
+
+class StubBot(botlib.Bot):
+    '''Just enough of a Bot to keep the channel index, without logging in or loading any config'''
+
+    def __init__(self, servers):
+        self.loop = asyncio.new_event_loop()
+        self.log = testlib.testlog
+        self.connection = FakeConnection(servers)
+        self.channel_index = dict()
+
+    def run_event(self, event, *args):
+        self.loop.run_until_complete(getattr(self, 'on_' + event)(*args))
+
+class ChannelIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.first = FakeServer('10', ['11', '12'])
+        self.second = FakeServer('20', ['21'])
+        self.bot = StubBot([self.first, self.second])
+
+    def tearDown(self):
+        self.bot.loop.close()
+
+    def test_beforeIndexBuilt(self):
+        # servers are searched until on_ready builds the index
+        self.assertEqual((self.second, self.second.channels[0]), self.bot.find_channel('21'))
+        self.assertEqual((None, None), self.bot.find_channel('30'))
+
+    def test_build(self):
+        self.bot.build_channel_index()
+        self.assertEqual({'11', '12', '21'}, set(self.bot.channel_index))
+        self.assertEqual((self.first, self.first.channels[1]), self.bot.find_channel('12'))
+        # once the index is built, channels which aren't in it aren't searched for
+        self.bot.connection.servers.append(FakeServer('30', ['31']))
+        self.assertEqual((None, None), self.bot.find_channel('31'))
+
+    def test_privateChannels(self):
+        private = FakeChannel('40')
+        self.bot.connection.private_channels.append(private)
+        self.bot.build_channel_index()
+        self.assertEqual((None, private), self.bot.find_channel('40'))
+        self.bot.run_event('channel_create', private)
+        self.assertNotIn('40', self.bot.channel_index)
+
+    def test_channelEvents(self):
+        self.bot.build_channel_index()
+        created = FakeChannel('13', self.first)
+        self.bot.run_event('channel_create', created)
+        self.assertEqual((self.first, created), self.bot.find_channel('13'))
+        updated = FakeChannel('13', self.first)
+        self.bot.run_event('channel_update', created, updated)
+        self.assertIs(updated, self.bot.find_channel('13')[1])
+        self.bot.run_event('channel_delete', updated)
+        self.assertNotIn('13', self.bot.channel_index)
+
+    def test_serverEvents(self):
+        self.bot.build_channel_index()
+        joined = FakeServer('30', ['31', '32'])
+        self.bot.run_event('server_join', joined)
+        self.assertEqual((joined, joined.channels[1]), self.bot.find_channel('32'))
+        self.bot.run_event('server_available', self.second)
+        self.assertEqual((self.second, self.second.channels[0]), self.bot.find_channel('21'))
+        self.bot.unindex_server(self.first)
+        self.assertEqual({'21', '31', '32'}, set(self.bot.channel_index))
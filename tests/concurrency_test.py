@@ -0,0 +1,120 @@
+import unittest
+import asyncio
+import bot as botlib
+from libs import testlib, registry, metrics, command
+
+class FakeMessage:
+    server = None
+    content = 'hello'
+
+class SlowCommand(command.Command):
+    def __init__(self, tracker, breaks_on_match=False, fails=False):
+        self.perms = None # no api methods or perms needed
+        self.breaks_on_match = breaks_on_match
+        self.tracker = tracker
+        self.fails = fails
+
+    def matches(self, message):
+        return True
+
+    def action(self, message):
+        self.tracker.start()
+        try:
+            yield from asyncio.sleep(0.05)
+            if self.fails:
+                raise ValueError('failed on purpose')
+        finally:
+            self.tracker.finish()
+
+class Tracker:
+    '''counts how many actions are running at once'''
+
+    def __init__(self):
+        self.running = 0
+        self.most_running = 0
+        self.finished = 0
+
+    def start(self):
+        self.running += 1
+        self.most_running = max(self.most_running, self.running)
+
+    def finish(self):
+        self.running -= 1
+        self.finished += 1
+
+class StubBot(botlib.Bot):
+    '''Just enough of a Bot to dispatch messages to commands, without logging in or loading any config'''
+
+    def __init__(self, concurrent_actions, max_concurrent_actions=2):
+        self.loop = asyncio.new_event_loop()
+        self.log = testlib.testlog
+        self.commands = registry.AddOnRegistry()
+        self.command_index = None
+        self.command_index_version = None
+        self.concurrent_actions = concurrent_actions
+        self.action_semaphore = asyncio.Semaphore(max_concurrent_actions, loop=self.loop)
+        self.action_timeout = None
+        self.action_timeouts = dict()
+        self.quarantined = dict()
+        self.consecutive_timeouts = dict()
+        self.metrics = metrics.MetricsRegistry()
+        self.errors = list()
+
+    @asyncio.coroutine
+    def message_stuff(self):
+        pass
+
+    @asyncio.coroutine
+    def on_command_error(self, cmd_name, error, message):
+        self.errors.append(cmd_name)
+
+class ConcurrentDispatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tracker = Tracker()
+
+    def dispatch(self, bot, messages, actions=None):
+        '''returns how many actions finished before on_message returned, then waits for the rest (one per message, by default)'''
+        async def run():
+            for i in range(messages):
+                await bot.on_message(FakeMessage())
+            finished = self.tracker.finished
+            for i in range(100):
+                if self.tracker.finished >= (actions or messages):
+                    break
+                await asyncio.sleep(0.02)
+            return finished
+        try:
+            return bot.loop.run_until_complete(run())
+        finally:
+            bot.loop.close()
+
+    def test_concurrent(self):
+        bot = StubBot(concurrent_actions=True)
+        bot.commands['slow'] = SlowCommand(self.tracker)
+        self.assertEqual(0, self.dispatch(bot, 5))
+        self.assertEqual(5, self.tracker.finished)
+        # maxconcurrentactions limits how many run at once
+        self.assertEqual(2, self.tracker.most_running)
+        self.assertEqual(5, bot.metrics.get(botlib.COMMANDS, 'slow').actions)
+
+    def test_sequential(self):
+        bot = StubBot(concurrent_actions=False)
+        bot.commands['slow'] = SlowCommand(self.tracker)
+        self.assertEqual(3, self.dispatch(bot, 3))
+        self.assertEqual(1, self.tracker.most_running)
+
+    def test_breaksOnMatch(self):
+        bot = StubBot(concurrent_actions=True)
+        bot.commands['first'] = SlowCommand(self.tracker, breaks_on_match=True)
+        bot.commands['second'] = SlowCommand(self.tracker)
+        self.dispatch(bot, 1)
+        self.assertEqual(1, self.tracker.finished)
+        self.assertNotIn('second', bot.metrics.addons[botlib.COMMANDS])
+
+    def test_errorsReported(self):
+        bot = StubBot(concurrent_actions=True)
+        bot.commands['broken'] = SlowCommand(self.tracker, fails=True)
+        self.dispatch(bot, 2)
+        self.assertEqual(['broken', 'broken'], bot.errors)
+        self.assertEqual(2, bot.metrics.get(botlib.COMMANDS, 'broken').errors)
@@ -0,0 +1,80 @@
+import unittest
+import os, tempfile, re
+from libs import discovery
+
+class TestDiscoveryCache(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.folder = os.path.join(self.directory.name, 'addons')
+        os.mkdir(self.folder)
+        os.mkdir(os.path.join(self.folder, 'package'))
+        self.path = os.path.join(self.folder, 'hello.py')
+        with open(self.path, 'w') as file:
+            file.write('# hello\n')
+        self.filename = os.path.join(self.directory.name, 'addoncache.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_listdir(self):
+        cache = discovery.DiscoveryCache(self.filename)
+        self.assertEqual([('hello.py', True), ('package', False)], cache.listdir(self.folder))
+        self.assertEqual([('hello.py', True), ('package', False)], cache.listdir(self.folder))
+        self.assertEqual(1, cache.hits)
+
+    def test_listdirChanged(self):
+        cache = discovery.DiscoveryCache(self.filename)
+        cache.listdir(self.folder)
+        with open(os.path.join(self.folder, 'bye.py'), 'w') as file:
+            file.write('# bye\n')
+        os.utime(self.folder, ns=(0, 0))  # mtime resolution can be coarse, so force a change
+        self.assertEqual([('bye.py', True), ('hello.py', True), ('package', False)], cache.listdir(self.folder))
+
+    def test_saveAndLoad(self):
+        cache = discovery.DiscoveryCache(self.filename)
+        cache.listdir(self.folder)
+        cache.put(self.path, 'command', config=None, trigger_prefixes=['!hello'])
+        cache.save()
+        cache = discovery.DiscoveryCache(self.filename)
+        cache.load()
+        self.assertEqual('command', cache.get(self.path)[discovery.KIND])
+        self.assertEqual(['!hello'], cache.get(self.path)['trigger_prefixes'])
+        self.assertEqual([('hello.py', True), ('package', False)], cache.listdir(self.folder))
+        self.assertEqual(3, cache.hits)
+
+    def test_changedFile(self):
+        cache = discovery.DiscoveryCache(self.filename)
+        cache.put(self.path, None)
+        with open(self.path, 'a') as file:
+            file.write('class Command: pass\n')
+        self.assertIsNone(cache.get(self.path))
+
+    def test_corruptCache(self):
+        with open(self.filename, 'w') as file:
+            file.write('{not json')
+        cache = discovery.DiscoveryCache(self.filename)
+        cache.load()
+        self.assertEqual(dict(), cache.files)
+
+    def test_prune(self):
+        cache = discovery.DiscoveryCache(self.filename)
+        cache.put(self.path, None)
+        cache.prune(set())
+        self.assertIsNone(cache.get(self.path))
+
+    def test_describe(self):
+        class Cmd:
+            trigger_prefixes = ('!hi',)
+            trigger_patterns = (re.compile('hi'),)
+        description = discovery.describe(Cmd())
+        self.assertEqual(['!hi'], description['trigger_prefixes'])
+        self.assertEqual([], description['trigger_keywords'])
+        self.assertIsNone(description['trigger_patterns'])
+
+    def test_describeEmoji(self):
+        class Rxn:
+            emoji = {'1': '👍', '2': None}
+        self.assertEqual({discovery.EMOJI: {'1': '👍', '2': None}}, discovery.describe_emoji(Rxn()))
+        Rxn.emoji = None
+        self.assertEqual(dict(), discovery.describe_emoji(Rxn()))
@@ -0,0 +1,116 @@
+import unittest
+import re
+from collections import OrderedDict
+from libs import dispatch
+
+class FakeCommand:
+    def __init__(self, prefixes=tuple(), keywords=tuple(), patterns=tuple()):
+        self.trigger_prefixes = prefixes
+        self.trigger_keywords = keywords
+        self.trigger_patterns = patterns
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+class TestCommandIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.commands = OrderedDict()
+        self.commands['alpha'] = FakeCommand(prefixes=('!alpha',))
+        self.commands['beta'] = FakeCommand()
+        self.commands['delta'] = FakeCommand(keywords=('pi',))
+        self.commands['gamma'] = FakeCommand(patterns=(r'\bvote\b', re.compile(r'POLL')))
+        self.commands['omega'] = FakeCommand(patterns=(r'(\w)\1{3}',))
+        self.index = dispatch.CommandIndex(self.commands)
+
+    def test_untriggeredCommandsAlwaysCandidates(self):
+        self.assertEqual(['beta'], self.index.candidates(FakeMessage('hello there')))
+        self.assertEqual(['beta'], self.index.candidates(FakeMessage(None)))
+
+    def test_prefix(self):
+        self.assertEqual(['alpha', 'beta'], self.index.candidates(FakeMessage('!ALPHA now')))
+        self.assertEqual(['beta'], self.index.candidates(FakeMessage('not !alpha')))
+
+    def test_keyword(self):
+        self.assertEqual(['beta', 'delta'], self.index.candidates(FakeMessage('what is Pi?')))
+        self.assertEqual(['beta'], self.index.candidates(FakeMessage('pie')))
+
+    def test_patterns(self):
+        self.assertEqual(['beta', 'gamma'], self.index.candidates(FakeMessage('please VOTE')))
+        self.assertEqual(['beta', 'gamma'], self.index.candidates(FakeMessage('a POLL')))
+        self.assertEqual(['beta'], self.index.candidates(FakeMessage('a poll')))
+        self.assertEqual(['beta', 'omega'], self.index.candidates(FakeMessage('zzzz')))
+
+    def test_registryOrder(self):
+        self.assertEqual(['alpha', 'beta', 'delta', 'gamma'], self.index.candidates(FakeMessage('!alpha pi vote')))
+
+class TestPrefixTrie(unittest.TestCase):
+
+    def test_nestedPrefixes(self):
+        trie = dispatch.PrefixTrie()
+        trie.add('!', 'bang')
+        trie.add('!help', 'help')
+        self.assertEqual({'bang', 'help'}, trie.search('!Help me'))
+        self.assertEqual({'bang'}, trie.search('!hel'))
+        self.assertEqual(set(), trie.search('help'))
+
+class FakeReactionCommand:
+    def __init__(self, emoji, emoji_indexed=True):
+        self.emoji = emoji
+        self.emoji_indexed = emoji_indexed
+
+class FakeServer:
+    def __init__(self, server_id):
+        self.id = server_id
+
+class FakeEmoji:
+    def __init__(self, emoji_id):
+        self.id = emoji_id
+
+class FakeReaction:
+    def __init__(self, emoji, server=None):
+        self.emoji = emoji
+        self.message = FakeMessage('')
+        self.message.server = server
+
+class TestReactionIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.reactions = OrderedDict()
+        self.reactions['any'] = FakeReactionCommand(None)
+        self.reactions['custom'] = FakeReactionCommand({'1': '12345'})
+        self.reactions['unicode'] = FakeReactionCommand({'1': '✅', '2': '✅'})
+        self.reactions['wildcard'] = FakeReactionCommand({'2': ''})
+        self.index = dispatch.ReactionIndex(self.reactions)
+
+    def test_privateMessage(self):
+        self.assertEqual(['any'], self.index.candidates(FakeReaction('✅')))
+
+    def test_emojis(self):
+        self.assertEqual(['any', 'custom'], self.index.candidates(FakeReaction(FakeEmoji('12345'), FakeServer('1'))))
+        self.assertEqual(['any', 'unicode'], self.index.candidates(FakeReaction('✅', FakeServer('1'))))
+        self.assertEqual(['any'], self.index.candidates(FakeReaction(FakeEmoji('12345'), FakeServer('3'))))
+
+    def test_serverWildcard(self):
+        self.assertEqual(['any', 'unicode', 'wildcard'], self.index.candidates(FakeReaction('✅', FakeServer('2'))))
+        self.assertEqual(['any', 'wildcard'], self.index.candidates(FakeReaction(FakeEmoji('12345'), FakeServer('2'))))
+
+    def test_notEmojiIndexed(self):
+        # eg a reaction command which overrides _matches(), so it may match emojis outside of its map
+        self.reactions['custom_matches'] = FakeReactionCommand({'1': '👍'}, emoji_indexed=False)
+        index = dispatch.ReactionIndex(self.reactions)
+        self.assertEqual(['any', 'custom_matches'], index.candidates(FakeReaction('👎', FakeServer('3'))))
+        self.assertEqual(['any', 'custom_matches'], index.candidates(FakeReaction('👎')))
+
+class TestIndexedDict(unittest.TestCase):
+
+    def test_changesReported(self):
+        changes = list()
+        indexed = dispatch.IndexedDict({'a': 1}, on_change=lambda: changes.append(True))
+        indexed['b'] = 2
+        del indexed['a']
+        indexed.update(c=3)
+        indexed.pop('c')
+        self.assertEqual(4, len(changes))
+        self.assertEqual({'b': 2}, indexed)
@@ -0,0 +1,61 @@
+import unittest
+import os, tempfile
+from libs import journal
+
+class TestMessageJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, 'messages.journal')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_saveAndLoad(self):
+        message_journal = journal.MessageJournal(self.filename)
+        message_journal.load()
+        message_journal.save([('1', '10'), ('1', '11'), ('2', '20')])
+        self.assertEqual([('1', '10'), ('1', '11'), ('2', '20')], journal.MessageJournal(self.filename).load())
+
+    def test_saveAppendsOnlyChanges(self):
+        message_journal = journal.MessageJournal(self.filename)
+        message_journal.load()
+        self.assertEqual(2, message_journal.save([('1', '10'), ('1', '11')]))
+        self.assertEqual(0, message_journal.save([('1', '10'), ('1', '11')]))
+        self.assertEqual(2, message_journal.save([('1', '11'), ('3', '30')]))
+        self.assertEqual(len(journal.HEADER) + 4*journal.RECORD.size, os.path.getsize(self.filename))
+        self.assertEqual([('1', '11'), ('3', '30')], journal.MessageJournal(self.filename).load())
+
+    def test_compaction(self):
+        message_journal = journal.MessageJournal(self.filename)
+        message_journal.load()
+        for i in range(journal.MIN_COMPACT_RECORDS):
+            message_journal.save([('1', str(i))])
+        self.assertLessEqual(message_journal.records, journal.MIN_COMPACT_RECORDS)
+        self.assertEqual([('1', str(journal.MIN_COMPACT_RECORDS-1))], journal.MessageJournal(self.filename).load())
+
+    def test_unloadedJournalOverwrites(self):
+        journal.MessageJournal(self.filename).import_pairs([('1', '10')])
+        message_journal = journal.MessageJournal(self.filename)
+        message_journal.save([('2', '20')])
+        self.assertEqual([('2', '20')], journal.MessageJournal(self.filename).load())
+
+    def test_partialRecordIgnored(self):
+        journal.MessageJournal(self.filename).import_pairs([('1', '10'), ('2', '20')])
+        with open(self.filename, 'ab') as file:
+            file.write(b'\x01\x02\x03')
+        self.assertEqual([('1', '10'), ('2', '20')], journal.MessageJournal(self.filename).load())
+        self.assertEqual(len(journal.HEADER) + 2*journal.RECORD.size, os.path.getsize(self.filename))
+
+    def test_notAJournal(self):
+        with open(self.filename, 'w') as file:
+            file.write('123456789012345678:123456789012345678\n')
+        self.assertRaises(ValueError, journal.MessageJournal(self.filename).load)
+
+    def test_notAJournalIsUntouched(self):
+        backup = b'123456789012345678:123456789012345678\n123456789012345678:1234567890123456\n'
+        with open(self.filename, 'wb') as file:
+            file.write(backup)
+        self.assertRaises(ValueError, journal.MessageJournal(self.filename).load)
+        with open(self.filename, 'rb') as file:
+            self.assertEqual(backup, file.read())
@@ -0,0 +1,94 @@
+import unittest
+from collections import OrderedDict
+from libs import loader, command, reaction, dispatch
+
+class FakeCommand(command.Command):
+    def __init__(self):
+        pass # no api methods or perms needed
+
+    def _matches(self, message):
+        return True
+
+class FakeChannel:
+    def __init__(self, server=None):
+        self.server = server
+
+class FakeServer:
+    def __init__(self, server_id):
+        self.id = server_id
+
+class FakeMessage:
+    def __init__(self, content, server=None):
+        self.content = content
+        self.server = server
+        self.channel = FakeChannel(server)
+
+class FakeReaction:
+    def __init__(self, emoji, server=None):
+        self.emoji = emoji
+        self.message = FakeMessage('', server)
+
+class FakeAddOnFile:
+    '''Stands in for an add-on file, which can be broken or fixed'''
+
+    def __init__(self, broken=False):
+        self.broken = broken
+        self.version = 1
+        self.imports = 0
+
+    def load(self):
+        self.imports += 1
+        if self.broken:
+            raise SyntaxError('broken add-on')
+        return FakeCommand()
+
+    def change(self, broken):
+        self.broken = broken
+        self.version += 1
+
+class TestLazyCommand(unittest.TestCase):
+
+    def test_deferredImport(self):
+        addon_file = FakeAddOnFile()
+        lazy = loader.LazyCommand(addon_file.load, {loader.TYPE: 'command', 'trigger_prefixes': ['!hello']})
+        index = dispatch.CommandIndex(OrderedDict([('hello', lazy)]))
+        self.assertEqual(list(), index.candidates(FakeMessage('something else')))
+        self.assertEqual(0, addon_file.imports)
+
+    def test_firstUseImport(self):
+        addon_file = FakeAddOnFile()
+        lazy = loader.LazyCommand(addon_file.load, {loader.TYPE: 'command', 'trigger_prefixes': ['!hello']})
+        self.assertTrue(lazy._matches(FakeMessage('!hello')))
+        self.assertTrue(lazy._matches(FakeMessage('!hello again')))
+        self.assertEqual(1, addon_file.imports)
+        self.assertIsInstance(lazy.addon, FakeCommand)
+
+    def test_failure(self):
+        addon_file = FakeAddOnFile(broken=True)
+        lazy = loader.LazyCommand(addon_file.load, {loader.TYPE: 'command'}, version_func=lambda: addon_file.version)
+        self.assertRaises(SyntaxError, lazy._matches, FakeMessage('!hello'))
+        # a broken add-on isn't imported again until its file changes
+        self.assertFalse(lazy._matches(FakeMessage('!hello')))
+        self.assertEqual(1, addon_file.imports)
+        addon_file.change(broken=False)
+        self.assertTrue(lazy._matches(FakeMessage('!hello')))
+        self.assertEqual(2, addon_file.imports)
+
+    def test_notACommand(self):
+        lazy = loader.LazyCommand(lambda: object(), {loader.TYPE: 'command'})
+        self.assertFalse(lazy._matches(FakeMessage('!hello')))
+        self.assertTrue(lazy.failed)
+
+class TestLazyReaction(unittest.TestCase):
+
+    def test_emojiFromDescription(self):
+        lazy = loader.LazyReaction(lambda: None, {loader.TYPE: 'reaction', loader.EMOJI: {'1': '👍'}})
+        index = dispatch.ReactionIndex(OrderedDict([('vote', lazy)]))
+        self.assertEqual(list(), index.candidates(FakeReaction('👎', FakeServer('1'))))
+        self.assertEqual(['vote'], index.candidates(FakeReaction('👍', FakeServer('1'))))
+
+    def test_noEmoji(self):
+        lazy = loader.LazyReaction(lambda: None, {loader.TYPE: 'reaction'})
+        self.assertIsNone(lazy.emoji)
+        index = dispatch.ReactionIndex(OrderedDict([('vote', lazy)]))
+        self.assertEqual(['vote'], index.candidates(FakeReaction('👎', FakeServer('1'))))
@@ -0,0 +1,46 @@
+import unittest
+import asyncio, logging, time
+from libs import loopmonitor
+
+def blocking_addon(seconds):
+    time.sleep(seconds)
+
+# pretend blocking_addon is defined in an add-on
+blocking_addon = type(blocking_addon)(blocking_addon.__code__, {'__name__': 'addons.slow.blocker', 'time': time})
+
+class TestLoopMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.monitor = loopmonitor.LoopMonitor(self.loop, interval=0.01, threshold=0.05, log=logging.getLogger('test'))
+
+    def tearDown(self):
+        self.monitor.stop()
+        self.loop.close()
+
+    def run_loop(self, seconds):
+        task = self.loop.create_task(self.monitor.run())
+        self.loop.run_until_complete(asyncio.sleep(seconds))
+        self.monitor.stop()
+        self.loop.run_until_complete(task)
+
+    def test_blame(self):
+        self.loop.call_later(0.05, blocking_addon, 0.3)
+        self.run_loop(0.5)
+        report = self.monitor.report()
+        self.assertEqual(['addons.slow.blocker'], list(report['blame']))
+        self.assertEqual(1, report['stalls'])
+        self.assertGreater(report['blame']['addons.slow.blocker']['time'], 0.2)
+        self.assertGreater(report['lag']['max'], 0.2)
+        self.assertIn('blocking_addon', ''.join(report['samples'][0]['stack']))
+
+    def test_noStall(self):
+        self.run_loop(0.2)
+        report = self.monitor.report()
+        self.assertEqual(0, report['stalls'])
+        self.assertGreater(report['lag']['count'], 0)
+
+    def test_unknownCulprit(self):
+        self.loop.call_later(0.05, time.sleep, 0.3)
+        self.run_loop(0.5)
+        self.assertEqual([loopmonitor.UNKNOWN], list(self.monitor.report()['blame']))
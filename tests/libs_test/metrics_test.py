@@ -0,0 +1,54 @@
+import unittest
+import os, tempfile, json
+from libs import metrics
+
+class TestHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = metrics.Histogram()
+        for i in range(1, 101):
+            histogram.add(i / 1000)
+        summary = histogram.summary()
+        self.assertEqual(100, summary['count'])
+        self.assertAlmostEqual(0.0505, summary['mean'])
+        self.assertEqual(0.1, summary['max'])
+        # percentiles are accurate to within a bucket
+        self.assertLessEqual(0.050, summary['p50'])
+        self.assertGreaterEqual(0.050 * metrics.BUCKET_FACTOR, summary['p50'])
+        self.assertLessEqual(0.095, summary['p95'])
+        self.assertGreaterEqual(0.095 * metrics.BUCKET_FACTOR, summary['p95'])
+        self.assertLessEqual(summary['p99'], 0.1)
+
+    def test_empty(self):
+        self.assertEqual(0.0, metrics.Histogram().percentile(99))
+
+    def test_tiny(self):
+        histogram = metrics.Histogram()
+        histogram.add(0)
+        self.assertEqual(0, histogram.percentile(50))
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def test_record(self):
+        registry = metrics.MetricsRegistry()
+        registry.record_match('commands', 'hello', 0.001, False)
+        registry.record_match('commands', 'hello', 0.001, True)
+        registry.record_action('commands', 'hello', 0.5)
+        registry.record_error('commands', 'hello')
+        registry.record_action('reactions', 'vote', 0.1)
+        report = registry.report()
+        self.assertEqual(2, report['commands']['hello']['checks'])
+        self.assertEqual(1, report['commands']['hello']['matches'])
+        self.assertEqual(1, report['commands']['hello']['actions'])
+        self.assertEqual(1, report['commands']['hello']['errors'])
+        self.assertEqual(1, report['reactions']['vote']['action_time']['count'])
+        self.assertEqual([('commands', 'hello'), ('reactions', 'vote')], [total[:2] for total in registry.busiest()])
+
+    def test_save(self):
+        registry = metrics.MetricsRegistry()
+        registry.record_action('commands', 'hello', 0.5)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'metrics.json')
+            registry.save(filename)
+            with open(filename) as file:
+                self.assertEqual(0.5, json.load(file)['commands']['hello']['action_time']['max'])
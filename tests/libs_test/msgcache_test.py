@@ -0,0 +1,112 @@
+import unittest
+from libs import msgcache
+
+class FakeMessage:
+    def __init__(self, msg_id):
+        self.id = msg_id
+
+class TestMessageCache(unittest.TestCase):
+
+    def test_evictsOldest(self):
+        cache = msgcache.MessageCache(maxlen=2)
+        first, second, third = FakeMessage('1'), FakeMessage('2'), FakeMessage('3')
+        for msg in (first, second, third):
+            cache.append(msg)
+        self.assertEqual([second, third], list(cache))
+        self.assertNotIn(first, cache)
+        self.assertIs(third, cache.get('3'))
+
+    def test_pinnedNotEvicted(self):
+        cache = msgcache.MessageCache(maxlen=2)
+        pinned = FakeMessage('1')
+        cache.pin(pinned)
+        for i in range(2, 10):
+            cache.append(FakeMessage(str(i)))
+        self.assertIn(pinned, cache)
+        self.assertEqual(2, len(cache))
+        cache.unpin(pinned)
+        cache.append(FakeMessage('10'))
+        cache.append(FakeMessage('11'))
+        self.assertNotIn(pinned, cache)
+
+    def test_onlyPinned(self):
+        cache = msgcache.MessageCache(maxlen=1)
+        cache.pin(FakeMessage('1'))
+        cache.pin(FakeMessage('2'))
+        self.assertEqual(2, len(cache))
+
+    def test_remove(self):
+        msg = FakeMessage('1')
+        cache = msgcache.MessageCache([msg])
+        cache.remove(msg)
+        self.assertEqual(0, len(cache))
+        self.assertRaises(ValueError, cache.remove, msg)
+
+    def test_appendSameId(self):
+        cache = msgcache.MessageCache(maxlen=5)
+        cache.append(FakeMessage('1'))
+        cache.append(FakeMessage('2'))
+        newer = FakeMessage('1')
+        cache.append(newer)
+        self.assertEqual(['2', '1'], [msg.id for msg in cache])
+        self.assertIs(newer, cache.get('1'))
+
+class TestWatchSet(unittest.TestCase):
+
+    def test_callbacks(self):
+        added, removed = list(), list()
+        watch = msgcache.WatchSet({'a'}, on_add=added.append, on_remove=removed.append)
+        watch.add('b')
+        watch.add('b')
+        watch |= {'c'}
+        watch.discard('a')
+        watch.discard('z')
+        watch -= {'b'}
+        self.assertEqual(['b', 'c'], added)
+        self.assertEqual(['a', 'b'], removed)
+        self.assertEqual({'c'}, watch)
+
+    def test_callbacksForIntersectionAndSymmetricDifference(self):
+        added, removed = list(), list()
+        watch = msgcache.WatchSet({'a', 'b', 'c'}, on_add=added.append, on_remove=removed.append)
+        watch &= {'a', 'b', 'z'}
+        self.assertEqual(['c'], removed)
+        watch ^= {'b', 'd'}
+        self.assertEqual({'a', 'd'}, watch)
+        self.assertEqual(['d'], added)
+        self.assertEqual(['c', 'b'], removed)
+        watch.intersection_update(['d'])
+        watch.symmetric_difference_update(['e'])
+        self.assertEqual({'d', 'e'}, watch)
+        self.assertEqual(['d', 'e'], added)
+        self.assertEqual(['c', 'b', 'a'], removed)
+
+class TestByteBudget(unittest.TestCase):
+
+    def test_evictsBySize(self):
+        cache = msgcache.MessageCache(max_bytes=10, sizeof=lambda msg: 4)
+        for i in range(5):
+            cache.append(FakeMessage(str(i)))
+        self.assertEqual(['3', '4'], [msg.id for msg in cache])
+        self.assertEqual(8, cache.bytes)
+        self.assertEqual(3, cache.evictions)
+
+    def test_leastRecentlyUsed(self):
+        cache = msgcache.MessageCache(max_bytes=8, lru=True, sizeof=lambda msg: 4)
+        cache.append(FakeMessage('1'))
+        cache.append(FakeMessage('2'))
+        self.assertIsNotNone(cache.get('1'))
+        cache.append(FakeMessage('3'))
+        self.assertEqual(['1', '3'], [msg.id for msg in cache])
+        self.assertIsNone(cache.get('2'))
+        self.assertEqual(1, cache.stats()['hits'])
+        self.assertEqual(1, cache.stats()['misses'])
+
+    def test_pinSources(self):
+        role_messages = {'1': dict()}
+        cache = msgcache.MessageCache(maxlen=2, pin_sources=[role_messages])
+        cache.append(FakeMessage('1'))
+        cache.append(FakeMessage('2'))
+        cache.append(FakeMessage('3'))
+        self.assertEqual(['1', '3'], sorted(msg.id for msg in cache))
+        self.assertEqual(1, cache.stats()['pinned'])
@@ -0,0 +1,172 @@
+import unittest
+import asyncio
+from libs import outbound
+
+class FakeResponse:
+    def __init__(self, status, headers=dict()):
+        self.status = status
+        self.headers = headers
+
+class FakeHTTPException(Exception):
+    def __init__(self, response):
+        super().__init__('HTTP %s' % response.status)
+        self.response = response
+
+class FakeChannel:
+    def __init__(self, channel_id):
+        self.id = channel_id
+
+class FakeAPI:
+    '''Records when each call is made, and fails the first rate_limited calls with a 429'''
+
+    def __init__(self, loop, rate_limited=0, retry_after=None):
+        self.loop = loop
+        self.calls = list()  # (time, channel id, content)
+        self.rate_limited = rate_limited
+        self.retry_after = retry_after
+
+    async def send_message(self, destination, content=None):
+        if self.rate_limited > 0:
+            self.rate_limited -= 1
+            headers = {'Retry-After': str(self.retry_after)} if self.retry_after is not None else dict()
+            raise FakeHTTPException(FakeResponse(429, headers))
+        self.calls.append((self.loop.time(), destination.id, content))
+        return content
+
+class TestTokenBucket(unittest.TestCase):
+
+    def test_burstThenRate(self):
+        bucket = outbound.TokenBucket(2, 3, now=0)
+        for i in range(3):
+            self.assertEqual(0, bucket.wait_time(0))
+            bucket.take(0)
+        self.assertAlmostEqual(0.5, bucket.wait_time(0))
+        self.assertEqual(0, bucket.wait_time(0.5))
+
+    def test_pause(self):
+        bucket = outbound.TokenBucket(2, 3, now=0)
+        bucket.pause(1, 0)
+        self.assertAlmostEqual(1, bucket.wait_time(0))
+        self.assertEqual(0, bucket.wait_time(1))
+        bucket.take(1)
+        self.assertAlmostEqual(0.5, bucket.wait_time(1))
+
+class TestOutboundScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_loop = asyncio.get_event_loop() # restored afterwards, for tests which use the default loop
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(self.previous_loop)
+
+    def run_scheduler(self, scheduler, *futures):
+        task = self.loop.create_task(scheduler.run())
+        results = self.loop.run_until_complete(asyncio.gather(*futures, return_exceptions=True))
+        scheduler.stop()
+        self.loop.run_until_complete(task)
+        return results
+
+    def test_channelRateLimit(self):
+        api = FakeAPI(self.loop)
+        scheduler = outbound.OutboundScheduler(self.loop, channel_rate=20, channel_burst=2)
+        send = scheduler.wrap(api.send_message, outbound.channel_of_destination)
+        channel = FakeChannel('1')
+        results = self.run_scheduler(scheduler, *[send(channel, str(i)) for i in range(6)])
+        self.assertEqual([str(i) for i in range(6)], results)
+        times = [call[0] for call in api.calls]
+        # 2 at once, then one every 1/20s
+        self.assertGreaterEqual(times[-1] - times[0], 4 / 20 - 0.01)
+
+    def test_channelsAreIndependent(self):
+        api = FakeAPI(self.loop)
+        scheduler = outbound.OutboundScheduler(self.loop, channel_rate=1, channel_burst=1)
+        send = scheduler.wrap(api.send_message, outbound.channel_of_destination)
+        self.run_scheduler(scheduler, *[send(FakeChannel(str(i)), 'hi') for i in range(5)])
+        times = [call[0] for call in api.calls]
+        self.assertLess(times[-1] - times[0], 0.5)
+
+    def test_priority(self):
+        api = FakeAPI(self.loop)
+        scheduler = outbound.OutboundScheduler(self.loop)
+        send = scheduler.wrap(api.send_message, outbound.channel_of_destination)
+        channel = FakeChannel('1')
+        futures = [send(channel, 'low', priority=outbound.LOW), send(channel, 'high', priority=outbound.HIGH)]
+        self.run_scheduler(scheduler, *futures)
+        self.assertEqual(['high', 'low'], [call[2] for call in api.calls])
+
+    def test_createTask(self):
+        # add-ons run API calls as tasks, so scheduled methods must return coroutines like the ones they wrap
+        api = FakeAPI(self.loop)
+        scheduler = outbound.OutboundScheduler(self.loop)
+        send = scheduler.wrap(api.send_message, outbound.channel_of_destination)
+        task = self.loop.create_task(send(FakeChannel('1'), 'hi'))
+        self.assertEqual(['hi'], self.run_scheduler(scheduler, task))
+
+    def test_retryRateLimited(self):
+        api = FakeAPI(self.loop, rate_limited=2, retry_after=0.05)
+        scheduler = outbound.OutboundScheduler(self.loop)
+        send = scheduler.wrap(api.send_message, outbound.channel_of_destination)
+        self.assertEqual(['hi'], self.run_scheduler(scheduler, send(FakeChannel('1'), 'hi')))
+        self.assertEqual(2, scheduler.retries)
+
+    def test_giveUp(self):
+        api = FakeAPI(self.loop, rate_limited=10)
+        scheduler = outbound.OutboundScheduler(self.loop, max_retries=2, backoff=0.01)
+        send = scheduler.wrap(api.send_message, outbound.channel_of_destination)
+        result = self.run_scheduler(scheduler, send(FakeChannel('1'), 'hi'))[0]
+        self.assertIsInstance(result, FakeHTTPException)
+        self.assertEqual(2, scheduler.retries)
+
+class FakeMessage:
+    def __init__(self, msg_id):
+        self.id = msg_id
+
+class TestEditCoalescer(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_loop = asyncio.get_event_loop() # restored afterwards, for tests which use the default loop
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.edits = list()  # (message id, content)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(self.previous_loop)
+
+    async def edit_message(self, message, new_content=None):
+        await asyncio.sleep(0.01)
+        self.edits.append((message.id, new_content))
+        return new_content
+
+    def test_lastWriteWins(self):
+        coalescer = outbound.EditCoalescer(self.loop, self.edit_message, interval=0.1)
+        message = FakeMessage('1')
+
+        async def burst():
+            futures = list()
+            for i in range(20):
+                futures.append(self.loop.create_task(coalescer.edit(message, str(i))))
+                await asyncio.sleep(0.01)
+            return await asyncio.gather(*futures)
+        results = self.loop.run_until_complete(burst())
+        # the first edit is sent straight away, then at most one every 0.1s
+        self.assertLessEqual(len(self.edits), 4)
+        self.assertEqual(('1', '19'), self.edits[-1])
+        self.assertEqual('19', results[-1])
+        self.assertEqual(len(self.edits) + coalescer.coalesced, 20)
+
+    def test_messagesAreIndependent(self):
+        coalescer = outbound.EditCoalescer(self.loop, self.edit_message, interval=10)
+        futures = [coalescer.edit(FakeMessage(str(i)), 'hi') for i in range(3)]
+        self.loop.run_until_complete(asyncio.gather(*futures))
+        self.assertEqual([('0', 'hi'), ('1', 'hi'), ('2', 'hi')], sorted(self.edits))
+
+    def test_error(self):
+        async def broken_edit(message, new_content=None):
+            raise ValueError('oops')
+        coalescer = outbound.EditCoalescer(self.loop, broken_edit)
+        with self.assertRaises(ValueError):
+            self.loop.run_until_complete(coalescer.edit(FakeMessage('1'), 'hi'))
@@ -0,0 +1,142 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import threading
+import concurrent.futures
+from multiprocessing import Pipe
+from libs import plugin
+
+class EchoPlugin(plugin.ThreadedPlugin):
+    def threaded_action(self, queue, **kwargs):
+        queue.put({self.SEND_MESSAGE: {plugin.ARGS: ['channel', 'hello']}})
+
+class FetchPlugin(plugin.IOThreadPlugin):
+    def threaded_action(self, queue, **kwargs):
+        self.threads.add(threading.get_ident()) # attributes are shared, since it's not a separate process
+        queue.put({self.SEND_MESSAGE: {plugin.ARGS: ['channel', 'queued']}})
+        self.call_api(self.SEND_MESSAGE, 'channel', 'direct').result(timeout=1)
+
+class TestThreadedPlugin(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_loop = asyncio.get_event_loop() # restored afterwards, for tests which use the default loop
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.sent = list()
+        self.config = tempfile.NamedTemporaryFile('w', suffix='.config', delete=False)
+        # a long period, so that anything sent before it ends was delivered as it arrived
+        self.config.write('[DEFAULT]\nperiod = 100\nthreadedperiod = 0.05\nendprocess = terminate\n')
+        self.config.close()
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(self.previous_loop)
+        os.remove(self.config.name)
+
+    def api_methods(self):
+        async def send_message(*args, **kwargs):
+            self.sent.append((self.loop.time(), args))
+        async def nothing(*args, **kwargs):
+            pass
+        api_methods = {method: nothing for method in (plugin.Plugin.EDIT_MESSAGE, plugin.Plugin.ADD_REACTION, plugin.Plugin.REMOVE_REACTION, plugin.Plugin.SEND_TYPING, plugin.Plugin.SEND_FILE)}
+        api_methods[plugin.Plugin.SEND_MESSAGE] = send_message
+        return api_methods
+
+    def test_resultsDeliveredOnArrival(self):
+        echo = EchoPlugin(api_methods=self.api_methods(), config=self.config.name)
+        async def run():
+            task = self.loop.create_task(echo._action())
+            for i in range(100):
+                await asyncio.sleep(0.02)
+                if len(self.sent) >= 2:
+                    break
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            self.loop.run_until_complete(run())
+        finally:
+            echo._shutdown()
+        self.assertTrue(len(self.sent) >= 2, msg='Results weren\'t delivered before the next period')
+        self.assertEqual(('channel', 'hello'), self.sent[0][1])
+
+    def test_spawnDeferredOutsideMainThread(self):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            echo = executor.submit(EchoPlugin, api_methods=self.api_methods(), config=self.config.name).result()
+        self.assertIsNone(echo.process)
+        self.assertTrue(echo.spawn_pending)
+        async def run():
+            task = self.loop.create_task(echo._action())
+            for i in range(100):
+                await asyncio.sleep(0.02)
+                if len(self.sent) >= 1:
+                    break
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            self.loop.run_until_complete(run())
+        finally:
+            echo._shutdown()
+        self.assertFalse(echo.spawn_pending)
+        self.assertIsNotNone(echo.process)
+        self.assertEqual(('channel', 'hello'), self.sent[0][1])
+
+    def test_dispatchAction(self):
+        echo = EchoPlugin(should_spawn_thread=False, api_methods=self.api_methods(), config=self.config.name)
+        async def strict_send(channel, content):
+            self.sent.append((self.loop.time(), (channel, content)))
+        echo.action_methods[plugin.ACTION_CODES[plugin.Plugin.SEND_MESSAGE]] = strict_send
+        for item in ({plugin.Plugin.SEND_MESSAGE: {plugin.ARGS: ['channel', 'hi']}},
+                {plugin.Plugin.SEND_MESSAGE: {plugin.KWARGS: {'channel': 'channel'}}}, # missing content
+                {'not_an_action': {}},
+                'not a dict'):
+            for action in plugin.encode_actions(item):
+                echo.queue.put(action)
+        self.loop.run_until_complete(echo.action())
+        self.assertEqual([('channel', 'hi')], [sent[1] for sent in self.sent])
+        self.assertEqual(1, echo.ipc_stats[plugin.DROPPED])
+        self.assertEqual(2, echo.ipc_stats[plugin.INVALID])
+
+    def test_ioThreadPlugin(self):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        fetch = FetchPlugin(io_executor=executor, api_methods=self.api_methods(), config=self.config.name)
+        fetch.threads = set()
+        async def run():
+            task = self.loop.create_task(fetch._action())
+            for i in range(100):
+                await asyncio.sleep(0.02)
+                if len(self.sent) >= 4:
+                    break
+            fetch._shutdown()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        try:
+            self.loop.run_until_complete(run())
+        finally:
+            executor.shutdown()
+        self.assertIsNone(fetch.process)
+        self.assertEqual(1, len(fetch.threads))
+        self.assertNotIn(threading.get_ident(), fetch.threads)
+        contents = [sent[1][1] for sent in self.sent]
+        self.assertIn('queued', contents)
+        self.assertIn('direct', contents)
+
+class TestPipeQueue(unittest.TestCase):
+
+    def test_batching(self):
+        receiver, sender = Pipe(duplex=False)
+        queue = plugin.PipeQueue(sender, max_actions=3)
+        for i in range(4):
+            queue.put({plugin.Plugin.SEND_MESSAGE: {plugin.ARGS: ['channel', str(i)]}})
+        # a full frame is sent straight away, the rest when flushed
+        send_message = plugin.ACTION_CODES[plugin.Plugin.SEND_MESSAGE]
+        frame = plugin.decode_frame(receiver.recv_bytes())
+        self.assertEqual(3, len(frame))
+        self.assertEqual((send_message, ['channel', '0'], None), frame[0])
+        self.assertFalse(receiver.poll())
+        self.assertEqual(1, queue.qsize())
+        queue.flush()
+        self.assertTrue(queue.empty())
+        self.assertEqual([(send_message, ['channel', '3'], None)], plugin.decode_frame(receiver.recv_bytes()))
+        queue.flush()
+        self.assertFalse(receiver.poll())
@@ -0,0 +1,59 @@
+import unittest
+import os, tempfile, json, builtins
+from libs import profiler
+
+class TestStartupProfiler(unittest.TestCase):
+
+    def test_profile(self):
+        original_open = builtins.open
+        startup_profiler = profiler.StartupProfiler()
+        with startup_profiler.profile('hello', package='greetings', kind='command') as record:
+            with startup_profiler.phase(record, profiler.IMPORT_TIME):
+                with open(__file__) as file:
+                    file.read()
+        self.assertEqual('hello', record[profiler.NAME])
+        self.assertEqual(1, record[profiler.FILES_READ])
+        self.assertGreater(record[profiler.IMPORT_TIME], 0)
+        self.assertGreaterEqual(record[profiler.TOTAL_TIME], record[profiler.IMPORT_TIME])
+        self.assertEqual([record], startup_profiler.report()['addons'])
+        # open() isn't left wrapped (before Python 3.8) once startup is over
+        startup_profiler.finish()
+        self.assertIs(original_open, builtins.open)
+
+    def test_error(self):
+        startup_profiler = profiler.StartupProfiler()
+        with self.assertRaises(ValueError):
+            with startup_profiler.profile('broken'):
+                raise ValueError('oops')
+        startup_profiler.finish()
+        self.assertEqual(repr(ValueError('oops')), startup_profiler.report()['addons'][0][profiler.ERROR])
+
+    def test_disabled(self):
+        startup_profiler = profiler.StartupProfiler(enabled=False)
+        with startup_profiler.profile('hello') as record:
+            with startup_profiler.phase(record, profiler.IMPORT_TIME):
+                pass
+        self.assertIsNone(record)
+        self.assertEqual([], startup_profiler.report()['addons'])
+
+    def test_traceMemory(self):
+        startup_profiler = profiler.StartupProfiler(trace_memory=True)
+        with startup_profiler.profile('hungry') as record:
+            data = [bytearray(1024) for i in range(100)]
+        startup_profiler.finish()
+        self.assertGreater(record[profiler.MEMORY], 100*1024)
+
+    def test_save(self):
+        startup_profiler = profiler.StartupProfiler()
+        with startup_profiler.profile('slow'):
+            pass
+        with startup_profiler.profile('fast'):
+            pass
+        startup_profiler.finish()
+        startup_profiler.records[0][profiler.TOTAL_TIME] = 10
+        self.assertEqual('slow', startup_profiler.slowest(1)[0][profiler.NAME])
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'profile.json')
+            startup_profiler.save(filename)
+            with open(filename) as file:
+                self.assertEqual(2, len(json.load(file)['addons']))
@@ -0,0 +1,51 @@
+import unittest
+from collections import OrderedDict
+from libs import reaction, dispatch, discovery
+
+class FakeServer:
+    def __init__(self, server_id):
+        self.id = server_id
+
+class FakeMessage:
+    def __init__(self, server=None):
+        self.server = server
+
+class FakeReaction:
+    def __init__(self, emoji, server=None):
+        self.emoji = emoji
+        self.message = FakeMessage(server)
+
+class FakeUser:
+    id = '42'
+
+class AnyEmojiReaction(reaction.ErrorlessReaction):
+    def matches(self, reaction, user):
+        return True
+
+class ThumbsUpReaction(reaction.ReactionAddCommand):
+    def matches(self, reaction, user):
+        return True
+
+def make(reaction_class, emoji):
+    reaction_command = reaction_class.__new__(reaction_class) # skip __init__, which needs api methods and files
+    reaction_command._only_discord_exceptions = True
+    reaction_command.perms = None
+    reaction_command.emoji = emoji
+    return reaction_command
+
+class TestEmojiIndexed(unittest.TestCase):
+
+    def test_overriddenMatches(self):
+        self.assertTrue(reaction.ReactionAddCommand.emoji_indexed)
+        self.assertFalse(reaction.ErrorlessReaction.emoji_indexed)
+        errorless = make(AnyEmojiReaction, {'1': '👍'})
+        thumbs_up = make(ThumbsUpReaction, {'1': '👍'})
+        index = dispatch.ReactionIndex(OrderedDict([('errorless', errorless), ('thumbs_up', thumbs_up)]))
+        thumbs_down = FakeReaction('👎', FakeServer('2'))
+        # ErrorlessReaction's _matches() doesn't check the emoji, so it must still be asked
+        self.assertTrue(errorless._matches(thumbs_down, FakeUser()))
+        self.assertEqual(['errorless'], index.candidates(thumbs_down))
+        self.assertEqual(['errorless', 'thumbs_up'], index.candidates(FakeReaction('👍', FakeServer('1'))))
+        # and its emoji map isn't cached for lazy loading either
+        self.assertEqual(dict(), discovery.describe_emoji(errorless))
+        self.assertEqual({discovery.EMOJI: {'1': '👍'}}, discovery.describe_emoji(thumbs_up))
@@ -0,0 +1,41 @@
+import unittest
+from libs import registry
+
+class TestAddOnRegistry(unittest.TestCase):
+
+    def test_alphabeticalOrder(self):
+        addons = registry.AddOnRegistry()
+        for name in ['mike', 'alpha', 'zulu', 'echo']:
+            addons[name] = name.upper()
+        self.assertEqual(['alpha', 'echo', 'mike', 'zulu'], list(addons))
+        self.assertEqual(['ALPHA', 'ECHO', 'MIKE', 'ZULU'], list(addons.values()))
+
+    def test_replaceKeepsOrder(self):
+        addons = registry.AddOnRegistry(beta=1, alpha=2)
+        snapshot = addons.snapshot()
+        addons['beta'] = 3
+        self.assertIs(snapshot, addons.snapshot())
+        self.assertEqual([('alpha', 2), ('beta', 3)], list(addons.items()))
+
+    def test_delete(self):
+        addons = registry.AddOnRegistry(alpha=1, beta=2, gamma=3)
+        del addons['beta']
+        self.assertNotIn('beta', addons)
+        self.assertEqual(('alpha', 'gamma'), addons.snapshot())
+        self.assertRaises(KeyError, addons.__delitem__, 'beta')
+
+    def test_mutationWhileIterating(self):
+        addons = registry.AddOnRegistry(alpha=1, beta=2)
+        for name in addons:
+            addons[name+'2'] = 0
+        self.assertEqual(4, len(addons))
+
+    def test_versionChanges(self):
+        addons = registry.AddOnRegistry()
+        version = addons.version
+        addons['alpha'] = 1
+        self.assertNotEqual(version, addons.version)
+        version = addons.version
+        addons.clear()
+        self.assertNotEqual(version, addons.version)
+        self.assertEqual(0, len(addons))
@@ -0,0 +1,130 @@
+import unittest
+import asyncio
+from libs import scheduler
+
+class FakePlugin:
+    '''Records when action() runs, sleeping for duration each time'''
+
+    def __init__(self, loop, period, duration=0, config=None):
+        self.loop = loop
+        self.period = period
+        self.duration = duration
+        self.config = config
+        self.shutting_down = False
+        self.runs = list()
+        self.errors = list()
+
+    async def action(self):
+        self.runs.append(self.loop.time())
+        if self.duration:
+            await asyncio.sleep(self.duration)
+
+    def _on_action_error(self, error):
+        self.errors.append(error)
+
+class BrokenPlugin(FakePlugin):
+    async def action(self):
+        self.runs.append(self.loop.time())
+        raise ValueError('broken')
+
+class TestPluginScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_loop = asyncio.get_event_loop() # restored afterwards, for tests which use the default loop
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(self.previous_loop)
+
+    def run_plugins(self, plugin_scheduler, plugins, seconds):
+        async def run():
+            runner = self.loop.create_task(plugin_scheduler.run())
+            tasks = [self.loop.create_task(plugin_scheduler.schedule(plugin)) for plugin in plugins]
+            await asyncio.sleep(seconds)
+            for plugin in plugins:
+                plugin.shutting_down = True
+                plugin_scheduler.unschedule(plugin)
+            await asyncio.wait_for(asyncio.gather(*tasks), 1)
+            plugin_scheduler.stop()
+            await asyncio.wait_for(runner, 1)
+        self.loop.run_until_complete(run())
+
+    def test_period(self):
+        plugin_scheduler = scheduler.PluginScheduler(self.loop)
+        fast = FakePlugin(self.loop, 0.05)
+        slow = FakePlugin(self.loop, 0.2)
+        self.run_plugins(plugin_scheduler, [fast, slow], 0.43)
+        self.assertTrue(8 <= len(fast.runs) <= 10, msg='Fast plugin ran %s times' % len(fast.runs))
+        self.assertEqual(3, len(slow.runs))
+        # runs are a period after the previous scheduled run, so they don't drift
+        self.assertAlmostEqual(0.4, slow.runs[2] - slow.runs[0], delta=0.03)
+
+    def test_periodNever(self):
+        plugin_scheduler = scheduler.PluginScheduler(self.loop)
+        never = FakePlugin(self.loop, -1)
+        self.run_plugins(plugin_scheduler, [never], 0.05)
+        self.assertEqual(0, len(never.runs))
+
+    def test_error(self):
+        plugin_scheduler = scheduler.PluginScheduler(self.loop)
+        broken = BrokenPlugin(self.loop, 0.05)
+        self.run_plugins(plugin_scheduler, [broken], 0.12)
+        self.assertTrue(len(broken.runs) >= 2, msg='Broken plugin stopped being scheduled')
+        self.assertEqual(len(broken.runs), len(broken.errors))
+
+    def test_missedRunsSkip(self):
+        plugin_scheduler = scheduler.PluginScheduler(self.loop, policy=scheduler.SKIP)
+        slow = FakePlugin(self.loop, 0.05, duration=0.12)
+        self.run_plugins(plugin_scheduler, [slow], 0.2)
+        self.assertEqual(2, len(slow.runs))
+        self.assertAlmostEqual(0.15, slow.runs[1] - slow.runs[0], delta=0.03)
+
+    def test_missedRunsCoalesce(self):
+        plugin_scheduler = scheduler.PluginScheduler(self.loop, policy=scheduler.SKIP)
+        slow = FakePlugin(self.loop, 0.05, duration=0.12, config={scheduler.MISSED_RUNS: scheduler.COALESCE})
+        self.run_plugins(plugin_scheduler, [slow], 0.2)
+        self.assertEqual(2, len(slow.runs))
+        self.assertAlmostEqual(0.12, slow.runs[1] - slow.runs[0], delta=0.03)
+
+    def test_maxConcurrent(self):
+        plugin_scheduler = scheduler.PluginScheduler(self.loop, max_concurrent=1)
+        first = FakePlugin(self.loop, 1, duration=0.1)
+        second = FakePlugin(self.loop, 1, duration=0.1)
+        self.run_plugins(plugin_scheduler, [first, second], 0.15)
+        self.assertEqual(1, len(first.runs))
+        self.assertEqual(1, len(second.runs))
+        self.assertAlmostEqual(0.1, second.runs[0] - first.runs[0], delta=0.03)
+
+    def test_info(self):
+        plugin_scheduler = scheduler.PluginScheduler(self.loop)
+        plugin = FakePlugin(self.loop, 10)
+        self.assertIsNone(plugin_scheduler.info(plugin))
+        async def check():
+            runner = self.loop.create_task(plugin_scheduler.run())
+            task = self.loop.create_task(plugin_scheduler.schedule(plugin))
+            await asyncio.sleep(0.05)
+            info = plugin_scheduler.info(plugin)
+            plugin_scheduler.unschedule(plugin)
+            await asyncio.wait_for(task, 1)
+            plugin_scheduler.stop()
+            await asyncio.wait_for(runner, 1)
+            return info
+        info = self.loop.run_until_complete(check())
+        self.assertEqual(1, info['runs'])
+        self.assertAlmostEqual(10, info['next_run'], delta=0.1)
+        self.assertEqual(scheduler.COALESCE, info['policy'])
+
+    def test_stopCancelsRunning(self):
+        plugin_scheduler = scheduler.PluginScheduler(self.loop)
+        hung = FakePlugin(self.loop, 1, duration=10)
+        async def check():
+            runner = self.loop.create_task(plugin_scheduler.run())
+            task = self.loop.create_task(plugin_scheduler.schedule(hung))
+            await asyncio.sleep(0.05)
+            plugin_scheduler.stop()
+            await asyncio.wait_for(asyncio.gather(runner, task), 1)
+        self.loop.run_until_complete(check())
+        self.assertEqual(1, len(hung.runs))
+        self.assertEqual(set(), plugin_scheduler.running)
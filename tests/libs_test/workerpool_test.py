@@ -0,0 +1,101 @@
+import unittest
+import asyncio
+import os
+import time
+from libs import workerpool, plugin
+
+class CounterPlugin(plugin.ThreadedPlugin):
+    threaded_state = ('count',)
+
+    def threaded_action(self, queue, step=1):
+        self.count += step
+        queue.put({plugin.Plugin.SEND_MESSAGE: {plugin.ARGS: ['channel', str(self.count)], plugin.KWARGS: {'pid': os.getpid()}}})
+
+class SlowPlugin(plugin.ThreadedPlugin):
+    threaded_state = tuple()
+
+    def threaded_action(self, queue):
+        time.sleep(0.2)
+
+def make_counter(step):
+    counter = CounterPlugin.__new__(CounterPlugin)  # skip __init__, which needs a config
+    counter.count = 0
+    counter.threaded_kwargs = {'step': step}
+    return counter
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.previous_loop = asyncio.get_event_loop() # restored afterwards, for tests which use the default loop
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(self.previous_loop)
+
+    def test_runThreadedActionInProcess(self):
+        actions, state = workerpool.run_threaded_action(CounterPlugin, {'count': 1}, {'step': 2})
+        self.assertEqual({'count': 3}, state)
+        self.assertEqual(1, len(actions))
+        self.assertEqual(['channel', '3'], actions[0][plugin.Plugin.SEND_MESSAGE][plugin.ARGS])
+
+    def test_stateIsExplicit(self):
+        counter = make_counter(1)
+        counter.other = 'not sent'
+        self.assertEqual({'count': 0}, counter.get_threaded_state())
+        counter.set_threaded_state({'count': 5})
+        self.assertEqual(5, counter.count)
+
+    def test_sharedPool(self):
+        pool = workerpool.WorkerPool(max_workers=1)
+        self.assertFalse(pool.stats()['started'])
+        counters = [make_counter(1), make_counter(10)]
+        async def run():
+            results = list()
+            for i in range(2):
+                results.append(await asyncio.gather(*[pool.run_threaded_action(self.loop, counter) for counter in counters]))
+            return results
+        try:
+            results = self.loop.run_until_complete(run())
+        finally:
+            pool.shutdown()
+        # state is carried between runs
+        self.assertEqual(2, counters[0].count)
+        self.assertEqual(20, counters[1].count)
+        self.assertEqual(['channel', '20'], results[1][1][0][plugin.Plugin.SEND_MESSAGE][plugin.ARGS])
+        # every run happened in the same (shared) worker process, not this one
+        pids = {actions[0][plugin.Plugin.SEND_MESSAGE][plugin.KWARGS]['pid'] for result in results for actions in result}
+        self.assertEqual(1, len(pids))
+        self.assertNotIn(os.getpid(), pids)
+        self.assertEqual(4, pool.stats()['submitted'])
+
+    def test_shutdownCancelsPending(self):
+        pool = workerpool.WorkerPool(max_workers=1)
+        slow = SlowPlugin.__new__(SlowPlugin)
+        slow.threaded_kwargs = dict()
+        async def run():
+            tasks = [self.loop.create_task(pool.run_threaded_action(self.loop, slow)) for i in range(5)]
+            await asyncio.sleep(0.1)
+            pool.shutdown()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+        results = self.loop.run_until_complete(run())
+        self.assertIsNone(pool.executor)
+        self.assertTrue(any(isinstance(result, asyncio.CancelledError) for result in results))
+        self.assertEqual(set(), pool.pending)
+
+    def test_recycle(self):
+        pool = workerpool.WorkerPool(max_workers=1)
+        counter = make_counter(1)
+        def pid_of(actions):
+            return actions[0][plugin.Plugin.SEND_MESSAGE][plugin.KWARGS]['pid']
+        try:
+            first = self.loop.run_until_complete(pool.run_threaded_action(self.loop, counter))
+            pool.recycle()
+            self.assertFalse(pool.stats()['started'])
+            second = self.loop.run_until_complete(pool.run_threaded_action(self.loop, counter))
+        finally:
+            pool.shutdown()
+        # a new worker process, with the state carried over
+        self.assertNotEqual(pid_of(first), pid_of(second))
+        self.assertEqual(2, counter.count)
@@ -0,0 +1,218 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import discord
+import bot as botlib
+from libs import testlib, msgcache, journal
+
+class FakeUser:
+    name = 'Idea'
+
+class FakeMessage:
+    def __init__(self, msg_id, channel_id='1'):
+        self.id = msg_id
+        self.channel = discord.Object(channel_id)
+        self.content = 'message %s' % msg_id
+
+class StubBot(botlib.Bot):
+    '''Just enough of a Bot to handle READY, without logging in or loading any config'''
+
+    def __init__(self, folder, reload_messages=0):
+        self.loop = asyncio.new_event_loop()
+        self.log = testlib.testlog
+        self.connection = discord.state.ConnectionState(None, None, None, 100, loop=self.loop)
+        self.data_config = {'reloadmessages': str(reload_messages)}
+        self.max_message_bytes = None
+        self.role_messages = dict()
+        self.unsaved_message_changes = 0
+        self.message_save_threshold = 0
+        self.message_save_period = 600
+        self.message_save_event = asyncio.Event(loop=self.loop)
+        self.always_watch_messages = msgcache.WatchSet({botlib.LOADING_WARNING}, on_add=self._on_watch_add, on_remove=self._on_watch_remove)
+        self.message_journal = journal.MessageJournal(os.path.join(folder, 'messages.journal'))
+        self.watch_journal = journal.MessageJournal(os.path.join(folder, 'watchmessages.journal'))
+        self.channel_index = dict()
+        self.rehydrate_concurrency = 1
+
+    def ready(self):
+        # what discord.py does on READY, before dispatching on_ready
+        self.connection.clear()
+        self.connection.user = FakeUser()
+        self.loop.run_until_complete(self.on_ready())
+
+class FakeResponse:
+    status = 404
+    reason = 'Not Found'
+
+class FakeHTTP:
+    '''Serves message history from a dict of channel id -> list of int message ids, recording each request'''
+
+    def __init__(self, history):
+        self.history = history
+        self.requests = list()
+
+    async def logs_from(self, channel_id, limit, before=None, after=None, around=None):
+        self.requests.append(('logs_from', after))
+        page = [msg_id for msg_id in sorted(self.history[channel_id]) if msg_id > int(after)][:limit]
+        return [{'id': str(msg_id)} for msg_id in reversed(page)]  # newest first, like Discord
+
+    async def get_message(self, channel_id, message_id):
+        self.requests.append(('get_message', message_id))
+        if int(message_id) not in self.history[channel_id]:
+            raise discord.NotFound(FakeResponse(), 'Unknown Message')
+        return {'id': message_id}
+
+class RehydrateBot(StubBot):
+    '''Just enough of a Bot to retrieve saved messages from a fake channel history'''
+
+    def __init__(self, folder, history):
+        super().__init__(folder)
+        self.http = FakeHTTP(history)
+        self.connection._create_message = lambda channel, **data: FakeMessage(data['id'], channel_id=channel.id)
+        for channel_id in history:
+            self.channel_index[channel_id] = (discord.Object('server'), discord.Object(channel_id))
+
+    def rehydrate(self, saved_messages):
+        return [(msg.channel.id, msg.id) for msg in self.loop.run_until_complete(self.rehydrate_messages(saved_messages))]
+
+class RehydrateTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def rehydrate(self, history, saved_messages):
+        bot = RehydrateBot(self.folder.name, history)
+        try:
+            return bot.rehydrate(saved_messages), bot.http.requests
+        finally:
+            bot.loop.close()
+
+    def test_clustered(self):
+        saved = [('1', str(msg_id)) for msg_id in range(1050, 1000, -1)]
+        result, requests = self.rehydrate({'1': list(range(1000, 1300))}, saved)
+        self.assertEqual(saved, result)
+        self.assertEqual([('logs_from', '1000')], requests)
+
+    def test_clusteredOverSeveralPages(self):
+        saved = [('1', str(msg_id)) for msg_id in range(1000, 1250)]
+        result, requests = self.rehydrate({'1': list(range(1000, 1300))}, saved)
+        self.assertEqual(saved, result)
+        self.assertEqual([('logs_from', '999'), ('logs_from', '1099'), ('logs_from', '1199')], requests)
+
+    def test_sparse(self):
+        # each needed message is more than a page away from the next, so every request gets one of them
+        saved = [('1', '1000'), ('1', '1500'), ('1', '2000')]
+        result, requests = self.rehydrate({'1': list(range(1000, 2001))}, saved)
+        self.assertEqual(saved, result)
+        self.assertEqual([('logs_from', '999'), ('logs_from', '1499'), ('get_message', '2000')], requests)
+
+    def test_deleted(self):
+        # deleted messages are left out, whether they're alone or in a page
+        history = {'1': [msg_id for msg_id in range(1000, 1050) if msg_id not in (1010, 1049)], '2': [5000]}
+        saved = [('1', '1000'), ('1', '1010'), ('1', '1049'), ('2', '5000'), ('2', '6000')]
+        result, requests = self.rehydrate(history, saved)
+        self.assertEqual([('1', '1000'), ('2', '5000')], result)
+        self.assertCountEqual([('logs_from', '999'), ('logs_from', '4999')], requests)  # channels are retrieved concurrently
+        result, requests = self.rehydrate({'1': [1000]}, [('1', '1001')])
+        self.assertEqual(list(), result)
+        self.assertEqual([('get_message', '1001')], requests)
+
+    def test_privateAndUnknownChannelsSkipped(self):
+        bot = RehydrateBot(self.folder.name, {'1': [1000]})
+        try:
+            bot.channel_index['1'] = (None, discord.Object('1'))  # private channel
+            self.assertEqual(list(), bot.rehydrate([('1', '1000'), ('2', '2000')]))
+            self.assertEqual(list(), bot.http.requests)
+        finally:
+            bot.loop.close()
+
+class ReadyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.saved_messages = botlib._messages
+
+    def tearDown(self):
+        botlib._messages = self.saved_messages
+        self.folder.cleanup()
+
+    def test_cacheReinstalledOnReady(self):
+        bot = StubBot(self.folder.name)
+        try:
+            bot.install_message_cache()
+            bot.ready()
+            new = FakeMessage('2')
+            bot.connection.messages.append(new)  # as discord.py does for new messages
+            self.assertIsInstance(bot.connection.messages, msgcache.MessageCache)
+            self.assertIs(new, bot.connection._get_message('2'))
+        finally:
+            bot.loop.close()
+
+    def test_messagesKeptOnReconnect(self):
+        bot = StubBot(self.folder.name, reload_messages=1)
+        try:
+            old = FakeMessage('1')
+            bot.get_message_cache().append(old)
+            botlib._messages = bot.messages  # as saved by save_messages()
+            bot.ready()
+            self.assertIs(old, bot.connection._get_message('1'))
+            self.assertNotIn(botlib.LOADING_WARNING, bot.always_watch_messages)
+        finally:
+            bot.loop.close()
+
+class SaveBehindTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.saved_messages = botlib._messages
+        self.bot = StubBot(self.folder.name)
+        self.bot.message_save_threshold = 3
+        for msg_id in ('1', '2'):
+            self.bot.get_message_cache().append(FakeMessage(msg_id))
+
+    def tearDown(self):
+        self.bot.loop.close()
+        botlib._messages = self.saved_messages
+        self.folder.cleanup()
+
+    def saved(self):
+        return journal.MessageJournal(self.bot.message_journal.filename).load()
+
+    def run_saver(self, *changes):
+        '''marks each of changes, letting the save loop run in between'''
+        async def run():
+            task = self.bot.loop.create_task(self.bot._save_messages_loop())
+            for change in changes:
+                self.bot.mark_messages_changed(change)
+                await asyncio.sleep(0.05)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self.bot.loop.run_until_complete(run())
+
+    def test_savedOnThreshold(self):
+        self.bot.always_watch_messages.discard(botlib.LOADING_WARNING)
+        self.run_saver(1, 1)
+        self.assertEqual(list(), self.saved())
+        self.assertEqual(2, self.bot.unsaved_message_changes)
+        self.run_saver(1)
+        self.assertEqual([('1', '1'), ('1', '2')], self.saved())
+        self.assertEqual(0, self.bot.unsaved_message_changes)
+
+    def test_savedAfterPeriod(self):
+        self.bot.always_watch_messages.discard(botlib.LOADING_WARNING)
+        self.bot.message_save_period = 0.02
+        self.run_saver(1)
+        self.assertEqual([('1', '1'), ('1', '2')], self.saved())
+
+    def test_notSavedWhileLoading(self):
+        self.run_saver(3)
+        self.assertEqual(list(), self.saved())
+        # the changes are kept until loading is done
+        self.assertEqual(3, self.bot.unsaved_message_changes)
+        self.bot.always_watch_messages.discard(botlib.LOADING_WARNING)
+        self.bot.flush_messages()
+        self.assertEqual([('1', '1'), ('1', '2')], self.saved())
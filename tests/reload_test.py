@@ -0,0 +1,126 @@
+import unittest
+import asyncio
+import os
+import tempfile
+from collections import OrderedDict
+import bot as botlib
+from libs import testlib, command, addon, discovery
+
+class StubCommand(command.Command):
+    def __init__(self, version):
+        self.version = version # no api methods or perms needed
+        self.shut_down = False
+
+    def _shutdown(self):
+        self.shut_down = True
+
+class StubPool:
+    def __init__(self):
+        self.recycles = 0
+
+    def recycle(self):
+        self.recycles += 1
+
+class StubBot(botlib.Bot):
+    '''Just enough of a Bot to reload add-ons, without logging in or loading any config'''
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.log = testlib.testlog
+        self.addon_cache = discovery.DiscoveryCache(None)
+        self.addon_reload_failures = dict()
+        self.commands = OrderedDict()
+        self.reactions = OrderedDict()
+        self.plugins = OrderedDict()
+        self.packages = dict()
+        self.plugin_tasks = dict()
+        self.quarantined = dict()
+        self.consecutive_timeouts = dict()
+        self.worker_pool = None
+        self.inits = list() # names of the add-ons initialized, in order
+
+    def _init_addon_in_thread(self, filename, name, package=None, reload=False):
+        # stands in for importing the add-on file, which is broken if it says so
+        path = os.path.join('addons', package or '', filename)
+        self.inits.append(name)
+        self.quarantined_while_initializing = self.is_quarantined(botlib.COMMANDS, name)
+        with open(path) as file:
+            content = file.read()
+        if 'broken' in content:
+            raise SyntaxError('broken add-on')
+        self.addon_cache.put(path, addon.COMMAND)
+        return botlib.COMMANDS, StubCommand(content)
+
+class ReloadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.folder = tempfile.TemporaryDirectory()
+        os.chdir(self.folder.name)
+        os.mkdir('addons')
+        self.bot = StubBot()
+        self.write('hello.py', 'v1')
+        self.write('other.py', 'v1')
+        self.assertEqual(['hello', 'other'], self.reload())
+        self.bot.inits.clear()
+
+    def tearDown(self):
+        self.bot.loop.close()
+        os.chdir(self.cwd)
+        self.folder.cleanup()
+
+    def write(self, filename, content):
+        path = os.path.join('addons', filename)
+        with open(path, 'w') as file:
+            file.write(content)
+        # make sure the change is seen, even if the file's mtime doesn't
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000))
+
+    def reload(self):
+        return self.bot.loop.run_until_complete(self.bot.reload_changed_addons())
+
+    def test_onlyChangedReloaded(self):
+        self.assertEqual(list(), self.reload())
+        self.assertEqual(list(), self.bot.inits)
+        self.write('hello.py', 'v2')
+        self.assertEqual(['hello'], self.reload())
+        self.assertEqual(['hello'], self.bot.inits)
+
+    def test_swap(self):
+        old = self.bot.commands['hello']
+        self.write('hello.py', 'v2')
+        self.reload()
+        self.assertTrue(old.shut_down)
+        # the shut down add-on got no events while the new one was being initialized
+        self.assertTrue(self.bot.quarantined_while_initializing)
+        self.assertFalse(self.bot.is_quarantined(botlib.COMMANDS, 'hello'))
+        self.assertEqual('v2', self.bot.commands['hello'].version)
+        self.assertEqual(['hello', 'other'], list(self.bot.commands))
+
+    def test_failedReloadQuarantinesOld(self):
+        old = self.bot.commands['hello']
+        self.write('hello.py', 'broken')
+        self.assertEqual(list(), self.reload())
+        # the old add-on is shut down, so it stays registered but gets no events
+        self.assertIs(old, self.bot.commands['hello'])
+        self.assertTrue(self.bot.is_quarantined(botlib.COMMANDS, 'hello'))
+        self.assertIn(os.path.join('addons', 'hello.py'), self.bot.addon_reload_failures)
+        # a file which is still broken isn't tried again, until it changes
+        self.reload()
+        self.assertEqual(['hello'], self.bot.inits)
+        self.write('hello.py', 'v3')
+        self.assertEqual(['hello'], self.reload())
+        self.assertEqual('v3', self.bot.commands['hello'].version)
+        self.assertFalse(self.bot.is_quarantined(botlib.COMMANDS, 'hello'))
+        self.assertEqual(dict(), self.bot.addon_reload_failures)
+
+    def test_pooledAddOnRecyclesWorkers(self):
+        self.bot.worker_pool = StubPool()
+        self.write('other.py', 'v2')
+        self.reload()
+        self.assertEqual(0, self.bot.worker_pool.recycles)
+        self.bot.commands['hello'].worker_pool = self.bot.worker_pool # as if it ran in the worker pool
+        self.write('hello.py', 'v2')
+        self.reload()
+        self.assertEqual(1, self.bot.worker_pool.recycles)
@@ -1,6 +1,8 @@
 import unittest
 import bot as botlib
-from libs import testlib
+from libs import testlib, profiler
+
+MAX_ADDON_LOAD_TIME = 5  # seconds
 
 class StartupTest(unittest.TestCase):
 
@@ -13,3 +15,10 @@ class StartupTest(unittest.TestCase):
     def test_startup(self):
         bot = botlib.Bot('./data/config.config', testlib.testlog)
         bot._shutdown()
+
+    def test_startupProfile(self):
+        bot = botlib.Bot('./data/config.config', testlib.testlog, startup_profile=1)
+        report = bot.startup_report()
+        bot._shutdown()
+        slow = ['%s (%.2fs)' % (record[profiler.NAME], record[profiler.TOTAL_TIME]) for record in report['addons'] if record[profiler.TOTAL_TIME] > MAX_ADDON_LOAD_TIME]
+        self.assertEqual(list(), slow, 'Add-ons took more than %ss to load' % MAX_ADDON_LOAD_TIME)
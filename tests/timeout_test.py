@@ -0,0 +1,115 @@
+import unittest
+import asyncio
+import os
+import tempfile
+import bot as botlib
+from libs import testlib, registry, metrics, reaction
+
+class StubBot(botlib.Bot):
+    '''Just enough of a Bot to run add-on actions, without logging in or loading any config'''
+
+    def __init__(self, action_timeout=None, quarantine_timeouts=3, quarantine_period=600):
+        self.loop = asyncio.new_event_loop()
+        self.log = testlib.testlog
+        self.action_timeout = action_timeout
+        self.action_timeouts = dict()
+        self.quarantine_timeouts = quarantine_timeouts
+        self.quarantine_period = quarantine_period
+        self.consecutive_timeouts = dict()
+        self.quarantined = dict()
+        self.reactions = registry.AddOnRegistry()
+        self.reaction_add_index = None
+        self.reaction_remove_index = None
+        self.metrics = metrics.MetricsRegistry()
+
+class HungReaction(reaction.ReactionAddCommand):
+    def matches(self, rxn, user):
+        return True
+
+    def action(self, rxn, user):
+        yield from asyncio.sleep(10)
+
+class FakeMessage:
+    server = None
+
+class FakeReaction:
+    emoji = '👍'
+    message = FakeMessage()
+
+class TimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        self.bot = StubBot(action_timeout=0.05)
+        self.cancelled = 0
+
+    def tearDown(self):
+        self.bot.loop.close()
+
+    async def hang(self):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+    async def finish(self):
+        pass
+
+    def run_action(self, action, name='slow'):
+        self.bot.loop.run_until_complete(self.bot._run_action(botlib.COMMANDS, name, None, action))
+
+    def test_hungActionCancelled(self):
+        self.assertRaises(asyncio.TimeoutError, self.run_action, self.hang())
+        self.assertEqual(1, self.cancelled)
+        self.assertFalse(self.bot.is_quarantined(botlib.COMMANDS, 'slow'))
+
+    def test_quarantine(self):
+        for i in range(2):
+            self.assertRaises(asyncio.TimeoutError, self.run_action, self.hang())
+        # an action which finishes in time resets the count
+        self.run_action(self.finish())
+        for i in range(3):
+            self.assertFalse(self.bot.is_quarantined(botlib.COMMANDS, 'slow'))
+            self.assertRaises(asyncio.TimeoutError, self.run_action, self.hang())
+        self.assertTrue(self.bot.is_quarantined(botlib.COMMANDS, 'slow'))
+        self.assertFalse(self.bot.is_quarantined(botlib.REACTIONS, 'slow'))
+
+    def test_release(self):
+        self.bot.quarantine_period = 0.05
+        for i in range(3):
+            self.assertRaises(asyncio.TimeoutError, self.run_action, self.hang())
+        self.assertTrue(self.bot.is_quarantined(botlib.COMMANDS, 'slow'))
+        self.bot.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertFalse(self.bot.is_quarantined(botlib.COMMANDS, 'slow'))
+        self.assertNotIn((botlib.COMMANDS, 'slow'), self.bot.consecutive_timeouts)
+
+    def test_addonConfigOverrides(self):
+        with tempfile.TemporaryDirectory() as directory:
+            config = os.path.join(directory, 'slow.config')
+            with open(config, 'w') as file:
+                file.write('[DEFAULT]\nactiontimeout = 0\n')
+            self.assertIsNone(self.bot.read_action_timeout(config))
+            no_timeout = os.path.join(directory, 'other.config')
+            with open(no_timeout, 'w') as file:
+                file.write('[DEFAULT]\nperiod = 1\n')
+            self.assertIs(False, self.bot.read_action_timeout(no_timeout))
+        self.assertIs(False, self.bot.read_action_timeout(None))
+        self.bot.action_timeouts['slow'] = None
+        self.run_action(self.finish())
+        self.assertIsNone(self.bot.get_action_timeout('slow'))
+        self.assertEqual(0.05, self.bot.get_action_timeout('other'))
+
+    def test_reactionTimeoutReported(self):
+        hung = HungReaction.__new__(HungReaction) # skip __init__, which needs api methods and files
+        hung.perms = None
+        hung.emoji = None
+        self.bot.reactions['hung'] = hung
+        rxn = FakeReaction()
+        for i in range(3):
+            # the timeout is reported through on_reaction_add_error(), not raised
+            self.bot.loop.run_until_complete(self.bot.on_reaction_add(rxn, 'user'))
+        self.assertEqual(3, self.bot.metrics.get(botlib.REACTIONS, 'hung').errors)
+        self.assertTrue(self.bot.is_quarantined(botlib.REACTIONS, 'hung'))
+        # quarantined reactions aren't dispatched to any more
+        self.bot.loop.run_until_complete(self.bot.on_reaction_add(rxn, 'user'))
+        self.assertEqual(3, self.bot.metrics.get(botlib.REACTIONS, 'hung').errors)